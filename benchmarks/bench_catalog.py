@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+# Catalog size benchmark for check_bacula_jobs.py: generates synthetic Bacula client and job tables of growing size
+# into a scratch PostgreSQL database and times the stages of a check against each of them.
+#
+#   bench_catalog.py [-n RUNS] [--sizes N,N,...] [--clients N] [--job-names N] [--years N] [--levels SPEC]
+#                    [--status SPEC] [--seed N] [--days N] [--json] [-H HOST] [-p PORT] [-U DBUSER] [-P DBPASS] [-D DB]
+#
+# The database (default bacula_bench) is created if missing and its client and job tables are replaced for every size,
+# hence an existing database is only used if it was created by this script.
+import argparse
+import datetime
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+from check_bacula import jobs
+
+# Tagging table of databases created by this script
+MARKER = "check_bacula_bench"
+
+SCHEMA = """
+DROP TABLE IF EXISTS public.job, public.client;
+CREATE TABLE public.client (clientid serial PRIMARY KEY, name text NOT NULL, uname text NOT NULL DEFAULT '',
+                            autoprune smallint DEFAULT 0, fileretention bigint DEFAULT 0, jobretention bigint DEFAULT 0);
+CREATE TABLE public.job (jobid serial PRIMARY KEY, job text NOT NULL, name text NOT NULL, type char(1) NOT NULL,
+                         level char(1) NOT NULL, clientid integer DEFAULT 0, jobstatus char(1) NOT NULL,
+                         schedtime timestamp without time zone, starttime timestamp without time zone,
+                         endtime timestamp without time zone, realendtime timestamp without time zone,
+                         jobtdate bigint DEFAULT 0, volsessionid integer DEFAULT 0, volsessiontime integer DEFAULT 0,
+                         jobfiles integer DEFAULT 0, jobbytes bigint DEFAULT 0, readbytes bigint DEFAULT 0,
+                         joberrors integer DEFAULT 0, jobmissingfiles integer DEFAULT 0, poolid integer DEFAULT 0,
+                         filesetid integer DEFAULT 0, priorjobid integer DEFAULT 0, purgedfiles smallint DEFAULT 0,
+                         hasbase smallint DEFAULT 0);
+"""
+
+# Indexes of the Bacula catalog schema on the job table
+INDEXES = """
+CREATE INDEX job_name_idx ON public.job (name);
+CREATE INDEX job_jobtdate_idx ON public.job (jobtdate);
+"""
+
+JOB_COLUMNS = ("job", "name", "type", "level", "clientid", "jobstatus", "schedtime", "starttime", "endtime",
+               "realendtime", "jobtdate", "jobfiles", "jobbytes")
+
+
+#------------------------------------------------------------------------------
+# Parses a distribution like 'T=90,E=4' into (values, weights)
+def parseWeights(spec):
+  values, weights = [], []
+  for item in spec.split(","):
+    value, weight = item.split("=")
+    values.append(value.strip())
+    weights.append(float(weight))
+  return values, weights
+
+
+#------------------------------------------------------------------------------
+def connect(args, db):
+  jobs.importDriver()
+  cnx = jobs.psycopg2.connect(host=args.host, port=args.port, user=args.dbuser, password=args.dbpass, database=db)
+  cnx.autocommit = True
+  return cnx
+
+
+#------------------------------------------------------------------------------
+# Creates the benchmark database if missing, refuses to use any other database
+def prepareDatabase(args):
+  cnx = connect(args, "postgres")
+  cursor = cnx.cursor()
+  cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (args.db,))
+  created = cursor.rowcount == 0
+  if created: cursor.execute(f'CREATE DATABASE "{args.db}"')
+  cnx.close()
+
+  cnx = connect(args, args.db)
+  cursor = cnx.cursor()
+  if created:
+    cursor.execute(f"CREATE TABLE {MARKER} (created timestamp DEFAULT now())")
+  else:
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (MARKER,))
+    if not cursor.fetchone()[0]:
+      sys.exit(f"database '{args.db}' was not created by {os.path.basename(__file__)}, refusing to replace its tables")
+  return cnx
+
+
+#------------------------------------------------------------------------------
+# Yields the job table rows, jobs of each client and job name evenly spread over the history, the last one ending
+# about now
+def generateJobs(args, size, now):
+  rnd = random.Random(args.seed)
+  levels, levelWeights = parseWeights(args.levels)
+  status, statusWeights = parseWeights(args.status)
+  names = args.clients * args.job_names
+  history = datetime.timedelta(days=365 * args.years)
+  for i in range(size):
+    n = i % names
+    perName = size // names + (1 if n < size % names else 0)
+    age = history * (perName - 1 - i // names) / max(perName, 1)
+    clientID = n // args.job_names + 1
+    name = f"client{clientID}-job{n % args.job_names}"
+    st = rnd.choices(status, statusWeights)[0]
+    sched = now - age - datetime.timedelta(seconds=rnd.randint(600, 7200))
+    end = None if st in "RC" else sched + datetime.timedelta(seconds=rnd.randint(60, 3600))
+    yield (f"{name}.{i}", name, "B", rnd.choices(levels, levelWeights)[0], clientID, st, sched, sched, end, end,
+           0 if end is None else int(end.timestamp()), rnd.randint(0, 100000), rnd.randint(0, 10 ** 10))
+
+
+#------------------------------------------------------------------------------
+def copyRows(cursor, table, columns, rows, chunk=100000):
+  def field(v):
+    return "\\N" if v is None else str(v)
+
+  buf = io.StringIO()
+  count = 0
+  for row in rows:
+    buf.write("\t".join([field(v) for v in row]) + "\n")
+    count += 1
+    if count % chunk == 0:
+      buf.seek(0)
+      cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+      buf = io.StringIO()
+  buf.seek(0)
+  cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+
+
+#------------------------------------------------------------------------------
+def populate(cnx, args, size):
+  cursor = cnx.cursor()
+  cursor.execute(SCHEMA)
+  copyRows(cursor, "public.client", ("name",), [(f"client{i + 1}-fd",) for i in range(args.clients)])
+  copyRows(cursor, "public.job", JOB_COLUMNS, generateJobs(args, size, datetime.datetime.now()))
+  cursor.execute(INDEXES)
+  cursor.execute("ANALYZE public.client, public.job")
+  cursor.close()
+
+
+#------------------------------------------------------------------------------
+def timed(runs, func):
+  times = []
+  for i in range(runs):
+    t = time.perf_counter()
+    func()
+    times.append(time.perf_counter() - t)
+  return statistics.median(times)
+
+
+#------------------------------------------------------------------------------
+# Times the stages of a check of one client, the complete single check and a batch check of all clients
+def measure(args):
+  bacula = jobs.TBacula(f"{args.host}:{args.port}//{args.db}", args.dbuser, args.dbpass)
+  client = f"client{args.clients // 2 + 1}"
+  nagios = jobs.TNagios(exitOnResult=False)
+  check = jobs.TClient(bacula, client, None, nagios, fetch=False)
+  rows = []
+
+  def fetchJobs():
+    rows.clear()
+    bacula.Copy("check_bacula_batch_jobs", ([check.ClientID], check.Days, None, None), rows.extend)
+
+  def evaluate():
+    check.Nagios = jobs.TNagios(exitOnResult=False)
+    check.Summaries = {}
+    for row in rows: check.addJob(row, jobs.TJob.FromText)
+    try:
+      check.GetBackupStatus()
+    except jobs.TNagiosResult:
+      pass
+
+  def singleCheck():
+    try:
+      jobs.TClient(bacula, client, None, jobs.TNagios(exitOnResult=False)).GetBackupStatus()
+    except jobs.TNagiosResult:
+      pass
+
+  results = {"client resolution": timed(args.runs, check.getClient)}
+  results["job fetch"] = timed(args.runs, fetchJobs)
+  results["evaluation"] = timed(args.runs, evaluate)
+  results["output formatting"] = timed(args.runs, check.Nagios.FormatResult)
+  results["single check"] = timed(args.runs, singleCheck)
+  results["batch check"] = timed(args.runs, lambda: jobs.TClientBatch(bacula, None, None).GetBackupStatus([]))
+  results["jobs fetched"] = len(rows)
+  bacula.DBConnection.close()
+  return results
+
+
+#------------------------------------------------------------------------------
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-n", "--runs", default=5, type=int, help="Runs per measurement, the median is reported (default=5)")
+  parser.add_argument("--sizes", default="10000,100000,1000000,10000000",
+                      help="Comma separated job table sizes (default=10000,100000,1000000,10000000)")
+  parser.add_argument("--clients", default=200, type=int, help="Number of clients (default=200)")
+  parser.add_argument("--job-names", default=3, type=int, help="Number of job names per client (default=3)")
+  parser.add_argument("--years", default=3, type=float, help="Years of job history (default=3)")
+  parser.add_argument("--levels", default="F=1,D=2,I=11", help="Job level distribution (default=F=1,D=2,I=11)")
+  parser.add_argument("--status", default="T=92,E=3,f=1,A=1,W=2,R=1",
+                      help="Job status distribution (default=T=92,E=3,f=1,A=1,W=2,R=1)")
+  parser.add_argument("--seed", default=1, type=int, help="Random seed (default=1)")
+  parser.add_argument("-d", "--days", default=7, type=int, help="Days checked (default=7)")
+  parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+  parser.add_argument("-H", "--host", default="localhost", help="PostgreSQL host (default=localhost)")
+  parser.add_argument("-p", "--port", default=5432)
+  parser.add_argument("-U", "--dbuser", default="postgres")
+  parser.add_argument("-P", "--dbpass")
+  parser.add_argument("-D", "--db", default="bacula_bench", help="Scratch database (default=bacula_bench)")
+  args = parser.parse_args()
+  jobs.args = argparse.Namespace(days=args.days, norunwarn=False, history=0)
+
+  cnx = prepareDatabase(args)
+  results = {"parameters": {k: v for k, v in vars(args).items() if k not in ("dbpass", "json")}, "sizes": {}}
+  for size in sorted([int(s) for s in args.sizes.split(",")]):
+    t = time.perf_counter()
+    populate(cnx, args, size)
+    generation = time.perf_counter() - t
+    if not args.json: print(f"{size} jobs (generated in {generation:.1f} s)")
+    stages = measure(args)
+    results["sizes"][str(size)] = {k: v if isinstance(v, int) else round(v, 6) for k, v in stages.items()}
+    results["sizes"][str(size)]["generation"] = round(generation, 3)
+    if not args.json:
+      for name, value in stages.items():
+        print(f"  {name:<22}{value:8d}" if isinstance(value, int) else f"  {name:<22}{value * 1000:8.1f} ms")
+  cnx.close()
+
+  if args.json:
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+  main()
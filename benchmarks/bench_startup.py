@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+# Startup benchmark for check_bacula_jobs.py: measures interpreter start, module import, an early failing run and,
+# given catalog connection options, the time to the first catalog query, each in a fresh interpreter.
+#
+#   bench_startup.py [-n RUNS] [--json] [-H HOST] [-p PORT] [-U DBUSER] [-P DBPASS] [-D DB]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+PLUGIN = os.path.join(ROOT, "check_bacula_jobs.py")
+
+# Runs in a fresh interpreter, prints its internal timings as JSON
+FIRST_QUERY = """
+import json, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, {root!r})
+from check_bacula import jobs
+t1 = time.perf_counter()
+jobs.importDriver()
+t2 = time.perf_counter()
+bacula = jobs.TBacula({uri!r}, {user!r}, {password!r})
+cnx = bacula.DBConnection
+t3 = time.perf_counter()
+cursor = cnx.cursor()
+cursor.execute("SELECT 1")
+cursor.fetchone()
+t4 = time.perf_counter()
+print(json.dumps({{"import": t1 - t0, "driver import": t2 - t1, "connect": t3 - t2, "first query": t4 - t3}}))
+"""
+
+IMPORT = """
+import sys
+sys.path.insert(0, {root!r})
+from check_bacula import jobs
+if "psycopg2" in sys.modules: sys.exit("psycopg2 imported with the module")
+"""
+
+
+#------------------------------------------------------------------------------
+def timeRun(cmd, expectStatus=0):
+  t = time.perf_counter()
+  p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+  elapsed = time.perf_counter() - t
+  if p.returncode != expectStatus:
+    raise RuntimeError(f"{' '.join(cmd[:3])}... returned {p.returncode}: {p.stderr.strip() or p.stdout.strip()}")
+  return elapsed, p.stdout
+
+
+#------------------------------------------------------------------------------
+def median(runs, cmd, expectStatus=0):
+  return statistics.median([timeRun(cmd, expectStatus)[0] for i in range(runs)])
+
+
+#------------------------------------------------------------------------------
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-n", "--runs", default=10, type=int, help="Runs per measurement, the median is reported (default=10)")
+  parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+  parser.add_argument("-H", "--host", help="Bacula database host, enables the time to first query measurement")
+  parser.add_argument("-p", "--port", default=5432)
+  parser.add_argument("-U", "--dbuser", default="postgres")
+  parser.add_argument("-P", "--dbpass")
+  parser.add_argument("-D", "--db", default="bacula")
+  args = parser.parse_args()
+
+  python = sys.executable
+  timeRun([python, "-c", IMPORT.format(root=ROOT)])  # Warm up, writes the byte code cache
+  results = {
+    "interpreter": median(args.runs, [python, "-c", "pass"]),
+    "module import": median(args.runs, [python, "-c", IMPORT.format(root=ROOT)]),
+    "argument error": median(args.runs, [python, PLUGIN], expectStatus=2),
+  }
+
+  if args.host is not None:
+    code = FIRST_QUERY.format(root=ROOT, uri=f"{args.host}:{args.port}//{args.db}", user=args.dbuser,
+                              password=args.dbpass)
+    walls, stages = [], []
+    for i in range(args.runs):
+      wall, out = timeRun([python, "-c", code])
+      walls.append(wall)
+      stages.append(json.loads(out))
+    results["time to first query"] = statistics.median(walls)
+    for stage in stages[0].keys():
+      results[f"  {stage}"] = statistics.median([s[stage] for s in stages])
+
+  if args.json:
+    print(json.dumps({k.strip(): round(v, 6) for k, v in results.items()}, indent=2))
+  else:
+    for name, value in results.items():
+      print(f"{name:<24}{value * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+  main()
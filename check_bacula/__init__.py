@@ -0,0 +1 @@
+# Nagios / Icinga(2) plugin monitoring Bacula backup jobs, see check_bacula_jobs.py
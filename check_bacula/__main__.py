@@ -0,0 +1,4 @@
+# python3 -m check_bacula: same as check_bacula_jobs.py
+from check_bacula.jobs import main
+
+main()
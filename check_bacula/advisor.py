@@ -0,0 +1,154 @@
+# Catalog index advisor (check_bacula_jobs.py --explain / --advise), explains the statements a check issues and
+# proposes the indexes for index (only) scans, kept apart as it is not needed for regular checks
+from __future__ import annotations
+import json
+import typing
+from typing import AnyStr, List, Optional
+
+from check_bacula import jobs
+from check_bacula.jobs import Nagios, TBacula, TClient, TNagios, TPerfData
+
+
+###############################################################################
+# Runs EXPLAIN (ANALYZE, BUFFERS) on the registered statements with the
+# parameters a check of the given client would use
+class TQueryAdvisor:
+
+  # Statements explained, in the order a check issues them. check_bacula_summary_table (--summary-table) is only
+  # explained where the table is installed, check_bacula_job_log with the jobids of check_bacula_summary_id.
+  Explained = ["check_bacula_summary", "check_bacula_summary_id", "check_bacula_client", "check_bacula_summary_table",
+               "check_bacula_new_jobs", "check_bacula_baseline_jobs", "check_bacula_history", "check_bacula_batch_jobs",
+               "check_bacula_batch_last_jobs", "check_bacula_job_log", "check_bacula_pools"]
+
+  # Indexes for the check statements: name -> (table, definition). The stock Bacula schema only indexes job.name and
+  # job.jobtdate, the job indexes cover the job columns fetched so that jobs are read by index only scans, the second
+  # one for checks of a single job (-J) which filter on lower(job.name).
+  Indexes = {
+    "check_bacula_client_name_idx": ("client", "ON public.client (lower(name))"),
+    "check_bacula_job_client_idx": ("job", "ON public.job (clientid, realendtime DESC, jobid DESC)"
+                                           " INCLUDE (name, job, level, jobstatus, jobfiles, jobbytes, schedtime, endtime)"
+                                           " WHERE type = 'B'"),
+    "check_bacula_job_name_idx": ("job", "ON public.job (clientid, lower(name), realendtime DESC, jobid DESC)"
+                                         " INCLUDE (name, job, level, jobstatus, jobfiles, jobbytes, schedtime, endtime)"
+                                         " WHERE type = 'B'"),
+  }
+
+  def __init__(self, bacula: TBacula, client: TClient):
+    self.Bacula = bacula
+    self.Client = client
+    self.Plans: typing.Dict[AnyStr, typing.Dict[AnyStr, typing.Any]] = {}  # Statement name -> EXPLAIN JSON output
+    self.Invalid: List[AnyStr] = []  # Advised indexes left invalid by a failed concurrent creation
+    self.Created: List[AnyStr] = []  # Advised indexes created by CreateIndexes()
+
+  # ------------------------------------------------------------------------------
+  def Explain(self):
+    from check_bacula.media import TMediaCheck  # Registers check_bacula_pools
+
+    self.Client.getClient()
+    params = self.Client.StatementParams()
+    cursor = self.Bacula.DBConnection.cursor()
+    self.Bacula.Execute(cursor, "check_bacula_summary_id", params["check_bacula_summary_id"])
+    jobIDs = sorted({row[11] for row in cursor.fetchall() if row[11] is not None})  # Last column of TClient.JobColumns
+    params["check_bacula_job_log"] = (jobIDs, jobs.TJobLog.Relevant, 5)
+    params["check_bacula_pools"] = (TMediaCheck.UsableStates, None, None)
+    cursor.execute("SELECT to_regclass('public.check_bacula_summary_state') IS NOT NULL")
+    summaryTable = cursor.fetchone()[0]
+    for name in TQueryAdvisor.Explained:
+      if name == "check_bacula_summary_table":
+        if not summaryTable: continue
+        sql = jobs.SummaryTableSQL
+      else:
+        types, sql = TBacula.Statements[name]
+      cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", params[name])
+      plan = cursor.fetchone()[0]
+      self.Plans[name] = (json.loads(plan) if isinstance(plan, str) else plan)[0]
+    cursor.close()
+    self.Bacula.DBConnection.rollback()
+
+  # ------------------------------------------------------------------------------
+  # Returns the scans of a plan as (node type, relation, index) tuples
+  @staticmethod
+  def Scans(plan: typing.Dict[AnyStr, typing.Any]) -> List[typing.Tuple[AnyStr, AnyStr, Optional[AnyStr]]]:
+    scans = []
+    if "Relation Name" in plan: scans.append((plan["Node Type"], plan["Relation Name"], plan.get("Index Name")))
+    for child in plan.get("Plans", []): scans.extend(TQueryAdvisor.Scans(child))
+    return scans
+
+  # ------------------------------------------------------------------------------
+  # Names of the advised indexes not existing in the catalog or invalid (left over by a failed concurrent creation,
+  # such indexes are maintained but never used), the invalid ones are kept in Invalid
+  def MissingIndexes(self) -> List[AnyStr]:
+    cursor = self.Bacula.DBConnection.cursor()
+    cursor.execute("SELECT c.relname, i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid"
+                   " JOIN pg_namespace n ON n.oid = c.relnamespace WHERE n.nspname = 'public' AND c.relname = ANY(%s)",
+                   (list(TQueryAdvisor.Indexes.keys()),))
+    valid = dict(cursor.fetchall())
+    cursor.close()
+    self.Bacula.DBConnection.rollback()
+    self.Invalid = [name for name in TQueryAdvisor.Indexes.keys() if valid.get(name) is False]
+    return [name for name in TQueryAdvisor.Indexes.keys() if not valid.get(name, False)]
+
+  # ------------------------------------------------------------------------------
+  # Index creation cannot run inside a transaction, hence in autocommit mode. Invalid indexes are dropped first, as
+  # CREATE INDEX IF NOT EXISTS would keep them. Created indexes are added to Created as they succeed.
+  def CreateIndexes(self, names: List[AnyStr]):
+    cnx = self.Bacula.DBConnection
+    cnx.rollback()
+    cnx.autocommit = True
+    cursor = cnx.cursor()
+    try:
+      for name in names:
+        table, definition = TQueryAdvisor.Indexes[name]
+        if name in self.Invalid: cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS public.{name}")
+        cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}")
+        cursor.execute(f"ANALYZE public.{table}")
+        self.Created.append(name)
+    finally:
+      cursor.close()
+      cnx.autocommit = False
+
+  # ------------------------------------------------------------------------------
+  def ReturnResult(self, advise: bool, create: bool):
+    try:
+      self.Explain()
+    except jobs.psycopg2.Error as e:
+      Nagios.ReturnStatus(TNagios.UNKNOWN, f"explain failed: {str(e).strip()}")
+
+    seqScans = set()
+    for name, plan in self.Plans.items():
+      scans = TQueryAdvisor.Scans(plan["Plan"])
+      seqScans.update([relation for nodeType, relation, index in scans if nodeType == "Seq Scan"])
+      text = ", ".join([f"{nodeType} on {relation}" + ("" if index is None else f" using {index}")
+                        for nodeType, relation, index in scans])
+      Nagios.LongOutput.append(f"{name}: planning {plan['Planning Time']:.3f} ms, execution {plan['Execution Time']:.3f} ms,"
+                               f" shared buffers hit {plan['Plan'].get('Shared Hit Blocks', 0)}"
+                               f" read {plan['Plan'].get('Shared Read Blocks', 0)}; {text}")
+      Nagios.AddPerf([TPerfData(f"{name} planning", round(plan["Planning Time"], 3), "ms"),
+                      TPerfData(f"{name} execution", round(plan["Execution Time"], 3), "ms")])
+
+    Nagios.SetStatus(TNagios.SUCCESS, f"{len(self.Plans)} statements explained")
+    if len(seqScans) > 0:
+      Nagios.SetStatus(TNagios.SUCCESS, f"sequential scans on {', '.join(sorted(seqScans))}", append=', ')
+
+    if advise:
+      missing = self.MissingIndexes()
+      failure = None
+      if create and len(missing) > 0:
+        try:
+          self.CreateIndexes(missing)
+        except jobs.psycopg2.Error as e:
+          failure = str(e).strip()
+      for name in missing:
+        table, definition = TQueryAdvisor.Indexes[name]
+        state = "created" if name in self.Created else "invalid" if name in self.Invalid else "missing"
+        Nagios.LongOutput.append(f"{state} index: CREATE INDEX CONCURRENTLY {name} {definition};")
+      if failure is not None:
+        Nagios.ReturnStatus(TNagios.CRITICAL, f"index creation failed after {len(self.Created)} indexes created: {failure}",
+                            append=', ')
+      if create and len(missing) > 0:
+        Nagios.SetStatus(TNagios.SUCCESS, f"{len(missing)} indexes created", append=', ')
+      elif len(missing) > 0:
+        Nagios.SetStatus(TNagios.WARNING, f"{len(missing)} indexes missing", append=', ')
+      else:
+        Nagios.SetStatus(TNagios.SUCCESS, "all advised indexes exist", append=', ')
+    Nagios.ReturnResult()
@@ -0,0 +1,160 @@
+# Resident check daemon (check_bacula_jobs.py --daemon SOCKET), kept apart so that regular checks do not import the
+# socket server machinery
+from __future__ import annotations
+import argparse
+import contextlib
+import copy
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+import typing
+from typing import AnyStr, List
+
+from check_bacula import jobs
+from check_bacula.jobs import (Nagios, TBacula, TClient, TNagios, TNagiosResult, buildParser, checkArgs,
+                               importDriver, parseThresholds)
+
+
+###############################################################################
+# Pool of catalog connections for the check daemon, every connection has the
+# statements registered with TBacula.Register() prepared
+class TBaculaPool:
+
+  def __init__(self, bacula: TBacula, size: int):
+    self.Bacula = bacula
+    importDriver()
+    try:
+      self._pool = jobs.psycopg2.pool.ThreadedConnectionPool(1, size, **bacula.ConnectParams())
+    except Exception:
+      Nagios.ReturnStatus(TNagios.CRITICAL,
+                          f"could not connect to postgresql database '{bacula.DBName}' @ {bacula.DBHost}:{bacula.DBPort}")
+    self._prepared = set()  # id() of the pooled connections with prepared statements
+
+  # ------------------------------------------------------------------------------
+  # Lends a pooled connection as TBacula instance, connections failing with a database error are dropped from the pool
+  @contextlib.contextmanager
+  def Lease(self) -> typing.Iterator[TBacula]:
+    cnx = self._pool.getconn()
+    lease = copy.copy(self.Bacula)
+    lease._cnx = cnx
+    lease.Prepared = id(cnx) in self._prepared
+    broken = False
+    try:
+      if not lease.Prepared:
+        lease.PrepareStatements()
+        self._prepared.add(id(cnx))
+      yield lease
+    except jobs.psycopg2.Error:
+      broken = True
+      raise
+    finally:
+      if not broken and not cnx.closed:
+        try:
+          cnx.rollback()
+        except jobs.psycopg2.Error:
+          broken = True
+      if broken or cnx.closed: self._prepared.discard(id(cnx))
+      self._pool.putconn(cnx, close=broken or bool(cnx.closed))
+
+  # ------------------------------------------------------------------------------
+  def Close(self):
+    self._pool.closeall()
+
+
+###############################################################################
+# Argument parser for check requests, reports errors instead of exiting
+class TRequestParser(argparse.ArgumentParser):
+
+  def __init__(self, *args, **kwargs):
+    kwargs["add_help"] = False  # Help would be printed by the daemon
+    super().__init__(*args, **kwargs)
+
+  def error(self, message):
+    raise RuntimeError(message)
+
+  def exit(self, status=0, message=None):
+    raise RuntimeError("unexpected arguments" if message is None else message.strip())
+
+
+###############################################################################
+# Handles one check request: a single JSON line {"argv": [...]} holding the
+# plugin arguments, answered by a JSON line {"status": <exit code>, "output": ...}
+class TCheckRequestHandler(socketserver.StreamRequestHandler):
+
+  def handle(self):
+    try:
+      request = json.loads(self.rfile.readline())
+      argv = [str(x) for x in request["argv"]]
+    except (ValueError, KeyError, TypeError):
+      nagios = TNagios(exitOnResult=False)
+      nagios.SetStatus(TNagios.UNKNOWN, "malformed check request")
+    else:
+      nagios = self.server.Check(argv)
+    output = "\n".join([nagios.FormatResult()] + nagios.LongOutput)
+    self.wfile.write((json.dumps({"status": nagios.Status, "output": output}) + "\n").encode())
+
+
+###############################################################################
+# Resident check daemon answering check requests on a Unix domain socket,
+# see check_bacula_jobs_client.py
+class TCheckDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  daemon_threads = True
+
+  # Options of check requests, the daemon only runs the job check of a single client. Requests giving any other option
+  # are rejected instead of answered without it.
+  RequestOptions = {"host", "port", "dbuser", "dbpass", "db", "client", "job", "days", "norunwarn", "warn", "crit",
+                    "history"}
+
+  def __init__(self, socketPath: AnyStr, pool: TBaculaPool, size: int):
+    if os.path.exists(socketPath): os.unlink(socketPath)  # Left over by a previous instance
+    super().__init__(socketPath, TCheckRequestHandler)
+    self.SocketPath = socketPath
+    self.Pool = pool
+    self.Parser = buildParser(TRequestParser)
+    self._slots = threading.BoundedSemaphore(size)  # Never wait for a pooled connection
+
+  # ------------------------------------------------------------------------------
+  def Check(self, argv: List[AnyStr]) -> TNagios:
+    nagios = TNagios(exitOnResult=False)
+    try:
+      # Database options not given stay None (argparse keeps attributes already set) and are taken from the daemon
+      request = self.Parser.parse_args(argv, argparse.Namespace(host=None, port=None, dbuser=None, db=None))
+      bacula = self.Pool.Bacula
+      for option, given, own in [("-H", request.host, bacula.DBHost), ("-p", request.port, bacula.DBPort),
+                                 ("-U", request.dbuser, bacula.DBUser), ("-D", request.db, bacula.DBName)]:
+        if given is not None and str(given) != str(own):
+          raise RuntimeError(f"{option} {given} differs from the catalog of the daemon ({own})")
+      unsupported = [action.option_strings[-1] for action in self.Parser._actions
+                     if action.dest not in TCheckDaemon.RequestOptions and len(action.option_strings) > 0 and
+                     getattr(request, action.dest) != action.default]
+      if len(unsupported) > 0:
+        raise RuntimeError(f"{', '.join(unsupported)} not supported in check requests")
+      request = checkArgs(self.Parser, request)
+      nagios.AddTheshold(parseThresholds(TNagios.WARNING, request.warn))
+      nagios.AddTheshold(parseThresholds(TNagios.CRITICAL, request.crit))
+      with self._slots, self.Pool.Lease() as bacula:
+        client = TClient(bacula, request.client, request.job, nagios, days=request.days, norunwarn=request.norunwarn,
+                         history=request.history)
+        client.GetBackupStatus()
+    except TNagiosResult:
+      pass
+    except RuntimeError as e:
+      nagios.SetStatus(TNagios.UNKNOWN, f"invalid check request: {e}")
+    except jobs.psycopg2.Error as e:
+      nagios.SetStatus(TNagios.CRITICAL, f"catalog query failed: {str(e).strip()}")
+    return nagios
+
+  # ------------------------------------------------------------------------------
+  def Run(self):
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+      self.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      self.server_close()
+      self.Pool.Close()
+      if os.path.exists(self.SocketPath): os.unlink(self.SocketPath)
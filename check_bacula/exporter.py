@@ -0,0 +1,209 @@
+# Prometheus exporter mode (check_bacula_jobs.py --exporter [HOST:]PORT), serving the state of all checked clients as
+# metrics, kept apart so that regular checks do not import the HTTP server machinery
+from __future__ import annotations
+import http.server
+import signal
+import sys
+import threading
+import time
+import typing
+from typing import AnyStr, List, Optional
+
+from check_bacula import jobs
+from check_bacula.jobs import (TBacula, TClient, TClientBatch, TClientIDCache, TJob, TNagios, TNagiosResult,
+                               TThreshold, importDriver)
+
+
+###############################################################################
+# Evaluates all clients with one batch query and renders the results as
+# Prometheus / OpenMetrics text. The rendered payload is kept for Interval
+# seconds, concurrent scrapes wait for the running evaluation instead of
+# querying the catalog again.
+class TMetricsExporter:
+
+  # Gauges: name -> help text, in output order
+  Metrics = {
+    "bacula_up": "Whether the last evaluation could query the catalog",
+    "bacula_evaluation_duration_seconds": "Time spent querying the catalog and evaluating the clients",
+    "bacula_evaluation_timestamp_seconds": "Time of the last evaluation",
+    "bacula_client_status": "Check status of the client (0=OK, 1=WARNING, 2=CRITICAL, 3=UNKNOWN)",
+    "bacula_job_status": "Severity of the last job (0=OK, 1=WARNING, 2=CRITICAL, 3=UNKNOWN)",
+    "bacula_job_ok_jobs": "Successful jobs in the checked timeframe",
+    "bacula_job_last_end_timestamp_seconds": "End time of the last job",
+    "bacula_job_last_success_timestamp_seconds": "End time of the last successful job",
+    "bacula_job_last_success_age_seconds": "Seconds since the end of the last successful job",
+    "bacula_job_last_full_success_age_seconds": "Seconds since the end of the last successful full job",
+    "bacula_job_last_success_bytes": "Bytes written by the last successful job",
+    "bacula_job_last_success_files": "Files written by the last successful job",
+    "bacula_job_duration_seconds": "Duration of the last successful job of the job history",
+    "bacula_job_duration_p50_seconds": "Median duration of the successful jobs of the job history",
+    "bacula_job_duration_p90_seconds": "90th percentile duration of the successful jobs of the job history",
+    "bacula_job_duration_ratio": "Ratio of the last duration to the median duration of the previous jobs",
+    "bacula_job_bytes_per_second": "Throughput of the last successful job of the job history",
+    "bacula_job_files_per_second": "Files per second of the last successful job of the job history",
+  }
+
+  # Job history metric (see TJobHistory.Metrics()) -> gauge
+  HistoryMetrics = {"duration": "bacula_job_duration_seconds", "duration p50": "bacula_job_duration_p50_seconds",
+                    "duration p90": "bacula_job_duration_p90_seconds", "duration ratio": "bacula_job_duration_ratio",
+                    "bytes rate": "bacula_job_bytes_per_second", "files rate": "bacula_job_files_per_second"}
+
+  ContentType = "text/plain; version=0.0.4; charset=utf-8"
+  OpenMetricsContentType = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+  def __init__(self, bacula: TBacula, clientNames: Optional[List[AnyStr]], jobName: Optional[AnyStr],
+               thresholds: List[TThreshold], interval: float, ids: Optional[TClientIDCache] = None, history: int = 0):
+    self.Bacula = bacula
+    self.ClientNames = clientNames  # None for all clients registered in the catalog
+    self.JobName = jobName
+    self.Thresholds = thresholds
+    self.Interval = interval
+    self.IDs = ids
+    self.History = history  # Days of job history analysed, 0 for none
+    self._payload: Optional[AnyStr] = None
+    self._rendered = 0.0  # time.monotonic() of the payload
+    self._lock = threading.Lock()
+
+  # ------------------------------------------------------------------------------
+  # Returns the rendered metrics, evaluating the clients if the payload is older than Interval seconds
+  def Payload(self) -> AnyStr:
+    with self._lock:
+      if self._payload is None or time.monotonic() - self._rendered >= self.Interval:
+        self._payload = self.render()
+        self._rendered = time.monotonic()
+      return self._payload
+
+  # ------------------------------------------------------------------------------
+  # Label values are escaped as the exposition format expects
+  @staticmethod
+  def sample(name: AnyStr, labels: typing.Dict[AnyStr, AnyStr], value: typing.Union[int, float]) -> AnyStr:
+    text = ",".join([f'{k}="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+                     for k, v in labels.items()])
+    return f"{name}{{{text}}} {value}" if len(text) > 0 else f"{name} {value}"
+
+  # ------------------------------------------------------------------------------
+  @staticmethod
+  def timestamp(job: Optional[TJob]) -> Optional[float]:
+    return None if job is None or job.EndTime is None else job.EndTime.timestamp()
+
+  # ------------------------------------------------------------------------------
+  # Samples of one client: its check status and per job name its last jobs and job history metrics
+  def clientSamples(self, name: AnyStr, client: Optional[TClient], result: TNagios, now: float,
+                    samples: typing.Dict[AnyStr, List[AnyStr]]):
+    sample = TMetricsExporter.sample
+    samples["bacula_client_status"].append(sample("bacula_client_status", {"client": name}, result.Status))
+    if client is None: return
+    for jobName in sorted(client.Summaries.keys()):
+      summary = client.Summaries[jobName]
+      labels = {"client": name, "job": jobName}
+      if summary.Last is not None:
+        samples["bacula_job_status"].append(sample("bacula_job_status", labels,
+                                                   summary.Last.Status.GetSeverity(client.NoRunWarn)))
+        end = TMetricsExporter.timestamp(summary.Last)
+        if end is not None: samples["bacula_job_last_end_timestamp_seconds"].append(
+          sample("bacula_job_last_end_timestamp_seconds", labels, round(end, 3)))
+      samples["bacula_job_ok_jobs"].append(sample("bacula_job_ok_jobs", labels, summary.OKCount))
+      end = TMetricsExporter.timestamp(summary.LastSuccess)
+      if end is not None:
+        samples["bacula_job_last_success_timestamp_seconds"].append(
+          sample("bacula_job_last_success_timestamp_seconds", labels, round(end, 3)))
+        samples["bacula_job_last_success_age_seconds"].append(
+          sample("bacula_job_last_success_age_seconds", labels, round(now - end, 3)))
+        samples["bacula_job_last_success_bytes"].append(
+          sample("bacula_job_last_success_bytes", labels, summary.LastSuccess.Bytes or 0))
+        samples["bacula_job_last_success_files"].append(
+          sample("bacula_job_last_success_files", labels, summary.LastSuccess.Files or 0))
+      end = TMetricsExporter.timestamp(summary.LastFullSuccess)
+      if end is not None:
+        samples["bacula_job_last_full_success_age_seconds"].append(
+          sample("bacula_job_last_full_success_age_seconds", labels, round(now - end, 3)))
+
+    for jobName in sorted(client.HistoryLevels.keys()):
+      level = client.HistoryLevels[jobName]
+      labels = {"client": name, "job": jobName, "level": level}
+      for metric, value in client.Histories[(jobName, level)].Metrics().items():
+        gauge = TMetricsExporter.HistoryMetrics[metric]
+        samples[gauge].append(sample(gauge, labels, round(value, 3)))
+
+  # ------------------------------------------------------------------------------
+  # Evaluates all clients, a failing catalog is reported by bacula_up 0 and reconnected on the next evaluation
+  def render(self) -> AnyStr:
+    samples: typing.Dict[AnyStr, List[AnyStr]] = {name: [] for name in TMetricsExporter.Metrics.keys()}
+    start = time.monotonic()
+    up = 1
+    try:
+      batch = TClientBatch(self.Bacula, self.ClientNames, self.JobName, ids=self.IDs, history=self.History)
+      results = batch.GetBackupStatus(self.Thresholds)
+      self.Bacula.DBConnection.rollback()
+      now = time.time()
+      for name, result in results.items():
+        self.clientSamples(name, batch.Clients.get(name), result, now, samples)
+    except TNagiosResult as e:
+      up = 0
+      print(e.Nagios.FormatResult(), file=sys.stderr, flush=True)
+    except jobs.psycopg2.Error as e:
+      up = 0
+      print(f"catalog query failed: {str(e).strip()}", file=sys.stderr, flush=True)
+    if up == 0:
+      if self.Bacula._cnx is not None and not self.Bacula._cnx.closed: self.Bacula._cnx.close()
+      self.Bacula._cnx = None
+      samples = {name: [] for name in TMetricsExporter.Metrics.keys()}
+
+    samples["bacula_up"].append(TMetricsExporter.sample("bacula_up", {}, up))
+    samples["bacula_evaluation_duration_seconds"].append(
+      TMetricsExporter.sample("bacula_evaluation_duration_seconds", {}, round(time.monotonic() - start, 6)))
+    samples["bacula_evaluation_timestamp_seconds"].append(
+      TMetricsExporter.sample("bacula_evaluation_timestamp_seconds", {}, round(time.time(), 3)))
+    lines = []
+    for name, text in TMetricsExporter.Metrics.items():
+      if len(samples[name]) == 0: continue
+      lines += [f"# HELP {name} {text}", f"# TYPE {name} gauge"] + samples[name]
+    return "\n".join(lines) + "\n"
+
+  # ------------------------------------------------------------------------------
+  # Serves the metrics on http://ADDRESS/metrics until terminated
+  def Run(self, address: typing.Tuple[AnyStr, int]):
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    importDriver()
+    self.Bacula.Nagios = TNagios(exitOnResult=False)  # Connection errors are reported by bacula_up
+    server = TMetricsServer(address, TMetricsRequestHandler)
+    server.Exporter = self
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      server.server_close()
+
+
+###############################################################################
+# Answers GET /metrics, in OpenMetrics format if the scraper accepts it
+class TMetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+
+  def do_GET(self):
+    if self.path.split("?")[0] != "/metrics":
+      self.send_error(404)
+      return
+    payload = self.server.Exporter.Payload()
+    if "application/openmetrics-text" in self.headers.get("Accept", ""):
+      contentType = TMetricsExporter.OpenMetricsContentType
+      payload += "# EOF\n"
+    else:
+      contentType = TMetricsExporter.ContentType
+    body = payload.encode()
+    self.send_response(200)
+    self.send_header("Content-Type", contentType)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  # Scrapes are not logged
+  def log_message(self, format, *args):
+    pass
+
+
+###############################################################################
+class TMetricsServer(http.server.ThreadingHTTPServer):
+  daemon_threads = True
+  request_queue_size = 64  # Scrapers connecting while the clients are evaluated
+  Exporter: TMetricsExporter = None
@@ -0,0 +1,3109 @@
+# SELECT * FROM public.client INNER JOIN public.job ON client.clientid = job.clientid WHERE client.name = 'wiki-fd' ORDER BY job.endtime;
+from __future__ import annotations
+import array
+import contextlib
+import datetime
+import fcntl
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+import typing
+from typing import AnyStr, Optional, Union, List
+
+import argparse
+
+psycopg2 = None  # Imported with the first catalog connection, see importDriver()
+
+if not sys.version_info >= (3,7):
+  raise RuntimeError("this script requires Python V3.7 or higher")
+
+totalPerfLabel = "Total OK jobs"
+
+#------------------------------------------------------------------------------
+def buildParser(parserClass : typing.Type[argparse.ArgumentParser] = argparse.ArgumentParser) -> argparse.ArgumentParser:
+  parser = parserClass()
+  parser.add_argument(
+      "-H",
+      "--host",
+      default="localhost",
+      help="Bacula database host name or address"
+  )
+  parser.add_argument(
+      "-p",
+      "--port",
+      default=5432,
+      help="PostgreSQL port (default=5432)"
+  )
+  parser.add_argument(
+      "-U",
+      "--dbuser",
+      default="postgres",
+      help="Database user (default=potgres)"
+  )
+  parser.add_argument(
+      "-P",
+      "--dbpass",
+      help="Database user password"
+  )
+  parser.add_argument(
+      "-D",
+      "--db",
+      default="bacula"
+  )
+  parser.add_argument(
+      "-C",
+      "--client",
+      help="Bacula client name. "
+  )
+  parser.add_argument(
+      "--clients-from",
+      metavar="FILE",
+      help="""Batch mode: check all clients listed in FILE (one client name per line, '#' starts a comment, '-' reads\
+              from stdin). All clients are evaluated with a single catalog query and one result line is printed per client"""
+  )
+  parser.add_argument(
+      "--all-clients",
+      action="store_true",
+      help="""Batch mode: check all clients registered in the Bacula catalog"""
+  )
+  parser.add_argument(
+      "-d",
+      "--days",
+      default=7,
+      type=int,
+      help="""Number of days to consider when checking the job status for the given client"""
+  )
+  parser.add_argument(
+      "-j",
+      "--job",
+      help="""Optional job name"""
+  )
+  parser.add_argument(
+      "-R",
+      "--norunwarn",
+      action="store_true",
+      help="""No run status gives warning"""
+  )
+  parser.add_argument(
+      "-w",
+      "--warn",
+      action="append",
+      nargs=2,
+      help="""Warning threshold compatible to Nagios threshold range specifica\
+              tions. This option takes two arguments, first the target data eithe\
+              r '+' for the total successful job count or a job name, and the thr\
+              eshold. ex. --warn + 3:. Job names may be globs ('db-*') or regular \
+              expressions between slashes ('/^db-[0-9]+$/')"""
+  )
+  parser.add_argument(
+      "-c",
+      "--crit",
+      action="append",
+      nargs=2,
+      help="""Critical threshold compatible to Nagios threshold range specific\
+              ations. This option takes two arguments, first the target data eith\
+              er '+' for the total successful job count or a job name, and the th\
+              reshold. ex. --crit server-backup 3:. Job names may be globs \
+              ('db-*') or regular expressions between slashes ('/^db-[0-9]+$/')"""
+  )
+  parser.add_argument(
+      "--history",
+      metavar="DAYS",
+      default=0,
+      type=int,
+      help="""Analyse the successful jobs of the last DAYS days and report per job name duration, percentiles, \
+              ratio to the median duration of the previous jobs of the same level and throughput as perfdata. \
+              Thresholds on these (ex. --warn '* duration ratio' 2) raise the status"""
+  )
+  parser.add_argument(
+      "--job-log",
+      metavar="LINES",
+      default=0,
+      type=int,
+      help="""Append up to LINES lines of the catalog log of the last job of each job name which did not end \
+              successfully, errors first, as long output. The log of all of these jobs is fetched with one query, \
+              none if all jobs are fine (default=0, no log)"""
+  )
+  parser.add_argument(
+      "--check",
+      metavar="STAGES",
+      default="jobs",
+      help="""Comma separated check stages run over one catalog connection: 'jobs' (the job check of the client), \
+              'volumes' (usable volumes and volumes in error per pool) and 'pools' (volumes used of the maximum \
+              number per pool). Pool perfdata is labelled 'pool <name> <metric>' and takes thresholds like job \
+              perfdata (default=jobs)"""
+  )
+  parser.add_argument(
+      "--pool",
+      action="append",
+      metavar="NAME",
+      help="""Pool checked by the volumes and pools stages, may be given several times (default: all backup pools)"""
+  )
+  parser.add_argument(
+      "--fetch-size",
+      default=1000,
+      type=int,
+      help="""Number of job rows parsed per batch in batch mode (--clients-from, --all-clients) and of job history \
+              rows fetched per round trip (--history) (default=1000)"""
+  )
+  parser.add_argument(
+      "--dump-jobs",
+      metavar="FILE",
+      help="""Batch mode: write the fetched jobs to the compressed file FILE, for later runs with --jobs-from"""
+  )
+  parser.add_argument(
+      "--jobs-from",
+      metavar="FILE",
+      help="""Batch mode: evaluate the jobs of the --dump-jobs file FILE instead of querying the catalog, --days must \
+              lie within the dumped timeframe"""
+  )
+  parser.add_argument(
+      "--catalog",
+      metavar="HOST[:PORT][/DB]",
+      action="append",
+      help="""Query this catalog (repeatable) instead of --host. Catalogs are queried concurrently and the results \
+              are merged per client, which may have moved between directors. User, password, port and database \
+              default to the corresponding options"""
+  )
+  parser.add_argument(
+      "--catalogs-from",
+      metavar="FILE",
+      help="""Read catalogs from FILE, one [name] section per catalog with optional host, port, db, user and \
+              password entries defaulting to the corresponding options"""
+  )
+  parser.add_argument(
+      "--catalog-timeout",
+      default=10,
+      type=float,
+      help="""Time in seconds each catalog has to answer when querying several catalogs (default=10)"""
+  )
+  parser.add_argument(
+      "--timings",
+      action="store_true",
+      help="""Report the time spent per check stage (connect, resolve, query, fetch, evaluate) as perfdata"""
+  )
+  parser.add_argument(
+      "--profile",
+      metavar="FILE",
+      help="""Write the time spent per check stage to FILE, appending one JSON line per stage, or the cProfile \
+              statistics of the run with --profile-format cprofile"""
+  )
+  parser.add_argument(
+      "--profile-format",
+      choices=["jsonl", "cprofile"],
+      default="jsonl",
+      help="""Format of the --profile file (default=jsonl)"""
+  )
+  parser.add_argument(
+      "--explain",
+      action="store_true",
+      help="""Run EXPLAIN (ANALYZE, BUFFERS) on the statements issued for the given client and report planning and \
+              execution time, buffer usage and scan types instead of checking"""
+  )
+  parser.add_argument(
+      "--advise",
+      action="store_true",
+      help="""Like --explain, additionally proposing the catalog indexes missing for index scans of the check \
+              statements (WARNING if any is missing)"""
+  )
+  parser.add_argument(
+      "--create-indexes",
+      action="store_true",
+      help="""With --advise, create the missing indexes (CREATE INDEX CONCURRENTLY, requires the privilege to \
+              create indexes on the catalog tables)"""
+  )
+  parser.add_argument(
+      "--daemon",
+      metavar="SOCKET",
+      help="""Run as resident check daemon answering check requests from check_bacula_jobs_client.py on the Unix \
+              domain socket SOCKET, using a pool of catalog connections with prepared statements"""
+  )
+  parser.add_argument(
+      "--pool-size",
+      default=4,
+      type=int,
+      help="""Daemon mode: maximum number of catalog connections and concurrently handled checks (default=4)"""
+  )
+  parser.add_argument(
+      "--cache-dir",
+      metavar="DIR",
+      help="""Cache check results in DIR, shared between plugin processes. Cached results are returned without \
+              connecting to the catalog"""
+  )
+  parser.add_argument(
+      "--cache-ttl",
+      default=60,
+      type=int,
+      help="""Time in seconds a cached result is considered fresh (default=60). Expired results are still returned \
+              by concurrent checks while one process refreshes them"""
+  )
+  parser.add_argument(
+      "--cache-size",
+      default=10240,
+      type=int,
+      help="""Maximum size of the result cache in KiB, the oldest results are evicted first (default=10240)"""
+  )
+  parser.add_argument(
+      "--client-cache",
+      metavar="DIR",
+      help="""Keep the client name to clientid map of the catalog in DIR, shared between plugin processes, instead \
+              of resolving the client names on every check"""
+  )
+  parser.add_argument(
+      "--client-cache-ttl",
+      default=86400,
+      type=int,
+      help="""Time in seconds after which the client map is reloaded from the catalog (default=86400). Unknown \
+              client names reload it right away"""
+  )
+  parser.add_argument(
+      "--state-dir",
+      metavar="DIR",
+      help="""Keep the job summaries of each checked client in DIR and fetch only the jobs added since the \
+              previous check (incremental mode)"""
+  )
+  parser.add_argument(
+      "--baseline-dir",
+      metavar="DIR",
+      help="""Keep per client, job name and level the exponentially weighted mean and variance of bytes, files and \
+              run time of the successful jobs in DIR, updated from the jobs added since the previous check, and report \
+              the last job of each job name with thresholds around them (single client checks)"""
+  )
+  parser.add_argument(
+      "--baseline-warn",
+      metavar="K",
+      default="2",
+      help="""With --baseline-dir, warning band around the mean in standard deviations, or in percent of the mean \
+              if followed by '%%' (default=2)"""
+  )
+  parser.add_argument(
+      "--baseline-crit",
+      metavar="K",
+      default="3",
+      help="""With --baseline-dir, critical band around the mean in standard deviations, or in percent of the mean \
+              if followed by '%%' (default=3)"""
+  )
+  parser.add_argument(
+      "--submit-command-file",
+      metavar="FILE",
+      help="""Batch mode: write the result of every client as PROCESS_SERVICE_CHECK_RESULT external command to the \
+              Nagios / Icinga command file (FIFO) FILE instead of printing it"""
+  )
+  parser.add_argument(
+      "--submit-spool-dir",
+      metavar="DIR",
+      help="""Batch mode: write the results of all clients as one passive check result file to the Nagios check \
+              result spool directory DIR"""
+  )
+  parser.add_argument(
+      "--submit-url",
+      metavar="URL",
+      help="""Batch mode: post the result of every client to the Icinga 2 API URL, for instance \
+              https://localhost:5665/v1/actions/process-check-result"""
+  )
+  parser.add_argument(
+      "--submit-auth",
+      metavar="USER:PASSWORD",
+      help="""Credentials of the Icinga 2 API user for --submit-url"""
+  )
+  parser.add_argument(
+      "--submit-host",
+      default="{client}",
+      metavar="FORMAT",
+      help="""Host name submitted for a client, {client} is replaced by the client name and {host} by the client \
+              name without '-fd' suffix (default={client})"""
+  )
+  parser.add_argument(
+      "--submit-service",
+      default="bacula jobs",
+      metavar="SERVICE",
+      help="""Service description submitted for each client (default='bacula jobs')"""
+  )
+  parser.add_argument(
+      "--install-trigger",
+      action="store_true",
+      help="""Install a trigger on public.job notifying job status changes for --listen (requires the privilege to \
+              create triggers on the catalog tables)"""
+  )
+  parser.add_argument(
+      "--remove-trigger",
+      action="store_true",
+      help="""Remove the trigger installed by --install-trigger"""
+  )
+  parser.add_argument(
+      "--listen",
+      action="store_true",
+      help="""Batch mode: keep running and re-evaluate a client as soon as the catalog trigger notifies a change of \
+              its jobs, printing or submitting (--submit-*) its result right away"""
+  )
+  parser.add_argument(
+      "--listen-refresh",
+      default=3600,
+      type=int,
+      help="""With --listen, seconds between evaluations of all clients, catching the job age thresholds which \
+              change without catalog activity (default=3600)"""
+  )
+  parser.add_argument(
+      "--exporter",
+      metavar="[HOST:]PORT",
+      help="""Batch mode: keep running and serve the state of the clients as Prometheus metrics on \
+              http://[HOST:]PORT/metrics, the job history (for durations) defaults to --days"""
+  )
+  parser.add_argument(
+      "--exporter-interval",
+      default=60,
+      type=float,
+      help="""With --exporter, seconds the evaluated metrics are served before scrapes evaluate the clients again \
+              (default=60)"""
+  )
+  parser.add_argument(
+      "--deadline",
+      metavar="SECONDS",
+      type=float,
+      help="""Time budget of the check: catalog connect and statement timeouts are bounded by the remaining time and \
+              a query still running when it is used up is cancelled"""
+  )
+  parser.add_argument(
+      "--stale-dir",
+      metavar="DIR",
+      help="""With --deadline, keep the last good result of each check in DIR and return it, with its age, when the \
+              deadline is exceeded instead of UNKNOWN"""
+  )
+  parser.add_argument(
+      "--replica",
+      metavar="HOST[:PORT]",
+      action="append",
+      help="""Hot standby of the catalog on --host (repeatable). Checks read from the fastest replica whose \
+              replication lag is below --max-lag, failing over to the next one and finally to --host"""
+  )
+  parser.add_argument(
+      "--max-lag",
+      default=60,
+      type=float,
+      help="""Replication lag in seconds up to which a replica is used (default=60)"""
+  )
+  parser.add_argument(
+      "--host-state",
+      metavar="FILE",
+      help="""Remember the connect latency and failures of --host and the replicas in FILE, shared between plugin \
+              processes, to try the fastest host first and skip failed ones for a while"""
+  )
+  parser.add_argument(
+      "--summary-table",
+      action="store_true",
+      help="""Refresh and read the job summary table maintained in the catalog (see --install-summary-table) instead \
+              of summarizing the jobs of the client, falling back to the latter if the table is not installed"""
+  )
+  parser.add_argument(
+      "--install-summary-table",
+      action="store_true",
+      help="""Create the job summary table and its refresh function in the catalog and summarize all jobs (requires \
+              the privilege to create tables in the catalog)"""
+  )
+  parser.add_argument(
+      "--remove-summary-table",
+      action="store_true",
+      help="""Drop the job summary table and its refresh function"""
+  )
+  parser.add_argument(
+      "--summary-retention",
+      default=400,
+      type=int,
+      help="""With --install-summary-table, days the successful job counts are kept for (default=400), checks \
+              with more --days do not use the summary table"""
+  )
+  return parser
+
+#------------------------------------------------------------------------------
+def checkArgs(parser : argparse.ArgumentParser, args : argparse.Namespace) -> argparse.Namespace:
+  args.check = [stage.strip().lower() for stage in args.check.split(",") if len(stage.strip()) > 0]
+  for stage in args.check:
+    if stage not in ["jobs", "volumes", "pools"]:
+      parser.error(f"invalid check stage '{stage}', expected jobs, volumes or pools")
+  if len(args.check) == 0:
+    parser.error("--check requires at least one stage")
+  if args.check != ["jobs"] and (args.clients_from is not None or args.all_clients or args.daemon is not None or
+                                 args.catalog is not None or args.catalogs_from is not None):
+    parser.error("--check volumes and pools cannot be used with --clients-from, --all-clients, --daemon, --catalog or "
+                 "--catalogs-from")
+  if args.client is None and args.clients_from is None and not args.all_clients and args.daemon is None and \
+     not args.install_trigger and not args.remove_trigger and not args.install_summary_table and \
+     not args.remove_summary_table and "jobs" in args.check:
+    parser.error("one of the arguments -C/--client, --clients-from or --all-clients is required")
+  if (args.explain or args.advise) and args.client is None:
+    parser.error("--explain and --advise require -C/--client")
+  if args.create_indexes and not args.advise:
+    parser.error("--create-indexes requires --advise")
+  if (args.submit_command_file is not None or args.submit_spool_dir is not None or args.submit_url is not None) and \
+     args.clients_from is None and not args.all_clients:
+    parser.error("--submit-command-file, --submit-spool-dir and --submit-url require --clients-from or --all-clients")
+  if args.listen and args.clients_from is None and not args.all_clients:
+    parser.error("--listen requires --clients-from or --all-clients")
+  if args.exporter is not None and args.clients_from is None and not args.all_clients:
+    parser.error("--exporter requires --clients-from or --all-clients")
+  if (args.dump_jobs is not None or args.jobs_from is not None) and args.clients_from is None and not args.all_clients:
+    parser.error("--dump-jobs and --jobs-from require --clients-from or --all-clients")
+  if (args.dump_jobs is not None or args.jobs_from is not None) and \
+     (args.listen or args.exporter is not None or args.catalog is not None or args.catalogs_from is not None):
+    parser.error("--dump-jobs and --jobs-from cannot be used with --listen, --exporter, --catalog or --catalogs-from")
+  # The checks of several catalogs run the plain job check on each, see TCatalogFanOut
+  if args.catalog is not None or args.catalogs_from is not None:
+    unsupported = [option for option, given in [("--job-log", args.job_log > 0),
+                                                ("--state-dir", args.state_dir is not None),
+                                                ("--baseline-dir", args.baseline_dir is not None),
+                                                ("--cache-dir", args.cache_dir is not None),
+                                                ("--deadline", args.deadline is not None),
+                                                ("--replica", args.replica is not None),
+                                                ("--summary-table", args.summary_table),
+                                                ("--client-cache", args.client_cache is not None)] if given]
+    if len(unsupported) > 0:
+      parser.error(f"{', '.join(unsupported)} cannot be used with --catalog or --catalogs-from")
+  if args.jobs_from is not None and (args.dump_jobs is not None or int(args.history) > 0 or args.job_log > 0):
+    parser.error("--jobs-from cannot be used with --dump-jobs, --history or --job-log")
+  for band in [args.baseline_warn, args.baseline_crit]:
+    if re.fullmatch(r"[0-9]+(\.[0-9]*)?%?", band) is None:
+      parser.error(f"invalid baseline band '{band}', expected a number of standard deviations or a percentage")
+  if args.stale_dir is not None and args.deadline is None:
+    parser.error("--stale-dir requires --deadline")
+  return args
+
+#------------------------------------------------------------------------------
+# Imports psycopg2 on first use, so that runs failing early or answered from the result cache do not pay for it
+def importDriver():
+  global psycopg2
+  if psycopg2 is None:
+    import psycopg2
+    import psycopg2.pool
+
+
+# Parsed command line arguments, set by main(). The defaults apply when used as module.
+args = argparse.Namespace(days=7, norunwarn=False, history=0)
+
+POSTGRES_PORT = 5432
+
+
+###############################################################################
+class TRange:
+
+  def __init__(self, min, max, inside: bool = False):
+    self.Min = min
+    self.Max = max
+    self.Inside = inside
+
+  # ------------------------------------------------------------------------------
+  # Nagios range semantics: alert if the value is outside the range, or inside it for '@' ranges
+  def Alert(self, value: Union[int, float]) -> bool:
+    inside = (self.Min is None or value >= self.Min) and (self.Max is None or value <= self.Max)
+    return inside if self.Inside else not inside
+
+
+def days(d: datetime):
+  if d is None: return 0  # Still running
+  d = d.date()
+  today = datetime.datetime.now().date()
+  return (today - d).days
+
+
+###############################################################################
+class TThreshold(TRange):
+
+  # type = TNagios.WARNING  | TNagios.CRITICAL
+  def __init__(self, type : int, thresholdStr : AnyStr, target : AnyStr= None, matcher : Optional[typing.Callable[[TThreshold, AnyStr], bool]] = None):
+    if type not in [ TNagios.WARNING, TNagios.CRITICAL ]:
+      raise RuntimeError("BUG: TThreshold type muts be TNagios.WARNING or TNagios..CRITICAL")
+    self.Type = type
+    self.Target = target
+    self.Matcher = self.defaultMatcher if matcher is None else matcher
+
+    m = re.fullmatch(r"^(\s*[@]?)([-.0-9]*|[~])?(?:([:])([-.0-9]*))?\s*$", thresholdStr)
+    if m is None:
+      raise RuntimeError(f"Threshold '{thresholdStr}' could not be parsed")
+    inside = m.group(1) == '@'
+    v1 = m.group(2)
+    v2 = m.group(4)
+
+    if (m.group(3) == ':'):
+      # We have a range
+      if v1 == "": v1 = "0"
+      v1 = None if v1 == '~' else (float(v1) if '.' in v1 else int(v1))
+      v2 = None if v2 == '' else (float(v2) if '.' in v2 else int(v2))
+    else:
+      # v1 is actually v2 (i.e. :x same as x)
+      v2 = None if v1 == '~' else (float(v1) if '.' in v1 else int(v1))
+      v1 = 0
+
+    super().__init__(v1, v2, inside)
+
+  #------------------------------------------------------------------------------
+  def defaultMatcher(self,thr : TThreshold, lbl : AnyStr):
+    return thr.Target == lbl
+
+  # ------------------------------------------------------------------------------
+  # Readings of a job target as (job name or pattern, metric), see TThresholdIndex: the whole target as job name for
+  # the OK count, then '<job name> <metric>' if it ends in a metric, so that jobs named like 'home files' still match
+  def JobTargets(self) -> List[typing.Tuple[AnyStr, AnyStr]]:
+    target = self.Target.strip()
+    job, metric = TThresholdIndex.SplitJob(target)
+    if metric is None: return [(target, "OK")]
+    return [(target, "OK"), (job.strip(), metric)]
+
+  # ------------------------------------------------------------------------------
+  # Regular expression of glob ('db-*') and regex ('/^db-[0-9]+$/') job names of targets, None for plain names. Regex
+  # targets match anywhere in the name, globs the whole name.
+  @staticmethod
+  def TargetPattern(target: AnyStr) -> Optional[AnyStr]:
+    if len(target) > 2 and target[0] == '/' and target[-1] == '/': return f".*?(?:{target[1:-1]})"
+    if any([c in target for c in "*?["]):
+      import fnmatch
+      return fnmatch.translate(target)
+    return None
+
+  # ------------------------------------------------------------------------------
+  def __str__(self):
+    v1 = '~' if self.Min is None else self.Min
+    v2 = '' if self.Max is None else self.Max
+    prefix = '@' if self.Inside else ''
+    if v1 == 0: return f"{prefix}{v2}"
+    return f"{prefix}{v1}:{v2}"
+
+
+###############################################################################
+# Thresholds by perfdata label, compiled once instead of matching every
+# threshold against every label. Job perfdata labels are '<job name> <metric>'
+# (see JobMetrics), job targets are '<job name>' for the OK count or
+# '<job name> <metric>'. Plain job names (and '+') are looked up by hash, glob
+# and regex job names are compiled into one alternation per threshold type and
+# metric. Plain names take precedence over patterns, patterns apply in the
+# order given. Matches are remembered per label.
+class TThresholdIndex:
+
+  # Metrics of job perfdata, see TJobHistory and TJobBaseline, and of pool perfdata ('pool <name> <metric>'), see
+  # check_bacula.media
+  JobMetrics = ["OK", "duration", "duration p50", "duration p90", "duration ratio", "bytes rate", "files rate", "bytes",
+                "files", "run time", "volumes", "used", "usable volumes", "error volumes"]
+
+  def __init__(self, thresholds: List[TThreshold]):
+    self.Labels: typing.Dict[typing.Tuple[int, AnyStr], TThreshold] = {}  # (type, label) -> threshold
+    self.Jobs: typing.Dict[typing.Tuple[int, AnyStr, AnyStr], TThreshold] = {}  # (type, metric, lowercase job name)
+    # (type, metric) -> (alternation of all patterns or None, [(pattern, threshold)])
+    self.Patterns: typing.Dict[typing.Tuple[int, AnyStr],
+                               typing.Tuple[Optional[typing.Pattern], List[typing.Tuple[typing.Pattern, TThreshold]]]] = {}
+    self.Other: List[TThreshold] = []  # Thresholds with own matcher, tried one by one
+    self.Matches: typing.Dict[AnyStr, typing.Tuple[Optional[TThreshold], Optional[TThreshold]]] = {}
+
+    patterns: typing.Dict[typing.Tuple[int, AnyStr], List[typing.Tuple[AnyStr, TThreshold]]] = {}
+    for thr in thresholds:
+      if thr.Matcher == thr.defaultMatcher:
+        self.Labels.setdefault((thr.Type, thr.Target), thr)
+      elif thr.Matcher is thresholdMapper and thr.Target == '+':
+        self.Labels.setdefault((thr.Type, totalPerfLabel), thr)
+      elif thr.Matcher is thresholdMapper:
+        for job, metric in thr.JobTargets():
+          pattern = TThreshold.TargetPattern(job)
+          if pattern is None:
+            self.Jobs.setdefault((thr.Type, metric, job.lower()), thr)
+          else:
+            patterns.setdefault((thr.Type, metric), []).append((pattern, thr))
+      else:
+        self.Other.append(thr)
+    # Patterns with groups of their own (backreferences, named groups) do not survive being joined into one alternation,
+    # where their groups are renumbered, and are then matched one by one
+    for key, lst in patterns.items():
+      compiled = [(re.compile(pattern, re.IGNORECASE), thr) for pattern, thr in lst]
+      rx = None
+      if all([pattern.groups == 0 for pattern, thr in compiled]):
+        rx = re.compile("|".join([f"(?P<_thr{i}>{pattern})" for i, (pattern, thr) in enumerate(lst)]), re.IGNORECASE)
+      self.Patterns[key] = (rx, compiled)
+
+  # ------------------------------------------------------------------------------
+  # Splits '<job name> <metric>' into job name and metric, metric is None if it is no job perfdata
+  @staticmethod
+  def SplitJob(text: AnyStr) -> typing.Tuple[AnyStr, Optional[AnyStr]]:
+    for metric in sorted(TThresholdIndex.JobMetrics, key=len, reverse=True):
+      if len(text) > len(metric) + 1 and text[-len(metric) - 1:].lower() == " " + metric.lower():
+        return text[:-len(metric) - 1], metric
+    return text, None
+
+  # ------------------------------------------------------------------------------
+  # Returns the (warning, critical) thresholds of a perfdata label
+  def Match(self, label: AnyStr) -> typing.Tuple[Optional[TThreshold], Optional[TThreshold]]:
+    result = self.Matches.get(label)
+    if result is None:
+      job, metric = TThresholdIndex.SplitJob(label)
+      job = job.lower()
+      result = self.Matches[label] = (self.match(TNagios.WARNING, label, job, metric),
+                                      self.match(TNagios.CRITICAL, label, job, metric))
+    return result
+
+  # ------------------------------------------------------------------------------
+  def match(self, type: int, label: AnyStr, job: AnyStr, metric: Optional[AnyStr]) -> Optional[TThreshold]:
+    thr = self.Labels.get((type, label))
+    if thr is None and metric is not None:
+      thr = self.Jobs.get((type, metric, job))
+      if thr is None and (type, metric) in self.Patterns:
+        rx, lst = self.Patterns[(type, metric)]
+        if rx is not None:
+          m = rx.match(job)
+          if m is not None: thr = lst[int(m.lastgroup[4:])][1]
+        else:
+          thr = next((t for pattern, t in lst if pattern.match(job) is not None), None)
+    if thr is None:
+      for other in self.Other:
+        if other.Type == type and other.Matcher(other, label): return other
+    return thr
+
+
+###############################################################################
+class TPerfData:
+  def __init__(self, label: AnyStr, value: Union[int, float], unit: Optional[AnyStr] = None,
+               warn: Optional[TThreshold] = None, crit: Optional[TThreshold] = None,
+               min: Optional[Union[int, float]] = None, max: Optional[Union[int, float]] = None):
+    self.Label = label
+    self.Value = value
+    self.Unit = unit
+    self.WarnThreshold = warn
+    self.CritThreshold = crit
+    self.Min = min
+    self.Max = max
+
+  # ------------------------------------------------------------------------------
+  def ToDict(self) -> typing.Dict[AnyStr, typing.Any]:
+    return {"label": self.Label, "value": self.Value, "unit": self.Unit,
+            "warn": None if self.WarnThreshold is None else str(self.WarnThreshold),
+            "crit": None if self.CritThreshold is None else str(self.CritThreshold),
+            "min": self.Min, "max": self.Max}
+
+  # ------------------------------------------------------------------------------
+  @staticmethod
+  def FromDict(d: typing.Dict[AnyStr, typing.Any]) -> TPerfData:
+    return TPerfData(d["label"], d["value"], d["unit"],
+                     None if d["warn"] is None else TThreshold(TNagios.WARNING, d["warn"]),
+                     None if d["crit"] is None else TThreshold(TNagios.CRITICAL, d["crit"]),
+                     d["min"], d["max"])
+
+  # ------------------------------------------------------------------------------
+  def __str__(self):
+    s = f"'{self.Label}'={self.Value}"
+    if self.Unit is not None: s = s + self.Unit
+    meta = [self.WarnThreshold, self.CritThreshold, self.Min, self.Max]
+    while len(meta) > 0 and meta[-1] is None: del meta[-1]
+    meta = ["" if x is None else str(x) for x in meta]
+    if len(meta) > 0: s = s + ';' + ';'.join(meta)
+    return s
+
+
+###############################################################################
+# Wall clock time spent per check stage (connect, resolve, query, fetch,
+# evaluate, format), reported as perfdata and written as profile trace
+class TStageTimer:
+
+  def __init__(self):
+    self.Enabled = False
+    self.PerfData = False  # Report the stages as perfdata, see TNagios.ReturnResult()
+    self.Stages: typing.Dict[AnyStr, float] = {}  # Stage -> seconds, in order of first use
+    self.Trace: List[typing.Tuple[AnyStr, float, float]] = []  # (stage, start offset, seconds)
+    self.Start = time.time()
+    self.ProfileFile: Optional[AnyStr] = None
+    self.Profiler = None  # cProfile.Profile if the profile is written in cProfile format
+    self._lock = threading.Lock()  # Stages are timed by the catalog workers of TCatalogFanOut too
+
+  # ------------------------------------------------------------------------------
+  def Enable(self, perfData: bool, profileFile: Optional[AnyStr], profileFormat: AnyStr):
+    self.Enabled = perfData or profileFile is not None
+    self.PerfData = perfData
+    self.ProfileFile = profileFile
+    self.Start = time.time()
+    if profileFile is not None and profileFormat == "cprofile":
+      import cProfile
+      self.Profiler = cProfile.Profile()
+      self.Profiler.enable()
+
+  # ------------------------------------------------------------------------------
+  @contextlib.contextmanager
+  def Stage(self, name: AnyStr) -> typing.Iterator[None]:
+    if not self.Enabled:
+      yield
+      return
+    t = time.perf_counter()
+    try:
+      yield
+    finally:
+      elapsed = time.perf_counter() - t
+      with self._lock:
+        self.Stages[name] = self.Stages.get(name, 0.0) + elapsed
+        self.Trace.append((name, round(time.time() - elapsed - self.Start, 6), elapsed))
+
+  # ------------------------------------------------------------------------------
+  def GetPerfData(self) -> List[TPerfData]:
+    with self._lock:
+      return [TPerfData(f"{name} time", round(seconds * 1000, 3), "ms") for name, seconds in self.Stages.items()]
+
+  # ------------------------------------------------------------------------------
+  # Appends the stages as JSON lines or writes the cProfile statistics of the run
+  def WriteProfile(self):
+    if self.ProfileFile is None: return
+    try:
+      if self.Profiler is not None:
+        self.Profiler.disable()
+        self.Profiler.dump_stats(self.ProfileFile)
+      else:
+        with open(self.ProfileFile, "a") as f:
+          for stage, offset, seconds in self.Trace:
+            f.write(json.dumps({"time": self.Start, "pid": os.getpid(), "stage": stage, "offset": offset,
+                                "seconds": round(seconds, 6)}) + "\n")
+    except OSError as e:
+      print(f"could not write profile '{self.ProfileFile}': {e.strerror}", file=sys.stderr)
+
+
+Timer = TStageTimer()
+
+
+###############################################################################
+# Raised instead of exiting by TNagios.ReturnResult() for results which are
+# collected by the caller (i.e. batch mode) rather than returned to Nagios
+class TNagiosResult(Exception):
+
+  def __init__(self, nagios: TNagios):
+    super().__init__(nagios.Message)
+    self.Nagios = nagios
+
+
+###############################################################################
+class TNagios:
+  SUCCESS = 0
+  WARNING = 1
+  CRITICAL = 2
+  UNKNOWN = 3
+
+  STATUS = {SUCCESS: "OK", WARNING: "WARNING", CRITICAL: "CRITICAL", UNKNOWN: "UNKNOWN"}
+
+  def __init__(self, exitOnResult: bool = True):
+    self.Status = TNagios.UNKNOWN
+    self.Message = "unknown status"
+    self.PerfDataList = []
+    self.ThresholdList : List[TThreshold] = []
+    self.ThresholdIndex : Optional[TThresholdIndex] = None  # Built from ThresholdList on first use
+    self.LongOutput : List[AnyStr] = []
+    self.ExitOnResult = exitOnResult
+    self.Timer: Optional[TStageTimer] = None  # Stage timings reported with the result
+
+  # ------------------------------------------------------------------------------
+  def SetStatus(self, status: int, msg: Optional[AnyStr], append: Optional[AnyStr] = None):
+    self.Status = status
+    if msg is not None:
+      if append is not None and len(self.Message) > 0:
+        self.Message = self.Message + append + msg
+      else:
+        self.Message = msg
+
+  # ------------------------------------------------------------------------------
+  def ShiftStatus(self, status: int, msg: Optional[AnyStr], keepEqual: bool = False, append: Optional[AnyStr] = None):
+    if status > TNagios.UNKNOWN: status = TNagios.UNKNOWN
+    if self.Status < TNagios.UNKNOWN and self.Status > status: return
+    if self.Status == status and keepEqual and not append: return
+
+    self.Status = status
+    if msg is not None:
+      if append is not None and len(self.Message) > 0:
+        self.Message = self.Message + append + msg
+      else:
+        self.Message = msg
+
+  # ------------------------------------------------------------------------------
+  def ReturnStatus(self, status: int, msg: Optional[AnyStr], append: Optional[AnyStr] = None):
+    self.SetStatus(status, msg, append)
+    self.ReturnResult()
+
+  # ------------------------------------------------------------------------------
+  def ProposeReturnStatus(self, status: int, msg: AnyStr, keepEqual: bool = False, append: Optional[AnyStr] = None):
+    self.ShiftStatus(status, msg, keepEqual, append)
+    self.ReturnResult()
+
+  # ------------------------------------------------------------------------------
+  def FormatResult(self) -> AnyStr:
+    msg = f"{TNagios.STATUS[self.Status]} - {self.Message}"
+    if len(self.PerfDataList) > 0:
+      perf = ""
+      for p in self.PerfDataList:
+        perf = perf + str(p) + " "
+      perf = perf[:-1]
+      msg = msg + "|" + perf
+    return msg
+
+  # ------------------------------------------------------------------------------
+  def ReturnResult(self):
+    if not self.ExitOnResult:
+      raise TNagiosResult(self)
+    if self.Timer is not None and self.Timer.PerfData: self.AddPerf(self.Timer.GetPerfData())
+    with Timer.Stage("format"):
+      text = self.FormatResult()
+    print(text)
+    for line in self.LongOutput: print(line)
+    if self.Timer is not None: self.Timer.WriteProfile()
+    sys.exit(self.Status)
+
+  # ------------------------------------------------------------------------------
+  def AddPerf(self, perfData: Union[TPerfData, List[TPerfData]]):
+    if isinstance(perfData, list):
+      for p in perfData: self.AddPerf(p)
+      return
+
+    # Try to resolve for thresholds
+    if self.ThresholdIndex is None: self.ThresholdIndex = TThresholdIndex(self.ThresholdList)
+    warn, crit = self.ThresholdIndex.Match(perfData.Label)
+    if perfData.WarnThreshold is None: perfData.WarnThreshold = warn
+    if perfData.CritThreshold is None: perfData.CritThreshold = crit
+
+    self.PerfDataList.append(perfData)
+
+  # ------------------------------------------------------------------------------
+  def AddTheshold(self, thr: Union[TThreshold, List[TThreshold]]):
+    if isinstance(thr, list):
+      self.ThresholdList += thr
+    else:
+      self.ThresholdList.append(thr)
+    self.ThresholdIndex = None
+
+
+Nagios = TNagios()
+
+
+# dbUser = "monitor"
+# dbPass = "ofZT8e4XckW"
+
+
+###############################################################################
+# Connect latency and failures of the catalog hosts (--host-state), shared
+# between plugin processes and used to order the hosts tried
+class THostState:
+
+  # Seconds a failed or lagging host is only tried after all others
+  RetryAfter = 300
+  # Weight of the last connect latency in the remembered average
+  Smoothing = 0.3
+
+  def __init__(self, path: Optional[AnyStr]):
+    self.Path = path
+    self.Hosts: typing.Dict[AnyStr, typing.Dict[AnyStr, float]] = {}  # "host:port" -> {"latency": ms, "failed": time}
+    if path is None: return
+    try:
+      with open(path) as f:
+        self.Hosts = json.load(f)
+    except (OSError, ValueError):
+      self.Hosts = {}
+
+  # ------------------------------------------------------------------------------
+  # Replicas by remembered latency (unknown first, to be measured), then the primary, then the recently failed hosts
+  def Order(self, primary: typing.Tuple[AnyStr, int],
+            replicas: List[typing.Tuple[AnyStr, int]]) -> List[typing.Tuple[AnyStr, int]]:
+    now = time.time()
+    def entry(host):
+      return self.Hosts.get(f"{host[0]}:{host[1]}", {})
+
+    failed = [h for h in replicas if now - entry(h).get("failed", 0) < THostState.RetryAfter]
+    healthy = sorted([h for h in replicas if h not in failed], key=lambda h: entry(h).get("latency", 0))
+    return healthy + [primary] + failed
+
+  # ------------------------------------------------------------------------------
+  def Record(self, host: typing.Tuple[AnyStr, int], latency: Optional[float] = None):
+    entry = self.Hosts.setdefault(f"{host[0]}:{host[1]}", {})
+    if latency is None:
+      entry["failed"] = time.time()
+      return
+    entry.pop("failed", None)
+    last = entry.get("latency")
+    entry["latency"] = round(latency if last is None else last + THostState.Smoothing * (latency - last), 3)
+
+  # ------------------------------------------------------------------------------
+  def Save(self):
+    if self.Path is None: return
+    tmpPath = f"{self.Path}.{os.getpid()}"
+    try:
+      with open(tmpPath, "w") as f:
+        json.dump(self.Hosts, f)
+      os.replace(tmpPath, self.Path)
+    except OSError:
+      if os.path.exists(tmpPath): os.unlink(tmpPath)
+
+
+###############################################################################
+# Time budget of a check (--deadline), bounding the connect and statement
+# timeouts by the remaining time and cancelling the running query once used up
+class TDeadline:
+
+  def __init__(self, seconds: float):
+    self.Seconds = seconds
+    self.End = time.monotonic() + seconds
+    self.Exceeded = False  # The check was cut short
+    self._timer: Optional[threading.Timer] = None
+
+  # ------------------------------------------------------------------------------
+  def Remaining(self) -> float:
+    return max(0.0, self.End - time.monotonic())
+
+  # ------------------------------------------------------------------------------
+  # Cancels the query running on cnx at the deadline, from a timer thread as libpq does not return to the interpreter
+  # for signal handlers while waiting for the server
+  def Watch(self, cnx):
+    def cancel():
+      try:
+        cnx.cancel()
+      except psycopg2.Error:
+        pass
+
+    self.Stop()
+    self._timer = threading.Timer(self.Remaining(), cancel)
+    self._timer.daemon = True
+    self._timer.start()
+
+  # ------------------------------------------------------------------------------
+  def Stop(self):
+    if self._timer is not None: self._timer.cancel()
+    self._timer = None
+
+
+###############################################################################
+# File object receiving the data of COPY ... TO STDOUT in text format with
+# empty NULLs, one write per row, passed on in batches of BatchSize rows split
+# into their text fields
+class TCopyWriter:
+
+  Escapes = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v"}
+  EscapeRE = re.compile(r"\\(?:([0-7]{1,3})|x([0-9a-fA-F]{1,2})|(.))")
+
+  def __init__(self, consume: typing.Callable[[List[List[AnyStr]]], None], batchSize: int,
+               tee: Optional[typing.Callable[[bytes], None]] = None, encoding: AnyStr = "utf-8"):
+    self.Consume = consume
+    self.BatchSize = batchSize
+    self.Tee = tee  # Receives the COPY data as is, see TJobDump
+    self.Encoding = encoding  # Python codec of the connection, see TBacula.Codec()
+    self._rows: List[bytes] = []
+
+  # ------------------------------------------------------------------------------
+  def write(self, data: bytes):
+    self._rows.append(data)
+    if len(self._rows) >= self.BatchSize: self.flush()
+
+  # ------------------------------------------------------------------------------
+  def flush(self):
+    if len(self._rows) == 0: return
+    data = b"".join(self._rows)
+    self._rows = []
+    if self.Tee is not None: self.Tee(data)
+    self.Consume(TCopyWriter.Parse(data, self.Encoding))
+
+  # ------------------------------------------------------------------------------
+  # Splits COPY data holding whole rows, only rows with escaped characters need to be unescaped. Bytes invalid in the
+  # encoding (SQL_ASCII catalogs hold whatever the director wrote) are replaced instead of failing the check.
+  @staticmethod
+  def Parse(data: bytes, encoding: AnyStr = "utf-8") -> List[List[AnyStr]]:
+    rows = []
+    for line in data.decode(encoding, errors="replace").split("\n")[:-1]:
+      fields = line.split("\t")
+      if "\\" in line: fields = [TCopyWriter.unescape(field) for field in fields]
+      rows.append(fields)
+    return rows
+
+  # ------------------------------------------------------------------------------
+  @staticmethod
+  def unescape(field: AnyStr) -> AnyStr:
+    def char(m):
+      if m.group(1) is not None: return chr(int(m.group(1), 8))
+      if m.group(2) is not None: return chr(int(m.group(2), 16))
+      return TCopyWriter.Escapes.get(m.group(3), m.group(3))
+    return TCopyWriter.EscapeRE.sub(char, field)
+
+
+###############################################################################
+class TBacula:
+
+  # Statements which are prepared on long living connections (daemon mode), name -> (parameter types, SQL with %s
+  # placeholders), see Register() and Execute()
+  Statements: typing.Dict[AnyStr, typing.Tuple[List[AnyStr], AnyStr]] = {}
+  # Rows per round trip when streaming, see Stream()
+  FetchSize = 1000
+
+  def __init__(self, dbURI: AnyStr, dbUser: AnyStr, dbPass: AnyStr, nagios: Optional[TNagios] = None):
+    self.Nagios = Nagios if nagios is None else nagios
+    m = re.fullmatch(r"(?P<host>[^:]+)[:](?P<port>[0-9]*)[/][/](?P<db>.+)", dbURI)
+    if m is None:
+      self.Nagios.ReturnStatus(TNagios.CRITICAL, f"invalid db URI: '{dbURI}'")
+
+    self.DBHost = m.group("host")
+    self.DBPort = int(m.group("port")) if len(m.group("port")) > 0 else POSTGRES_PORT
+    self.DBName = m.group("db")
+    self.DBUser = dbUser
+    self.DBPass = dbPass
+    self.Prepared = False
+    self.ConnectTimeout = 3
+    self.StatementTimeout: Optional[int] = None  # ms
+    self.Deadline: Optional[TDeadline] = None
+    self.Replicas: List[typing.Tuple[AnyStr, int]] = []  # Hot standbys tried before DBHost, see connectReplicated()
+    self.MaxLag = 60.0  # s
+    self.HostState: Optional[THostState] = None
+    self.Host: Optional[AnyStr] = None  # "host:port" connected to
+    self._cnx = None
+
+  # ----------------------------------------------------------------------------
+  @property
+  def DBConnection(self):
+    if self._cnx is None:
+      self.connect()
+    return self._cnx
+
+  # ------------------------------------------------------------------------------
+  @property
+  def Connected(self) -> bool:
+    return self._cnx is not None and not self._cnx.closed
+
+  # ------------------------------------------------------------------------------
+  # Statement timeout in ms bounded by the remaining time of the deadline if any, None for no timeout
+  def statementTimeout(self) -> Optional[int]:
+    if self.Deadline is None: return self.StatementTimeout
+    remaining = max(1, int(self.Deadline.Remaining() * 1000))
+    return remaining if self.StatementTimeout is None else min(self.StatementTimeout, remaining)
+
+  # ------------------------------------------------------------------------------
+  def ConnectParams(self, host: Optional[AnyStr] = None, port: Optional[int] = None) -> typing.Dict[AnyStr, typing.Any]:
+    params = {"host": self.DBHost if host is None else host,
+              "database": self.DBName,
+              "user": self.DBUser,
+              "password": self.DBPass,
+              "port": self.DBPort if port is None else port,
+              "connect_timeout": self.ConnectTimeout}
+    if self.Deadline is not None:
+      params["connect_timeout"] = max(1, min(self.ConnectTimeout, int(self.Deadline.Remaining() + 0.999)))
+    timeout = self.statementTimeout()
+    if timeout is not None: params["options"] = f"-c statement_timeout={timeout}"
+    return params
+
+  # ------------------------------------------------------------------------------
+  def connect(self):
+    importDriver()
+    if len(self.Replicas) > 0:
+      self.connectReplicated()
+    else:
+      try:
+        with Timer.Stage("connect"):
+          self._cnx = psycopg2.connect(**self.ConnectParams())
+      except Exception:
+        if self.Deadline is not None and self.Deadline.Remaining() == 0: self.Deadline.Exceeded = True
+        self.Nagios.ReturnStatus(TNagios.CRITICAL,
+                                 f"could not connect to postgresql database '{self.DBName}' @ {self.DBHost}:{self.DBPort}")
+      self.Host = f"{self.DBHost}:{self.DBPort}"
+    if self.Deadline is not None: self.Deadline.Watch(self._cnx)
+
+  # ------------------------------------------------------------------------------
+  # Connects to the first answering replica with a replication lag below MaxLag in the order of the host state, the
+  # primary (DBHost) being the fallback. Unreachable and lagging hosts are remembered as failed.
+  def connectReplicated(self):
+    state = THostState(None) if self.HostState is None else self.HostState
+    hosts = state.Order((self.DBHost, self.DBPort), self.Replicas)
+    for host, port in hosts:
+      t = time.perf_counter()
+      try:
+        with Timer.Stage("connect"):
+          cnx = psycopg2.connect(**self.ConnectParams(host, port))
+          cursor = cnx.cursor()
+          cursor.execute("SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()"
+                         " THEN 0 ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END")
+          lag = float(cursor.fetchone()[0])
+          cursor.close()
+          cnx.rollback()
+      except Exception:
+        state.Record((host, port))
+        continue
+      if lag > self.MaxLag and (host, port) != (self.DBHost, self.DBPort):
+        cnx.close()
+        state.Record((host, port))
+        continue
+      state.Record((host, port), (time.perf_counter() - t) * 1000)
+      state.Save()
+      self._cnx = cnx
+      self.Host = f"{host}:{port}"
+      return
+
+    state.Save()
+    if self.Deadline is not None and self.Deadline.Remaining() == 0: self.Deadline.Exceeded = True
+    self.Nagios.ReturnStatus(TNagios.CRITICAL, f"could not connect to postgresql database '{self.DBName}' @ " +
+                             ", ".join([f"{host}:{port}" for host, port in hosts]))
+
+  # ------------------------------------------------------------------------------
+  # Lowers the statement timeout to the remaining time of the deadline before running a statement
+  def bound(self, cursor: psycopg2.cursor):
+    if self.Deadline is not None: cursor.execute(f"SET statement_timeout = {self.statementTimeout()}")
+
+  # ------------------------------------------------------------------------------
+  @staticmethod
+  def Register(name: AnyStr, types: List[AnyStr], sql: AnyStr):
+    if sql.count("%s") != len(types):
+      raise RuntimeError(f"BUG: statement '{name}' expects {sql.count('%s')} parameters, {len(types)} types given")
+    TBacula.Statements[name] = (types, sql)
+
+  # ------------------------------------------------------------------------------
+  # Prepares all registered statements on the current connection, worth it for long living connections only
+  def PrepareStatements(self):
+    cursor: psycopg2.cursor = self.DBConnection.cursor()
+    for name, (types, sql) in TBacula.Statements.items():
+      parts = sql.split("%s")
+      sql = parts[0] + "".join([f"${i}{part}" for i, part in enumerate(parts[1:], 1)])
+      cursor.execute(f"PREPARE {name}({', '.join(types)}) AS {sql}")
+    cursor.close()
+    self.DBConnection.commit()
+    self.Prepared = True
+
+  # ------------------------------------------------------------------------------
+  # Runs a registered statement through a server side cursor yielding its rows, fetching FetchSize rows per round trip.
+  # Server side cursors cannot execute prepared statements, so the statement is always sent as is.
+  def Stream(self, name: AnyStr, params: typing.Sequence) -> typing.Iterator[tuple]:
+    types, sql = TBacula.Statements[name]
+    if self.Deadline is not None:
+      with self.DBConnection.cursor() as bound: self.bound(bound)
+    cursor: psycopg2.cursor = self.DBConnection.cursor(name=f"{name}_stream")
+    try:
+      with Timer.Stage("query"):
+        cursor.execute(sql, params)
+      with Timer.Stage("fetch"):
+        rows = cursor.fetchmany(TBacula.FetchSize)
+      while len(rows) > 0:
+        yield from rows
+        with Timer.Stage("fetch"):
+          rows = cursor.fetchmany(TBacula.FetchSize)
+    finally:
+      cursor.close()
+
+  # ------------------------------------------------------------------------------
+  # Python codec of the client encoding of the connection, for data not decoded by the driver (COPY)
+  def Codec(self) -> AnyStr:
+    return psycopg2.extensions.encodings.get(self.DBConnection.encoding, "utf-8")
+
+  # ------------------------------------------------------------------------------
+  # Runs a registered statement as COPY ... TO STDOUT, passing its rows as text fields (empty for NULL) to consume() in
+  # batches of FetchSize rows, see TCopyWriter. Unlike Stream() the driver converts no value, callers converting only
+  # the fields of the rows they keep fetch long timeframes at a fraction of the cost.
+  def Copy(self, name: AnyStr, params: typing.Sequence, consume: typing.Callable[[List[List[AnyStr]]], None],
+           tee: Optional[typing.Callable[[bytes], None]] = None):
+    types, sql = TBacula.Statements[name]
+    cursor: psycopg2.cursor = self.DBConnection.cursor()
+    codec = self.Codec()
+    writer = TCopyWriter(consume, TBacula.FetchSize, tee, codec)
+    try:
+      self.bound(cursor)
+      with Timer.Stage("fetch"):
+        # mogrify() encodes the statement with the client encoding, which copy_expert() applies again
+        cursor.copy_expert(f"COPY ({cursor.mogrify(sql, params).decode(codec)}) TO STDOUT WITH (NULL '')", writer)
+        writer.flush()
+    finally:
+      cursor.close()
+
+  # ------------------------------------------------------------------------------
+  def Execute(self, cursor: psycopg2.cursor, name: AnyStr, params: typing.Sequence, stage: AnyStr = "query"):
+    types, sql = TBacula.Statements[name]
+    self.bound(cursor)
+    with Timer.Stage(stage):
+      if self.Prepared:
+        cursor.execute(f"EXECUTE {name}({', '.join(['%s'] * len(types))})", params)
+      else:
+        cursor.execute(sql, params)
+
+
+###############################################################################
+class TJobStatus:
+  StatusDB = {
+    'C': "Created but not yet running",
+    'R': "Running",
+    'B': "Blocked",
+    'T': "Terminated normally",
+    'W': "Terminated normally with warnings",
+    'E': "Terminated in Error",
+    'e': "Non-fatal error",
+    'f': "Fatal error",
+    'D': "Verify Differences",
+    'A': "Canceled by the user",
+    'I': "Incomplete Job",
+    'F': "Waiting on the File daemon",
+    'S': "Waiting on the Storage daemon",
+    'm': "Waiting for a new Volume to be mounted",
+    'M': "Waiting for a Mount",
+    's': "Waiting for Storage resource",
+    'j': "Waiting for Job resource",
+    'c': "Waiting for Client resource",
+    'd': "Wating for Maximum jobs",
+    't': "Waiting for Start Time",
+    'p': "Waiting for higher priority job to finish",
+    'i': "Doing batch insert file records",
+    'a': "SD despooling attributes",
+    'l': "Doing data despooling",
+    'L': "Committing data (last despool)"
+  }
+
+  ShortStatusDB = {
+    'C': "created",
+    'R': "running",
+    'B': "blocked",
+    'T': "OK",
+    'W': "WARN",
+    'E': "ERROR",
+    'e': "non-fatal",
+    'f': "fatal",
+    'D': "verify error",
+    'A': "canceled",
+    'I': "incomplete",
+    'F': "wait FD",
+    'S': "wait SD",
+    'm': "wait new vol",
+    'M': "wait mount",
+    's': "wait storage",
+    'j': "wait job res.",
+    'c': "wait client res.",
+    'd': "wait max jobs",
+    't': "wait start",
+    'p': "wait job",
+    'i': "batch file ins.",
+    'a': "SD despool attr.",
+    'l': "data despool",
+    'L': "commit data"
+  }
+
+  StatusList = [x for x in StatusDB.keys()]
+
+  StatusGroups = {
+    TNagios.SUCCESS : ['T'],
+    TNagios.WARNING : ['W', 'D', 'A'],
+    TNagios.CRITICAL: ['B', 'E', 'e', 'f', 'I'],
+    # We use unkown status for any running status
+    TNagios.UNKNOWN : {'R': TNagios.SUCCESS,
+                       'F': TNagios.WARNING,
+                       'S': TNagios.WARNING,
+                       'm': TNagios.WARNING,
+                       'M': TNagios.WARNING,
+                       's': TNagios.WARNING,
+                       'j': TNagios.WARNING,
+                       'c': TNagios.WARNING,
+                       'i': TNagios.UNKNOWN,
+                       'a': TNagios.UNKNOWN,
+                       'l': TNagios.UNKNOWN,
+                       'L': TNagios.UNKNOWN,
+                       'd': TNagios.WARNING,
+                       'p': TNagios.WARNING},
+    -1              : ['C', 't']  # ignore if just created and not yet run
+  }
+
+  SeverityDB = {status: severity for severity, lst in StatusGroups.items() for status in lst}
+
+  def __init__(self, status: str):
+    if (not isinstance(status, str)) or len(status) != 1:
+      raise RuntimeError(f"expect job status to be single character string, is '{status}'")
+    if status not in TJobStatus.StatusList:
+      raise RuntimeError(f"unknown job status '{status}'")
+    self.Status = sys.intern(status)
+
+  # ------------------------------------------------------------------------------
+  # Returns the shared instance for the given status code, job status objects are immutable
+  @staticmethod
+  def Get(status: str) -> TJobStatus:
+    if status in TJobStatus.Instances: return TJobStatus.Instances[status]
+    return TJobStatus(status)  # Reports the invalid status
+
+  # ------------------------------------------------------------------------------
+  def __str__(self):
+    return TJobStatus.StatusDB[self.Status]
+
+  def GetText(self):
+    return str(self)
+
+  def GetShortText(self):
+    return TJobStatus.ShortStatusDB[self.Status]
+
+  # ------------------------------------------------------------------------------
+  def _is(self, target, norunwarn: bool):
+    if self.Status in TJobStatus.StatusGroups[target]: return True
+    if norunwarn: return False  # We do not translate some runnign status to other status
+    if self.Status not in TJobStatus.StatusGroups[TNagios.UNKNOWN]: return False
+    return TJobStatus.StatusGroups[TNagios.UNKNOWN][self.Status] == target
+
+  # ------------------------------------------------------------------------------
+  def IsSuccess(self, norunwarn: Optional[bool] = None):
+    return self.Status in TJobStatus.SuccessSets[args.norunwarn if norunwarn is None else norunwarn]
+
+  # ------------------------------------------------------------------------------
+  def IsWarning(self, norunwarn: Optional[bool] = None):
+    return self._is(TNagios.WARNING, args.norunwarn if norunwarn is None else norunwarn)
+
+  # ------------------------------------------------------------------------------
+  def IsCritical(self, norunwarn: Optional[bool] = None):
+    return self._is(TNagios.CRITICAL, args.norunwarn if norunwarn is None else norunwarn)
+
+  # ------------------------------------------------------------------------------
+  # Job status codes counted as success, see IsSuccess()
+  @staticmethod
+  def SuccessCodes(norunwarn: bool) -> List[str]:
+    return [s for s in TJobStatus.StatusList if TJobStatus(s)._is(TNagios.SUCCESS, norunwarn)]
+
+  # ------------------------------------------------------------------------------
+  def IsRunning(self):
+    return self._is(TNagios.UNKNOWN, True)
+
+  # ----------------------------------------------------------------------------
+  @property
+  def Severity(self):
+    return self.GetSeverity(args.norunwarn)
+
+  def GetSeverity(self, norunwarn: bool):
+    return TJobStatus.SeverityTables[norunwarn][self.Status]
+
+  def _severity(self, norunwarn: bool):
+    s = TJobStatus.SeverityDB[self.Status]
+    if s == -1: return TNagios.SUCCESS
+    if s != TNagios.UNKNOWN: return s
+    if norunwarn: return TNagios.SUCCESS
+    return TJobStatus.StatusGroups[TNagios.UNKNOWN][self.Status]
+
+  # ------------------------------------------------------------------------------
+  def Check():
+    for s in TJobStatus.StatusList:
+      found = False
+      for g in TJobStatus.StatusGroups.values():
+        if s in g:
+          if found:
+            raise RuntimeError(f"BUG: job status '{s}' found in two different groups")
+          found = True
+      if not found:
+        raise RuntimeError(f"BUG: job status '{s}' was not found in any group")
+
+
+TJobStatus.Check()
+# Precomputed tables: shared instances (see TJobStatus.Get()) as well as success status codes and severities with and
+# without --norunwarn
+TJobStatus.Instances = {s: TJobStatus(s) for s in TJobStatus.StatusList}
+TJobStatus.SuccessSets = {norunwarn: frozenset(TJobStatus.SuccessCodes(norunwarn)) for norunwarn in [False, True]}
+TJobStatus.SeverityTables = {norunwarn: {s: TJobStatus(s)._severity(norunwarn) for s in TJobStatus.StatusList}
+                             for norunwarn in [False, True]}
+
+
+###############################################################################
+# Duration and size history of the successful jobs of one job name and level
+# in columnar arrays, oldest first. Statistics are computed by NumPy if
+# installed, else from the sorted arrays.
+class TJobHistory:
+
+  # Number of previous jobs required for the duration ratio
+  MinBaseline = 3
+  # Perfdata unit and rounding per metric, see TThresholdIndex.JobMetrics
+  Units = {"duration": ("s", 1), "duration p50": ("s", 1), "duration p90": ("s", 1), "duration ratio": (None, 2),
+           "bytes rate": (None, 0), "files rate": (None, 1)}
+  numpy = False  # NumPy module once imported, None if not installed
+
+  def __init__(self, name: AnyStr, level: str):
+    self.Name = name
+    self.Level = level
+    self.Files = array.array('d')
+    self.Bytes = array.array('d')
+    self.Duration = array.array('d')  # Seconds
+
+  # ------------------------------------------------------------------------------
+  def Add(self, files: Optional[int], bytes: Optional[int], duration: float):
+    self.Files.append(files or 0)
+    self.Bytes.append(bytes or 0)
+    self.Duration.append(duration)
+
+  # ------------------------------------------------------------------------------
+  @staticmethod
+  def importNumPy():
+    if TJobHistory.numpy is False:
+      try:
+        import numpy
+        TJobHistory.numpy = numpy
+      except ImportError:
+        TJobHistory.numpy = None
+    return TJobHistory.numpy
+
+  # ------------------------------------------------------------------------------
+  # Linear interpolation between the closest ranks, as numpy.percentile() does by default
+  @staticmethod
+  def percentile(ordered: typing.Sequence[float], p: float) -> float:
+    k = (len(ordered) - 1) * p / 100
+    i = int(k)
+    if i + 1 >= len(ordered): return ordered[-1]
+    return ordered[i] + (ordered[i + 1] - ordered[i]) * (k - i)
+
+  # ------------------------------------------------------------------------------
+  # Returns metric -> value: duration and throughput of the last job, duration percentiles over the history and the
+  # ratio of the last duration to the median duration of the previous jobs
+  def Metrics(self) -> typing.Dict[AnyStr, float]:
+    np = TJobHistory.importNumPy()
+    baseline = None
+    if np is not None:
+      duration = np.frombuffer(self.Duration, dtype=np.float64)
+      p50, p90 = [float(x) for x in np.percentile(duration, [50, 90])]
+      if len(duration) > TJobHistory.MinBaseline: baseline = float(np.median(duration[:-1]))
+    else:
+      ordered = sorted(self.Duration)
+      p50, p90 = TJobHistory.percentile(ordered, 50), TJobHistory.percentile(ordered, 90)
+      if len(ordered) > TJobHistory.MinBaseline: baseline = TJobHistory.percentile(sorted(self.Duration[:-1]), 50)
+
+    last = self.Duration[-1]
+    metrics = {"duration": last, "duration p50": p50, "duration p90": p90}
+    if baseline: metrics["duration ratio"] = last / baseline
+    if last > 0:
+      metrics["bytes rate"] = self.Bytes[-1] / last
+      metrics["files rate"] = self.Files[-1] / last
+    return metrics
+
+  # ------------------------------------------------------------------------------
+  def GetPerfData(self) -> List[TPerfData]:
+    perfData = []
+    for metric, value in self.Metrics().items():
+      unit, digits = TJobHistory.Units[metric]
+      value = round(value, digits)
+      perfData.append(TPerfData(f"{self.Name} {metric}", int(value) if digits == 0 else value, unit))
+    return perfData
+
+
+###############################################################################
+# Last, last successful and last successful full job as well as the number of
+# successful jobs for one job name
+class TJobSummary:
+
+  def __init__(self, name: AnyStr):
+    self.Name = name
+    self.Last: Optional[TJob] = None
+    self.LastSuccess: Optional[TJob] = None
+    self.LastFullSuccess: Optional[TJob] = None
+    self.OKCount = 0
+
+  # ------------------------------------------------------------------------------
+  # Jobs must be added descending by end date (i.e. last job first)
+  def Add(self, job: TJob, norunwarn: bool):
+    if self.Last is None: self.Last = job
+    if job.Status.IsSuccess(norunwarn):
+      self.OKCount += 1
+      if self.LastSuccess is None: self.LastSuccess = job
+      if self.LastFullSuccess is None and job.Level == "F": self.LastFullSuccess = job
+
+  # ------------------------------------------------------------------------------
+  # Merges the summary of the same job name from another catalog
+  def Merge(self, other: TJobSummary):
+    newer = lambda a, b: b is None or (a is not None and TJobSummary.endKey(a) > TJobSummary.endKey(b))
+    if newer(other.Last, self.Last): self.Last = other.Last
+    if newer(other.LastSuccess, self.LastSuccess): self.LastSuccess = other.LastSuccess
+    if newer(other.LastFullSuccess, self.LastFullSuccess): self.LastFullSuccess = other.LastFullSuccess
+    self.OKCount += other.OKCount
+
+  # ------------------------------------------------------------------------------
+  # Sort key by end date, unfinished jobs are the most recent ones (as with ORDER BY realendtime DESC)
+  @staticmethod
+  def endKey(job: TJob):
+    return (job.EndTime is None, datetime.datetime.min if job.EndTime is None else job.EndTime)
+
+  # ------------------------------------------------------------------------------
+  # Same as Add() for a row holding the TClient.JobColumns, creating a TJob only if the row is actually kept
+  def AddRow(self, row, norunwarn: bool, fromRow: typing.Callable[[typing.Sequence], TJob] = None):
+    success = row[3] in TJobStatus.SuccessSets[norunwarn]
+    if success: self.OKCount += 1
+    if self.Last is not None and not success: return
+    if self.Last is not None and self.LastSuccess is not None and (row[2] != "F" or self.LastFullSuccess is not None): return
+
+    job = (fromRow or TJob.FromRow)(row)
+    if self.Last is None: self.Last = job
+    if success:
+      if self.LastSuccess is None: self.LastSuccess = job
+      if self.LastFullSuccess is None and job.Level == "F": self.LastFullSuccess = job
+
+
+###############################################################################
+class TClient:
+
+  # Columns fetched per job, see addJob()
+  JobColumns = ("job.name, job.job, job.level, job.jobstatus, job.jobfiles, job.jobbytes, job.schedtime, job.endtime,"
+                " job.realendtime, job.jobid")
+  # Same layout for bulk fetches, the columns not used by the evaluation (job, schedtime, endtime) are not read
+  PrunedColumns = ("job.name, NULL::text, job.level, job.jobstatus, job.jobfiles, job.jobbytes, NULL::timestamp,"
+                   " NULL::timestamp, job.realendtime, job.jobid")
+  # Number of jobs considered if no job was found in the requested timeframe
+  FallbackJobs = 20
+
+  def __init__(self, bacula: TBacula, clientName: AnyStr, jobName: Optional[AnyStr], nagios: Optional[TNagios] = None,
+               fetch: bool = True, days: Optional[int] = None, norunwarn: Optional[bool] = None,
+               state: Optional[TJobState] = None, ids: Optional[TClientIDCache] = None, history: int = 0,
+               summaryTable: bool = False):
+    self.Bacula = bacula
+    self.ClientName = clientName
+    self.ClientID = None
+    self.JobName = jobName
+    self.Nagios = Nagios if nagios is None else nagios
+    self.Days = int(args.days if days is None else days)
+    self.NoRunWarn = args.norunwarn if norunwarn is None else norunwarn
+    self.Summaries: typing.Dict[AnyStr, TJobSummary] = {}  # Job summary by job name, see GetBackupStatus()
+    self.Fallback = False  # Summaries are from the last jobs as none was found in the requested timeframe
+    self.IDs = ids
+    self.HistoryDays = int(history)  # Job history analysed, 0 for none
+    self.Histories: typing.Dict[typing.Tuple[AnyStr, str], TJobHistory] = {}  # (job name, level) -> history
+    self.HistoryLevels: typing.Dict[AnyStr, str] = {}  # Job name -> level of its last job in the history
+    self.Baseline: Optional[TJobBaseline] = None  # Reported by GetBackupStatus(), see TJobBaseline.Update()
+    if fetch and ids is not None:
+      self.getClient()
+    if fetch and state is not None:
+      self.getIncremental(state)
+    elif fetch and summaryTable:
+      if not self.getSummaryTable(): self.getSummary()
+    elif fetch:
+      self.getSummary()
+    if fetch and self.HistoryDays > 0:
+      self.getHistory()
+
+  # ------------------------------------------------------------------------------
+  # Returns the lowercase client names matching the given name, i.e. the name as given, the name only for FQDNs and the
+  # simple client name with '-fd' suffix
+  @staticmethod
+  def NameVariants(clientName: AnyStr) -> List[AnyStr]:
+    client = clientName.lower()  # Force lowercase
+    clientList = [client]  # Name as given
+    if '.' in client: clientList.append(client.split('.')[0])  # Only name in FQDN
+    # Now the last entry is the simple client name
+    if len(clientList[-1]) > 3 and clientList[-1][-3:] != "-fd": clientList.append(clientList[-1] + "-fd")
+    return clientList
+
+  # ------------------------------------------------------------------------------
+  # Parameters of the statements issued for this client by statement name, the job statements require ClientID
+  def StatementParams(self) -> typing.Dict[AnyStr, tuple]:
+    variants = TClient.NameVariants(self.ClientName)
+    jobName = None if self.JobName is None else self.JobName.lower()
+    return {"check_bacula_client": (variants,),
+            "check_bacula_summary": (variants, self.Days, jobName, jobName, jobName, jobName, TClient.FallbackJobs,
+                                     TJobStatus.SuccessCodes(self.NoRunWarn)),
+            "check_bacula_summary_id": (self.ClientID, self.Days, jobName, jobName, jobName, jobName,
+                                        TClient.FallbackJobs, TJobStatus.SuccessCodes(self.NoRunWarn)),
+            "check_bacula_new_jobs": (self.ClientID, 0, [], self.Days, jobName, jobName),
+            "check_bacula_baseline_jobs": (self.ClientID, 0, [], jobName, jobName),
+            "check_bacula_batch_jobs": ([self.ClientID], self.Days, jobName, jobName),
+            "check_bacula_batch_last_jobs": ([self.ClientID], jobName, jobName, TClient.FallbackJobs),
+            "check_bacula_history": ([self.ClientID], self.HistoryDays, TJobStatus.SuccessCodes(self.NoRunWarn), jobName,
+                                     jobName),
+            # SummaryTableSQL, not registered as the table is optional
+            "check_bacula_summary_table": (self.Days, self.Days, self.Days, self.ClientID, self.Days, jobName, jobName,
+                                           self.Days)}
+
+  # ------------------------------------------------------------------------------
+  def getClient(self):
+    variants = TClient.NameVariants(self.ClientName)
+    clientList = ["'" + x + "'" for x in variants]
+
+    if self.IDs is not None:
+      found = sorted(self.IDs.Lookup(self.Bacula, variants))
+    else:
+      cursor: psycopg2.cursor = self.Bacula.DBConnection.cursor()
+      self.Bacula.Execute(cursor, "check_bacula_client", self.StatementParams()["check_bacula_client"], stage="resolve")
+      found = [row[0] for row in cursor.fetchall()]
+      cursor.close()
+    if len(found) == 0:
+      self.Nagios.ReturnStatus(TNagios.CRITICAL, f"unknown client {','.join(clientList)}")
+    if len(found) != 1:
+      self.Nagios.ReturnStatus(TNagios.WARNING, f"bug: more than one entry found for client {','.join(clientList)}")
+    self.ClientID = found[0]
+
+  # ------------------------------------------------------------------------------
+  # Resolves the client and fetches the job summaries in a single statement, returning only the last, last successful
+  # and last successful full job per job name, instead of all jobs in the requested timeframe. Clients already resolved
+  # (see TClientIDCache) are selected by clientid.
+  def getSummary(self):
+    self.Summaries = {}
+    cursor: psycopg2.cursor = self.Bacula.DBConnection.cursor()
+    variants = TClient.NameVariants(self.ClientName)
+    clientList = ["'" + x + "'" for x in variants]
+
+    name = "check_bacula_summary" if self.ClientID is None else "check_bacula_summary_id"
+    self.Bacula.Execute(cursor, name, self.StatementParams()[name])
+    with Timer.Stage("fetch"):
+      rows = cursor.fetchall()
+    cursor.close()
+    if len(rows) == 0 and self.ClientID is not None:
+      # Client removed since resolved, resolve again by name
+      if self.IDs is not None: self.IDs.Refresh(self.Bacula)
+      self.ClientID = None
+      return self.getSummary()
+    if len(rows) == 0:
+      self.Nagios.ReturnStatus(TNagios.CRITICAL, f"unknown client {','.join(clientList)}")
+    if rows[0][1] != 1:
+      self.Nagios.ReturnStatus(TNagios.WARNING, f"bug: more than one entry found for client {','.join(clientList)}")
+    self.ClientID = rows[0][0]
+    self.Fallback = rows[0][16] is True
+
+    for row in rows:
+      if row[2] is None: continue  # Client without jobs
+      job = TJob.FromRow(row[2:12])
+      summary = self.summary(job.Name)
+      summary.OKCount = row[12]
+      if row[13]: summary.Last = job
+      if row[14]: summary.LastSuccess = job
+      if row[15]: summary.LastFullSuccess = job
+
+  # ------------------------------------------------------------------------------
+  # Refreshes the summary table maintained in the catalog (see check_bacula.summary) and reads the client's job
+  # summaries from it. Returns False if the table cannot be used: not installed, read only replica, no privilege on
+  # it, more days than kept or no job in the requested timeframe (which needs the fallback to the last jobs).
+  def getSummaryTable(self) -> bool:
+    if self.ClientID is None: self.getClient()
+    cnx = self.Bacula.DBConnection
+    cursor: psycopg2.cursor = cnx.cursor()
+    try:
+      self.Bacula.bound(cursor)
+      with Timer.Stage("query"):
+        cursor.execute("SELECT public.check_bacula_summary_refresh()")
+        cnx.commit()
+        cursor.execute(SummaryTableSQL, self.StatementParams()["check_bacula_summary_table"])
+      with Timer.Stage("fetch"):
+        rows = cursor.fetchall()
+    except (psycopg2.errors.UndefinedFunction, psycopg2.errors.UndefinedTable, psycopg2.errors.ReadOnlySqlTransaction,
+            psycopg2.errors.InsufficientPrivilege):
+      cnx.rollback()
+      return False
+    finally:
+      cursor.close()
+    if len(rows) == 0 or any([row[1] is None for row in rows]): return False  # Pruned jobs are left to getSummary()
+
+    self.Summaries = {}
+    jobs = {}  # Share TJob instances, GetBackupStatus() compares them by identity
+    def job(cols):
+      if cols[9] is None: return None
+      if cols[9] not in jobs: jobs[cols[9]] = TJob.FromRow(cols)
+      return jobs[cols[9]]
+
+    width = len(TClient.JobColumns.split(","))
+    for row in rows:
+      cols = row[1:]
+      summary = self.summary(row[0])
+      summary.Last = job(cols[0:width])
+      summary.LastSuccess = job(cols[width:2 * width])
+      summary.LastFullSuccess = job(cols[2 * width:3 * width])
+      summary.OKCount = cols[3 * width]
+    return True
+
+  # ------------------------------------------------------------------------------
+  # Fetches only the jobs added since the last check (or not finished then) and merges them into the persisted state.
+  # Falls back to getSummary() if no job is left in the requested timeframe.
+  def getIncremental(self, state: TJobState):
+    if state.ClientID is None:
+      self.getClient()
+      state.Reset(self.ClientID)
+    self.ClientID = state.ClientID
+
+    cursor: psycopg2.cursor = self.Bacula.DBConnection.cursor()
+    jobName = None if self.JobName is None else self.JobName.lower()
+    self.Bacula.Execute(cursor, "check_bacula_new_jobs", (self.ClientID, state.Watermark, state.Pending, self.Days,
+                                                          jobName, jobName))
+    state.Pending = []  # Jobs purged meanwhile are not returned
+    for row in cursor:
+      state.Add(row, self.NoRunWarn, self.Days)
+    cursor.close()
+    state.Age(self.Days)
+    state.Save()
+
+    self.Summaries = state.Summaries()
+    if len(self.Summaries) == 0: self.getSummary()
+
+  # ------------------------------------------------------------------------------
+  # Successful jobs within the last HistoryDays days, see TJobHistory
+  def getHistory(self):
+    for row in self.Bacula.Stream("check_bacula_history", self.StatementParams()["check_bacula_history"]):
+      self.addHistory(row[1:])
+
+  # ------------------------------------------------------------------------------
+  # Adds a history row: job name, level, files, bytes, duration. Rows are expected ascending by end date.
+  def addHistory(self, row):
+    key = (row[0], row[1])
+    history = self.Histories.get(key)
+    if history is None: history = self.Histories[key] = TJobHistory(row[0], row[1])
+    history.Add(row[2], row[3], row[4])
+    self.HistoryLevels[row[0]] = row[1]
+
+  # ------------------------------------------------------------------------------
+  # Merges the job summaries of the same client found in several catalogs, where the client may have moved between
+  # directors. Last jobs found by fallback only count if no catalog has jobs in the requested timeframe.
+  @staticmethod
+  def Merge(clients: List[TClient]) -> TClient:
+    inTimeframe = [c for c in clients if not c.Fallback]
+    merged = TClient(clients[0].Bacula, clients[0].ClientName, clients[0].JobName, clients[0].Nagios, fetch=False,
+                     days=clients[0].Days, norunwarn=clients[0].NoRunWarn)
+    merged.ClientID = clients[0].ClientID
+    merged.Fallback = len(inTimeframe) == 0
+    for client in clients if merged.Fallback else inTimeframe:
+      for name, summary in client.Summaries.items(): merged.summary(name).Merge(summary)
+    # Histories cannot be interleaved without the end dates, the longest one of each job name and level is taken
+    for client in clients:
+      for key, history in client.Histories.items():
+        if key not in merged.Histories or len(history.Duration) > len(merged.Histories[key].Duration):
+          merged.Histories[key] = history
+          merged.HistoryLevels[key[0]] = client.HistoryLevels[key[0]]
+    return merged
+
+  # ------------------------------------------------------------------------------
+  def summary(self, jobName: AnyStr) -> TJobSummary:
+    if jobName not in self.Summaries: self.Summaries[jobName] = TJobSummary(jobName)
+    return self.Summaries[jobName]
+
+  # ------------------------------------------------------------------------------
+  # Folds a job row holding the TClient.JobColumns into the job summaries, rows are expected to be added descending by
+  # end date. Jobs are not kept, so memory does not grow with the number of jobs. Rows read by COPY are passed with
+  # fromRow=TJob.FromText.
+  def addJob(self, row, fromRow: typing.Callable[[typing.Sequence], TJob] = None):
+    summary = self.Summaries.get(row[0])
+    if summary is None: summary = self.Summaries[row[0]] = TJobSummary(sys.intern(row[0]))
+    summary.AddRow(row, self.NoRunWarn, fromRow)
+
+  # ------------------------------------------------------------------------------
+  def GetBackupStatus(self):
+    Nagios = self.Nagios
+    if len(self.Summaries) == 0:
+      if self.JobName is None:
+        msg = "no backup job found"
+      else:
+        msg = f"backup job '{self.JobName}' was not found"
+      msg = f"{msg} for client '{self.ClientName}'"
+      Nagios.ReturnStatus(TNagios.CRITICAL, msg)
+
+    # List of perfdfata where perfdata[0] is overall job data
+    perfData = [TPerfData(totalPerfLabel, 0)]
+
+    Nagios.SetStatus(TNagios.SUCCESS, "")
+    for jobName in sorted(self.Summaries.keys()):
+      summary = self.Summaries[jobName]
+      perfData.append(TPerfData(f"{jobName} OK", summary.OKCount))
+      Nagios.ShiftStatus(TNagios.SUCCESS, f"{jobName}:", append='; ')
+      last: TJob = summary.Last
+      lastSuccess: TJob = summary.LastSuccess
+      lastFullSuccess: TJob = summary.LastFullSuccess
+      if last is None:
+        # Should never happen
+        Nagios.ShiftStatus(TNagios.CRITICAL, "no backup job found", append=', ')
+        Nagios.ReturnResult()
+      else:
+        if last.Status.GetSeverity(self.NoRunWarn) == TNagios.SUCCESS: perfData[0].Value += 1
+        Nagios.ShiftStatus(last.Status.GetSeverity(self.NoRunWarn),
+                           f"Last(level={last.Level}): {last.Status.GetShortText()} {last.EndTime} ({days(last.EndTime)} days)",
+                           append=' ')
+      if lastSuccess is not None and lastSuccess is not last:
+        if last.Status.IsRunning(): perfData[0].Value += 1
+        Nagios.ShiftStatus(last.Status.GetSeverity(self.NoRunWarn),
+                           f"Last-OK(level={lastSuccess.Level}): {lastSuccess.EndTime} ({days(lastSuccess.EndTime)} days)",
+                           append=', ')
+      if lastFullSuccess is not None and lastFullSuccess is not lastSuccess:
+        Nagios.ShiftStatus(last.Status.GetSeverity(self.NoRunWarn),
+                           f"Last-full-OK: {lastFullSuccess.EndTime} ({days(lastFullSuccess.EndTime)} days)",
+                           append=', ')
+
+    # History metrics, thresholds on these raise the status
+    history = []
+    for jobName in sorted(self.HistoryLevels.keys()):
+      history += self.Histories[(jobName, self.HistoryLevels[jobName])].GetPerfData()
+    if self.Baseline is not None: history += self.Baseline.GetPerfData(sorted(self.Summaries.keys()))
+    Nagios.AddPerf(perfData + history)
+    for p in history:
+      for thr in [p.CritThreshold, p.WarnThreshold]:
+        if thr is not None and thr.Alert(p.Value):
+          Nagios.ShiftStatus(thr.Type, f"{p.Label} {p.Value}{p.Unit or ''} ({thr})", append=', ')
+          break
+
+
+TBacula.Register("check_bacula_client", ["text[]"],
+                 "SELECT client.clientid FROM public.client WHERE lower(client.name) = ANY(%s)")
+# Client resolution, job selection in the requested timeframe with fallback to the last jobs and the per job name
+# summary (see TJobSummary) in one statement. Returns one row per client match without jobs, else up to three rows per
+# job name: clientid, matching clients, TClient.JobColumns, OK count, is last, is last OK, is last full OK, fallback.
+# check_bacula_summary_id does the same for a client given by clientid, see TClientIDCache.
+SummarySQL = (f"WITH client AS ("
+              f"SELECT client.clientid, count(*) OVER () AS matches FROM public.client WHERE {{client}}"
+              f"), selected AS ("
+              f"SELECT {TClient.JobColumns} FROM public.job"
+              f" WHERE job.clientid = (SELECT min(clientid) FROM client) AND job.type = 'B'"
+              f" AND job.realendtime >= CURRENT_DATE - %s * INTERVAL '1 day' AND (%s::text IS NULL OR lower(job.name) = %s)"
+              f"), jobs AS ("
+              f"SELECT * FROM selected UNION ALL (SELECT {TClient.JobColumns} FROM public.job"
+              f" WHERE NOT EXISTS (SELECT 1 FROM selected)"
+              f" AND job.clientid = (SELECT min(clientid) FROM client) AND job.type = 'B'"
+              f" AND (%s::text IS NULL OR lower(job.name) = %s) ORDER BY job.realendtime DESC, job.jobid DESC LIMIT %s)"
+              f"), flagged AS ("
+              f"SELECT jobs.*, jobs.jobstatus = ANY(%s) AS ok FROM jobs"
+              f"), ranked AS ("
+              f"SELECT {TClient.JobColumns.replace('job.', 'flagged.')},"
+              f" count(*) FILTER (WHERE flagged.ok) OVER (PARTITION BY flagged.name) AS okcount,"
+              f" row_number() OVER (PARTITION BY flagged.name"
+              f" ORDER BY flagged.realendtime DESC, flagged.jobid DESC) = 1 AS islast,"
+              f" flagged.ok AND row_number() OVER (PARTITION BY flagged.name, flagged.ok"
+              f" ORDER BY flagged.realendtime DESC, flagged.jobid DESC) = 1 AS isok,"
+              f" flagged.ok AND flagged.level = 'F' AND row_number() OVER (PARTITION BY flagged.name, flagged.ok AND flagged.level = 'F'"
+              f" ORDER BY flagged.realendtime DESC, flagged.jobid DESC) = 1 AS isfull"
+              f" FROM flagged"
+              f") SELECT client.clientid, client.matches, ranked.*, NOT EXISTS (SELECT 1 FROM selected) AS fallback FROM client"
+              f" LEFT JOIN ranked ON ranked.islast OR ranked.isok OR ranked.isfull"
+              f" ORDER BY ranked.name, ranked.realendtime DESC")
+TBacula.Register("check_bacula_summary", ["text[]", "integer", "text", "text", "text", "text", "integer", "char[]"],
+                 SummarySQL.format(client="lower(client.name) = ANY(%s)"))
+TBacula.Register("check_bacula_summary_id", ["integer", "integer", "text", "text", "text", "text", "integer", "char[]"],
+                 SummarySQL.format(client="client.clientid = %s"))
+# Job summaries of a client read from the summary table maintained in the catalog (see check_bacula.summary), one row
+# per job name with jobs in the requested timeframe: job name, then the TClient.JobColumns of the last, last OK and last
+# full OK job (NULL if not in the timeframe) and the OK count. Returns nothing if more days are requested than kept.
+SummaryTableSQL = (f"SELECT s.name,"
+                   f" {TClient.JobColumns.replace('job.', 'l.')},"
+                   f" {TClient.JobColumns.replace('job.', 'o.')},"
+                   f" {TClient.JobColumns.replace('job.', 'f.')},"
+                   f" (SELECT COALESCE(sum(d.okcount), 0)::integer FROM public.check_bacula_summary_days d"
+                   f" WHERE d.clientid = s.clientid AND d.name = s.name AND d.day >= CURRENT_DATE - %s)"
+                   f" FROM public.check_bacula_summary s LEFT JOIN public.job l ON l.jobid = s.lastid"
+                   f" LEFT JOIN public.job o ON o.jobid = s.okid AND s.okend >= CURRENT_DATE - %s * INTERVAL '1 day'"
+                   f" LEFT JOIN public.job f ON f.jobid = s.fullid AND s.fullend >= CURRENT_DATE - %s * INTERVAL '1 day'"
+                   f" WHERE s.clientid = %s AND s.lastend >= CURRENT_DATE - %s * INTERVAL '1 day'"
+                   f" AND (%s::text IS NULL OR lower(s.name) = %s)"
+                   f" AND %s <= (SELECT retention FROM public.check_bacula_summary_state) ORDER BY s.name")
+# Jobs added after the given jobid or given by id (not yet finished when seen before), unless they ended before the
+# requested timeframe. Returns jobid followed by TClient.JobColumns.
+TBacula.Register("check_bacula_new_jobs", ["integer", "integer", "integer[]", "integer", "text", "text"],
+                 f"SELECT job.jobid, {TClient.JobColumns} FROM public.job WHERE job.clientid = %s AND job.type = 'B'"
+                 f" AND (job.jobid > %s OR job.jobid = ANY(%s))"
+                 f" AND (job.realendtime IS NULL OR job.realendtime >= CURRENT_DATE - %s * INTERVAL '1 day')"
+                 f" AND (%s::text IS NULL OR lower(job.name) = %s) ORDER BY job.jobid")
+# Up to the given number of log entries of each of the given jobids for TJobLog, the relevant ones first, then by time:
+# jobid, log text
+TBacula.Register("check_bacula_job_log", ["integer[]", "text", "integer"],
+                 "SELECT l.jobid, l.logtext FROM unnest(%s::integer[]) AS j(jobid)"
+                 " CROSS JOIN LATERAL (SELECT log.jobid, log.logid, log.time, log.logtext, log.logtext ~* %s AS relevant"
+                 " FROM public.log WHERE log.jobid = j.jobid ORDER BY relevant DESC, log.time DESC, log.logid DESC"
+                 " LIMIT %s) l"
+                 " ORDER BY l.jobid, l.relevant DESC, l.time, l.logid")
+# Jobs added after the given jobid or given by id (not yet finished when seen before) for TJobBaseline, ascending by end
+# date: jobid, job name, level, status, files, bytes, run time in seconds, end time, schedule time
+TBacula.Register("check_bacula_baseline_jobs", ["integer", "integer", "integer[]", "text", "text"],
+                 "SELECT job.jobid, job.name, job.level, job.jobstatus, job.jobfiles, job.jobbytes,"
+                 " extract(epoch FROM job.realendtime - job.starttime)::float8, job.realendtime, job.schedtime"
+                 " FROM public.job"
+                 " WHERE job.clientid = %s AND job.type = 'B' AND (job.jobid > %s OR job.jobid = ANY(%s))"
+                 " AND (%s::text IS NULL OR lower(job.name) = %s) ORDER BY job.realendtime NULLS LAST, job.jobid")
+# Successful jobs of the given clients within the given number of days for TJobHistory, ascending by end date:
+# clientid, job name, level, files, bytes, duration in seconds
+TBacula.Register("check_bacula_history", ["integer[]", "integer", "char[]", "text", "text"],
+                 "SELECT job.clientid, job.name, job.level, job.jobfiles, job.jobbytes,"
+                 " extract(epoch FROM job.realendtime - job.starttime)::float8 FROM public.job"
+                 " WHERE job.clientid = ANY(%s) AND job.type = 'B'"
+                 " AND job.realendtime >= CURRENT_DATE - %s * INTERVAL '1 day' AND job.starttime IS NOT NULL"
+                 " AND job.jobstatus = ANY(%s) AND (%s::text IS NULL OR lower(job.name) = %s)"
+                 " ORDER BY job.clientid, job.realendtime, job.jobid")
+
+
+# Batch statements, read by COPY (see TBacula.Copy()): TClient.PrunedColumns followed by the clientid
+TBacula.Register("check_bacula_batch_jobs", ["integer[]", "integer", "text", "text"],
+                 f"SELECT {TClient.PrunedColumns}, job.clientid FROM public.job"
+                 f" WHERE job.clientid = ANY(%s) AND job.type = 'B'"
+                 f" AND job.realendtime >= CURRENT_DATE - %s * INTERVAL '1 day'"
+                 f" AND (%s::text IS NULL OR lower(job.name) = %s) ORDER BY job.clientid, job.realendtime DESC, job.jobid DESC")
+TBacula.Register("check_bacula_batch_last_jobs", ["integer[]", "text", "text", "integer"],
+                 f"SELECT {TClient.PrunedColumns}, c.clientid FROM unnest(%s::integer[]) AS c(clientid)"
+                 f" CROSS JOIN LATERAL (SELECT * FROM public.job WHERE job.clientid = c.clientid AND job.type = 'B'"
+                 f" AND (%s::text IS NULL OR lower(job.name) = %s) ORDER BY job.realendtime DESC, job.jobid DESC LIMIT %s) AS job"
+                 f" ORDER BY c.clientid, job.realendtime DESC, job.jobid DESC")
+
+
+###############################################################################
+# Batch mode: evaluates a set of clients with a single client and job query
+# instead of one connection and two to three queries per client
+class TClientBatch:
+
+  def __init__(self, bacula: Optional[TBacula], clientNames: Optional[List[AnyStr]], jobName: Optional[AnyStr],
+               fetch: bool = True, ids: Optional[TClientIDCache] = None, dump: Optional[TJobDump] = None,
+               history: int = 0):
+    self.Bacula = bacula
+    self.IDs = ids
+    self.ClientNames = clientNames  # None for all clients registered in the catalog
+    self.JobName = jobName
+    self.Clients: typing.Dict[AnyStr, TClient] = {}
+    self.Errors: typing.Dict[AnyStr, typing.Tuple[int, AnyStr]] = {}  # Client name -> (status, message)
+    self.FanOut: Optional[TCatalogFanOut] = None  # Set if merged from several catalogs
+    self.Submitter = None  # TPassiveSubmitter of the results, see check_bacula.passive
+    self.Dump = dump  # Written with the fetched job rows
+    self.HistoryDays = int(history)  # Job history analysed, 0 for none
+    self.JobLog: Optional[TJobLog] = None  # Appends the log of failed jobs to the results
+    if fetch:
+      self.getClients()
+      self.getJobs()
+
+  # ------------------------------------------------------------------------------
+  # Merges the batches fetched from several catalogs by client name, see TClient.Merge()
+  @staticmethod
+  def Merge(batches: List[TClientBatch]) -> TClientBatch:
+    merged = TClientBatch(None, batches[0].ClientNames, batches[0].JobName, fetch=False)
+    clients: typing.Dict[AnyStr, List[TClient]] = {}
+    for batch in batches:
+      for name, client in batch.Clients.items(): clients.setdefault(name, []).append(client)
+    for name, lst in clients.items():
+      merged.Clients[name] = TClient.Merge(lst)
+    for batch in batches:
+      for name, error in batch.Errors.items():
+        if name not in merged.Clients and name not in merged.Errors: merged.Errors[name] = error
+    return merged
+
+  # ------------------------------------------------------------------------------
+  def getClients(self):
+    if self.ClientNames is None:
+      if self.IDs is not None:
+        clients = self.IDs.All(self.Bacula)
+      else:
+        cursor: psycopg2.cursor = self.Bacula.DBConnection.cursor()
+        with Timer.Stage("resolve"):
+          cursor.execute("SELECT client.clientid, client.name FROM public.client ORDER BY client.name")
+        clients = cursor.fetchall()
+        cursor.close()
+      for clientID, name in clients:
+        self.Clients[name] = TClient(self.Bacula, name, self.JobName, fetch=False)
+        self.Clients[name].ClientID = clientID
+      return
+
+    variants = {name: TClient.NameVariants(name) for name in self.ClientNames}
+    ids = {}
+    if self.IDs is None:
+      cursor: psycopg2.cursor = self.Bacula.DBConnection.cursor()
+      with Timer.Stage("resolve"):
+        cursor.execute("SELECT client.clientid, lower(client.name) FROM public.client WHERE lower(client.name) = ANY(%s)",
+                       (sorted({v for lst in variants.values() for v in lst}),))
+      for clientID, name in cursor.fetchall():
+        ids.setdefault(name, set()).add(clientID)
+      cursor.close()
+
+    for name, clientList in variants.items():
+      if self.IDs is not None:
+        found = self.IDs.Lookup(self.Bacula, clientList)
+      else:
+        found = set()
+        for v in clientList: found |= ids.get(v, set())
+      quoted = ','.join(["'" + x + "'" for x in clientList])
+      if len(found) == 0:
+        self.Errors[name] = (TNagios.CRITICAL, f"unknown client {quoted}")
+      elif len(found) != 1:
+        self.Errors[name] = (TNagios.WARNING, f"bug: more than one entry found for client {quoted}")
+      else:
+        self.Clients[name] = TClient(self.Bacula, name, self.JobName, fetch=False)
+        self.Clients[name].ClientID = found.pop()
+
+  # ------------------------------------------------------------------------------
+  # Fetches the jobs by COPY, converting only the fields of the jobs kept by the summaries (see TJob.FromText())
+  def getJobs(self):
+    byID: typing.Dict[int, List[TClient]] = {}
+    for client in self.Clients.values():
+      byID.setdefault(client.ClientID, []).append(client)
+    byText = {str(clientID): clients for clientID, clients in byID.items()}
+
+    def fold(rows):
+      for row in rows:
+        for client in byText[row[10]]: client.addJob(row, TJob.FromText)
+
+    if self.Dump is not None: self.Dump.Open(self)
+    try:
+      jobName = None if self.JobName is None else self.JobName.lower()
+      if len(byID) > 0:
+        self.Bacula.Copy("check_bacula_batch_jobs", (sorted(byID.keys()), int(args.days), jobName, jobName), fold,
+                         None if self.Dump is None else self.Dump.Write)
+
+      # Clients without jobs in the requested timeframe fall back to their last jobs, as check_bacula_summary does
+      ids = sorted([clientID for clientID, clients in byID.items() if len(clients[0].Summaries) == 0])
+      for clientID in ids:
+        for client in byID[clientID]: client.Fallback = True
+      if len(ids) > 0:
+        self.Bacula.Copy("check_bacula_batch_last_jobs", (ids, jobName, jobName, TClient.FallbackJobs), fold,
+                         None if self.Dump is None else self.Dump.Write)
+    except BaseException:
+      if self.Dump is not None: self.Dump.Discard()
+      raise
+    if self.Dump is not None: self.Dump.Close()
+
+    if self.HistoryDays > 0:
+      for row in self.Bacula.Stream("check_bacula_history", (sorted(byID.keys()), self.HistoryDays,
+                                                             TJobStatus.SuccessCodes(args.norunwarn), jobName, jobName)):
+        for client in byID[row[0]]: client.addHistory(row[1:])
+
+  # ------------------------------------------------------------------------------
+  # Evaluates all clients, returns client name -> TNagios result
+  def GetBackupStatus(self, thresholds: List[TThreshold]) -> typing.Dict[AnyStr, TNagios]:
+    results = {}
+    index = TThresholdIndex(thresholds)  # Shared by all clients
+    for name in sorted(list(self.Clients.keys()) + list(self.Errors.keys())):
+      nagios = TNagios(exitOnResult=False)
+      nagios.AddTheshold(thresholds)
+      nagios.ThresholdIndex = index
+      try:
+        if name in self.Errors:
+          nagios.ReturnStatus(*self.Errors[name])
+        client = self.Clients[name]
+        client.Nagios = nagios
+        with Timer.Stage("evaluate"):
+          client.GetBackupStatus()
+      except TNagiosResult:
+        pass
+      if self.FanOut is not None: self.FanOut.ReportErrors(nagios)
+      results[name] = nagios
+    if self.JobLog is not None:
+      for name, client in self.Clients.items():
+        if name not in self.Errors: self.JobLog.Add(client)
+      self.JobLog.Report()
+    return results
+
+  # ------------------------------------------------------------------------------
+  # Returns the overall result (worst client status) followed by one line per client. With a submitter the client
+  # results are submitted as passive check results and the own status only reflects the submission.
+  def ReturnResult(self, thresholds: List[TThreshold]):
+    results = self.GetBackupStatus(thresholds)
+    if self.Submitter is not None:
+      with Timer.Stage("submit"):
+        self.Submitter.Submit(results)
+    counts = {status: 0 for status in TNagios.STATUS.keys()}
+    Nagios.SetStatus(TNagios.SUCCESS, None)
+    for name, result in results.items():
+      counts[result.Status] += 1
+      Nagios.ShiftStatus(result.Status, None)
+      Nagios.LongOutput.append(f"{name}: {result.FormatResult()}")
+      Nagios.LongOutput += [f"{name}: {line}" for line in result.LongOutput]
+    summary = ', '.join([f"{counts[s]} {TNagios.STATUS[s]}" for s in sorted(counts.keys()) if counts[s] > 0])
+    if self.Submitter is None:
+      Nagios.SetStatus(Nagios.Status, f"{len(results)} clients checked: {summary}")
+    elif len(self.Submitter.Errors) > 0:
+      Nagios.SetStatus(TNagios.CRITICAL, f"submission of {len(results)} check results failed: " +
+                       "; ".join(self.Submitter.Errors))
+    else:
+      Nagios.SetStatus(TNagios.SUCCESS, f"{len(results)} check results submitted: {summary}")
+    Nagios.ReturnResult()
+
+
+###############################################################################
+# Queries several Bacula catalogs (one per director) concurrently, bounding the
+# total latency by the per catalog timeout instead of the sum of all catalogs
+class TCatalogFanOut:
+
+  def __init__(self, catalogs: typing.Dict[AnyStr, TBacula], timeout: float):
+    self.Catalogs = catalogs
+    self.Timeout = timeout
+    self.Errors: typing.Dict[AnyStr, AnyStr] = {}  # Catalog name -> error message
+
+  # ------------------------------------------------------------------------------
+  # Runs fetch(bacula) for all catalogs concurrently, returns catalog name -> result of fetch() for the catalogs which
+  # answered in time. Workers are daemon threads, so a catalog hanging beyond its connect and statement timeouts does
+  # not delay the exit.
+  def Run(self, fetch: typing.Callable[[TBacula], typing.Any]) -> typing.Dict[AnyStr, typing.Any]:
+    import concurrent.futures
+    for bacula in self.Catalogs.values():
+      bacula.Nagios = TNagios(exitOnResult=False)  # Connection errors are reported per catalog
+      bacula.ConnectTimeout = max(1, min(bacula.ConnectTimeout, int(self.Timeout)))
+      bacula.StatementTimeout = int(self.Timeout * 1000)
+
+    def work(future: concurrent.futures.Future, bacula: TBacula):
+      try:
+        future.set_result(fetch(bacula))
+      except BaseException as e:
+        future.set_exception(e)
+
+    futures = {}
+    for name, bacula in self.Catalogs.items():
+      future = concurrent.futures.Future()
+      futures[future] = name
+      threading.Thread(target=work, args=(future, bacula), daemon=True).start()
+    done, pending = concurrent.futures.wait(futures.keys(), timeout=self.Timeout)
+
+    results = {}
+    for future, name in futures.items():
+      if future not in done:
+        self.Errors[name] = f"no answer within {self.Timeout}s"
+        continue
+      try:
+        results[name] = future.result()
+      except TNagiosResult as e:
+        self.Errors[name] = e.Nagios.Message
+      except Exception as e:
+        self.Errors[name] = str(e).strip()
+    if len(results) == 0:
+      Nagios.ReturnStatus(TNagios.CRITICAL, "no catalog answered: " + "; ".join([f"{n}: {m}" for n, m in self.Errors.items()]))
+    return results
+
+  # ------------------------------------------------------------------------------
+  # Results are incomplete if a catalog did not answer, at least WARNING and always mentioned
+  def ReportErrors(self, nagios: TNagios):
+    if len(self.Errors) > 0:
+      status = nagios.Status if nagios.Status == TNagios.UNKNOWN else max(nagios.Status, TNagios.WARNING)
+      nagios.SetStatus(status, "; ".join([f"catalog {n}: {m}" for n, m in sorted(self.Errors.items())]), append=', ')
+
+  # ------------------------------------------------------------------------------
+  # Single client check over all catalogs
+  def CheckClient(self, clientName: AnyStr, jobName: Optional[AnyStr], history: int = 0):
+    def fetch(bacula):
+      nagios = TNagios(exitOnResult=False)
+      try:
+        return TClient(bacula, clientName, jobName, nagios, history=history)
+      except TNagiosResult as e:
+        if e.Nagios is not nagios: raise  # Catalog error
+        return nagios  # Client unknown in this catalog
+
+    results = self.Run(fetch)
+    clients = [r for r in results.values() if isinstance(r, TClient)]
+    try:
+      if len(clients) == 0:
+        error = [r for r in results.values()][0]
+        Nagios.SetStatus(error.Status, error.Message)
+      else:
+        client = TClient.Merge(clients)
+        client.Nagios = Nagios
+        Nagios.ExitOnResult = False
+        with Timer.Stage("evaluate"):
+          client.GetBackupStatus()
+    except TNagiosResult:
+      pass
+    Nagios.ExitOnResult = True
+    self.ReportErrors(Nagios)
+    Nagios.ReturnResult()
+
+  # ------------------------------------------------------------------------------
+  # Batch check over all catalogs, see TClientBatch
+  def CheckClients(self, clientNames: Optional[List[AnyStr]], jobName: Optional[AnyStr], thresholds: List[TThreshold],
+                   submitter=None, history: int = 0):
+    batches = self.Run(lambda bacula: TClientBatch(bacula, clientNames, jobName, history=history))
+    merged = TClientBatch.Merge(list(batches.values()))
+    merged.FanOut = self
+    merged.Submitter = submitter
+    merged.ReturnResult(thresholds)
+
+
+###############################################################################
+class TJob:
+  __slots__ = ("JobID", "Name", "JobName", "Level", "Status", "Files", "Bytes", "ScheduledTime", "EndTime")
+
+  def __init__(self, name, jobName, level, status, files, bytes, schedTime, endTime, jobID=None):
+    self.JobID = jobID
+    self.Name = name  # General job name
+    self.JobName = jobName  # Unique scheduled job name
+    self.Level = level
+    self.Status = TJobStatus.Get(status)
+    self.Files = files
+    self.Bytes = bytes
+    self.ScheduledTime = schedTime
+    self.EndTime = endTime
+
+  # ------------------------------------------------------------------------------
+  # Creates the job from a row holding the TClient.JobColumns
+  @staticmethod
+  def FromRow(row) -> TJob:
+    return TJob(sys.intern(row[0]), row[1], sys.intern(row[2]), row[3], row[4], row[5], row[6], row[8], row[9])
+
+  # ------------------------------------------------------------------------------
+  # Same as FromRow() for a row of text fields read by COPY, see TBacula.Copy()
+  @staticmethod
+  def FromText(row) -> TJob:
+    return TJob(sys.intern(row[0]), row[1] or None, sys.intern(row[2]), row[3], int(row[4]) if row[4] else None,
+                int(row[5]) if row[5] else None, parseTimestamp(row[6]), parseTimestamp(row[8]), int(row[9]))
+
+
+#------------------------------------------------------------------------------
+# Parses a timestamp as PostgreSQL prints it (DateStyle ISO), fractions of seconds are not padded to 6 digits
+def parseTimestamp(text: AnyStr) -> Optional[datetime.datetime]:
+  if not text: return None
+  if "." in text:
+    seconds, fraction = text.split(".")
+    text = f"{seconds}.{fraction:0<6}"
+  return datetime.datetime.fromisoformat(text)
+
+
+#------------------------------------------------------------------------------
+# File name for cache and state entries
+def keyDigest(key : typing.Sequence) -> AnyStr:
+  import hashlib
+  return hashlib.sha1(json.dumps(key, default=str).encode()).hexdigest()
+
+
+###############################################################################
+# On-disk result cache shared between plugin processes. Entries expire after
+# the TTL; only one process refreshes an expired entry (file lock) while the
+# others keep returning the stale result. The least recently written entries
+# are evicted when the cache grows over its maximum size.
+class TResultCache:
+
+  def __init__(self, directory: AnyStr, ttl: int, maxSize: int, key: typing.Sequence):
+    self.Directory = directory
+    self.TTL = ttl
+    self.MaxSize = maxSize
+    name = keyDigest(key)
+    self.EntryPath = os.path.join(directory, name + ".json")
+    self.LockPath = os.path.join(directory, name + ".lock")
+
+  # ------------------------------------------------------------------------------
+  # Returns the cached or refreshed result through nagios, check() runs the actual check if needed. Results for which
+  # fresh() returns False (previous results returned at the deadline) are returned but not cached.
+  def Run(self, nagios: TNagios, check: typing.Callable[[], None], fresh: typing.Callable[[], bool] = lambda: True):
+    entry = self.load()
+    if entry is not None and time.time() - entry["time"] < self.TTL:
+      self.restore(nagios, entry)
+
+    try:
+      os.makedirs(self.Directory, exist_ok=True)
+      lock = self.lock(False)
+    except OSError:
+      check()  # Cache not usable, check without
+      nagios.ReturnResult()
+
+    if lock is None:
+      # Another process is refreshing, use the stale entry if any, else wait for the refreshed one
+      if entry is not None: self.restore(nagios, entry)
+      lock = self.lock(True)
+
+    with lock:
+      # Another process may have refreshed the entry since it was read
+      entry = self.load()
+      if entry is not None and time.time() - entry["time"] < self.TTL: self.restore(nagios, entry)
+
+      nagios.ExitOnResult = False
+      try:
+        check()
+      except TNagiosResult:
+        pass
+      nagios.ExitOnResult = True
+      if fresh(): self.store(nagios)
+
+    self.evict()
+    nagios.ReturnResult()
+
+  # ------------------------------------------------------------------------------
+  # Opens and locks the lock file of the entry, returns None if another process holds it and not blocking. Retries if
+  # evict() removed the file meanwhile, as a lock on a removed file excludes no other process.
+  def lock(self, blocking: bool) -> Optional[typing.IO]:
+    while True:
+      lock = open(self.LockPath, "a")
+      try:
+        fcntl.flock(lock, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except BlockingIOError:
+        lock.close()
+        return None
+      try:
+        if os.stat(self.LockPath).st_ino == os.fstat(lock.fileno()).st_ino: return lock
+      except FileNotFoundError:
+        pass
+      lock.close()
+
+  # ------------------------------------------------------------------------------
+  def load(self) -> Optional[typing.Dict[AnyStr, typing.Any]]:
+    try:
+      with open(self.EntryPath) as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return None
+
+  # ------------------------------------------------------------------------------
+  def restore(self, nagios: TNagios, entry: typing.Dict[AnyStr, typing.Any]):
+    nagios.SetStatus(entry["status"], entry["message"])
+    nagios.PerfDataList = [TPerfData.FromDict(p) for p in entry["perfdata"]]
+    nagios.LongOutput = entry["longoutput"]
+    nagios.ReturnResult()
+
+  # ------------------------------------------------------------------------------
+  def store(self, nagios: TNagios):
+    entry = {"time": time.time(),
+             "status": nagios.Status,
+             "message": nagios.Message,
+             "perfdata": [p.ToDict() for p in nagios.PerfDataList],
+             "longoutput": nagios.LongOutput}
+    tmpPath = f"{self.EntryPath}.{os.getpid()}"
+    try:
+      os.makedirs(self.Directory, exist_ok=True)
+      with open(tmpPath, "w") as f:
+        json.dump(entry, f)
+      os.replace(tmpPath, self.EntryPath)
+    except OSError:
+      if os.path.exists(tmpPath): os.unlink(tmpPath)
+
+  # ------------------------------------------------------------------------------
+  def evict(self):
+    try:
+      entries = []
+      with os.scandir(self.Directory) as it:
+        for e in it:
+          if e.name.endswith(".json"): entries.append((e.stat().st_mtime, e.stat().st_size, e.path))
+      size = sum([e[1] for e in entries])
+      for mtime, entrySize, path in sorted(entries):
+        if size <= self.MaxSize: break
+        # The lock file goes with its entry, entries being refreshed are left alone
+        with open(path[:-len(".json")] + ".lock", "a") as lock:
+          try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+          except BlockingIOError:
+            continue
+          try:
+            os.unlink(lock.name)
+            os.unlink(path)
+          except FileNotFoundError:
+            continue  # Evicted by another process meanwhile
+        size -= entrySize
+    except OSError:
+      pass  # Concurrent eviction
+
+
+###############################################################################
+# Client name -> clientid map of a catalog shared between processes
+# (--client-cache). Loaded from public.client with one query and reloaded
+# after the TTL or when a requested name is not found.
+class TClientIDCache:
+
+  def __init__(self, directory: AnyStr, ttl: int, key: typing.Sequence):
+    self.Directory = directory
+    self.TTL = ttl
+    self.Path = os.path.join(directory, f"clients-{keyDigest(key)}.json")
+    self.Time = 0.0
+    self.Clients: List[typing.Tuple[int, AnyStr]] = []  # (clientid, name)
+    self.ByName: typing.Dict[AnyStr, typing.Set[int]] = {}  # Lowercase name -> clientids
+    self.Refreshed = False  # Reloaded from the catalog by this process
+    self.load()
+
+  # ------------------------------------------------------------------------------
+  def load(self):
+    try:
+      with open(self.Path) as f:
+        entry = json.load(f)
+      self.Time = entry["time"]
+      self.Clients = [(clientID, name) for clientID, name in entry["clients"]]
+    except (OSError, ValueError, KeyError, TypeError):
+      self.Time = 0.0
+      self.Clients = []
+    self.index()
+
+  # ------------------------------------------------------------------------------
+  def index(self):
+    self.ByName = {}
+    for clientID, name in self.Clients: self.ByName.setdefault(name.lower(), set()).add(clientID)
+
+  # ------------------------------------------------------------------------------
+  # Reloads the map from the catalog and replaces the shared copy atomically
+  def Refresh(self, bacula: TBacula):
+    cursor: psycopg2.cursor = bacula.DBConnection.cursor()
+    with Timer.Stage("resolve"):
+      cursor.execute("SELECT client.clientid, client.name FROM public.client ORDER BY client.name")
+      self.Clients = cursor.fetchall()
+    cursor.close()
+    self.Time = time.time()
+    self.Refreshed = True
+    self.index()
+
+    tmpPath = f"{self.Path}.{os.getpid()}"
+    try:
+      os.makedirs(self.Directory, exist_ok=True)
+      with open(tmpPath, "w") as f:
+        json.dump({"time": self.Time, "clients": self.Clients}, f)
+      os.replace(tmpPath, self.Path)
+    except OSError:
+      if os.path.exists(tmpPath): os.unlink(tmpPath)
+
+  # ------------------------------------------------------------------------------
+  def expired(self) -> bool:
+    return not self.Refreshed and time.time() - self.Time >= self.TTL
+
+  # ------------------------------------------------------------------------------
+  # Returns the clientids matching any of the given lowercase names, reloading the map once if expired or not found
+  def Lookup(self, bacula: TBacula, variants: List[AnyStr]) -> typing.Set[int]:
+    if self.expired(): self.Refresh(bacula)
+    found = set()
+    for v in variants: found |= self.ByName.get(v, set())
+    if len(found) == 0 and not self.Refreshed:
+      self.Refresh(bacula)
+      for v in variants: found |= self.ByName.get(v, set())
+    return found
+
+  # ------------------------------------------------------------------------------
+  # Returns all (clientid, name) of the catalog
+  def All(self, bacula: TBacula) -> List[typing.Tuple[int, AnyStr]]:
+    if self.expired(): self.Refresh(bacula)
+    return self.Clients
+
+
+###############################################################################
+# Persisted per client job summaries for incremental checks (--state-dir). Holds
+# the highest jobid seen, the jobids of jobs which were still running and per
+# job name the last, last successful and last successful full job as well as
+# the end times of the successful jobs within the requested timeframe.
+class TJobState:
+
+  def __init__(self, directory: AnyStr, key: typing.Sequence):
+    self.Directory = directory
+    self.Path = os.path.join(directory, keyDigest(key) + ".state")
+    self.ClientID: Optional[int] = None
+    self.Watermark = 0  # Highest jobid seen
+    self.Pending: List[int] = []  # Jobs not finished when seen
+    self.Names: typing.Dict[AnyStr, typing.Dict[AnyStr, typing.Any]] = {}
+    self.load()
+
+  # ------------------------------------------------------------------------------
+  def load(self):
+    try:
+      with open(self.Path) as f:
+        state = json.load(f)
+      self.ClientID = state["clientid"]
+      self.Watermark = state["watermark"]
+      self.Pending = state["pending"]
+      self.Names = state["names"]
+    except (OSError, ValueError, KeyError):
+      pass  # Start from scratch
+
+  # ------------------------------------------------------------------------------
+  def Save(self):
+    state = {"clientid": self.ClientID, "watermark": self.Watermark, "pending": self.Pending, "names": self.Names}
+    tmpPath = f"{self.Path}.{os.getpid()}"
+    try:
+      os.makedirs(self.Directory, exist_ok=True)
+      with open(tmpPath, "w") as f:
+        json.dump(state, f)
+      os.replace(tmpPath, self.Path)
+    except OSError:
+      if os.path.exists(tmpPath): os.unlink(tmpPath)
+
+  # ------------------------------------------------------------------------------
+  def Reset(self, clientID: int):
+    self.ClientID = clientID
+    self.Watermark = 0
+    self.Pending = []
+    self.Names = {}
+
+  # ------------------------------------------------------------------------------
+  # Merges a fetched job row (jobid followed by TClient.JobColumns) into the state. Jobs not finished are followed
+  # until they are scheduled before the timeframe (left over by a crashed director), like TJobBaseline.PendingDays.
+  def Add(self, row, norunwarn: bool, days: int):
+    jobID = row[0]
+    self.Watermark = max(self.Watermark, jobID)
+    if row[9] is None:
+      since = datetime.datetime.combine(datetime.date.today() - datetime.timedelta(days=days), datetime.time())
+      if jobID not in self.Pending and (row[7] is None or row[7] >= since): self.Pending.append(jobID)
+      return
+    if jobID in self.Pending: self.Pending.remove(jobID)
+
+    rec = [jobID, row[1], row[2], row[3], row[4], row[5], row[6],
+           None if row[7] is None else row[7].isoformat(), row[9].isoformat()]
+    entry = self.Names.setdefault(row[1], {"last": None, "lastok": None, "lastfull": None, "ok": []})
+    newer = lambda old: old is None or (rec[8], rec[0]) > (old[8], old[0])
+    if newer(entry["last"]): entry["last"] = rec
+    if TJobStatus(row[4]).IsSuccess(norunwarn):
+      entry["ok"].append(rec[8])
+      if newer(entry["lastok"]): entry["lastok"] = rec
+      if row[3] == "F" and newer(entry["lastfull"]): entry["lastfull"] = rec
+
+  # ------------------------------------------------------------------------------
+  # Drops what ended before the start of the timeframe, i.e. CURRENT_DATE - days
+  def Age(self, days: int):
+    since = datetime.datetime.combine(datetime.date.today() - datetime.timedelta(days=days), datetime.time()).isoformat()
+    for name in list(self.Names.keys()):
+      entry = self.Names[name]
+      if entry["last"][8] < since:
+        del self.Names[name]
+        continue
+      for k in ["lastok", "lastfull"]:
+        if entry[k] is not None and entry[k][8] < since: entry[k] = None
+      entry["ok"] = [t for t in entry["ok"] if t >= since]
+
+  # ------------------------------------------------------------------------------
+  def Summaries(self) -> typing.Dict[AnyStr, TJobSummary]:
+    jobs = {}  # Share TJob instances, GetBackupStatus() compares them by identity
+    def job(rec):
+      if rec is None: return None
+      if rec[0] not in jobs:
+        schedTime = None if rec[7] is None else datetime.datetime.fromisoformat(rec[7])
+        jobs[rec[0]] = TJob(rec[1], rec[2], rec[3], rec[4], rec[5], rec[6], schedTime,
+                            datetime.datetime.fromisoformat(rec[8]), rec[0])
+      return jobs[rec[0]]
+
+    summaries = {}
+    for name, entry in self.Names.items():
+      summary = TJobSummary(name)
+      summary.Last = job(entry["last"])
+      summary.LastSuccess = job(entry["lastok"])
+      summary.LastFullSuccess = job(entry["lastfull"])
+      summary.OKCount = len(entry["ok"])
+      summaries[name] = summary
+    return summaries
+
+
+###############################################################################
+# Job rows of a batch run kept in a gzip compressed file (--dump-jobs) for
+# later runs evaluating them without querying the catalog (--jobs-from): a
+# JSON header line with the resolved clients followed by the COPY data of the
+# batch statements, ordered by clientid and end date descending
+class TJobDump:
+
+  # Fast compression, a dump is written on every run
+  CompressLevel = 1
+  # Fields per row, dumps with other rows were written by another version
+  Columns = len(TClient.PrunedColumns.split(",")) + 1
+
+  def __init__(self, path: AnyStr):
+    self.Path = path
+    self._file = None
+    self._tmpPath: Optional[AnyStr] = None
+
+  # ------------------------------------------------------------------------------
+  def Open(self, batch: TClientBatch):
+    import gzip
+    header = {"created": datetime.date.today().isoformat(), "columns": TJobDump.Columns,
+              "encoding": batch.Bacula.Codec(), "days": int(args.days),
+              "job": None if batch.JobName is None else batch.JobName.lower(),
+              "clients": {name: client.ClientID for name, client in batch.Clients.items()}, "errors": batch.Errors}
+    self._tmpPath = f"{self.Path}.{os.getpid()}"
+    try:
+      self._file = gzip.open(self._tmpPath, "wb", compresslevel=TJobDump.CompressLevel)
+      self._file.write((json.dumps(header) + "\n").encode())
+    except OSError as e:
+      self.Discard()
+      Nagios.ReturnStatus(TNagios.UNKNOWN, f"could not write job dump '{self.Path}': {e.strerror}")
+
+  # ------------------------------------------------------------------------------
+  def Write(self, data: bytes):
+    try:
+      self._file.write(data)
+    except OSError as e:
+      self.Discard()
+      Nagios.ReturnStatus(TNagios.UNKNOWN, f"could not write job dump '{self.Path}': {e.strerror}")
+
+  # ------------------------------------------------------------------------------
+  def Close(self):
+    try:
+      self._file.close()
+      os.replace(self._tmpPath, self.Path)
+    except OSError as e:
+      self.Discard()
+      Nagios.ReturnStatus(TNagios.UNKNOWN, f"could not write job dump '{self.Path}': {e.strerror}")
+    self._file = None
+
+  # ------------------------------------------------------------------------------
+  def Discard(self):
+    if self._file is not None:
+      try:
+        self._file.close()
+      except OSError:
+        pass
+    self._file = None
+    if self._tmpPath is not None and os.path.exists(self._tmpPath): os.unlink(self._tmpPath)
+
+  # ------------------------------------------------------------------------------
+  # Evaluates the dumped jobs instead of querying the catalog, for the timeframe of --days counted from today, which
+  # must lie within the dumped timeframe. Clients without jobs in it fall back to their last dumped jobs.
+  def Load(self, batch: TClientBatch):
+    import gzip
+    try:
+      f = gzip.open(self.Path, "rb")
+      header = json.loads(f.readline())
+      created, dumpDays, dumpJob, clientIDs = header["created"], header["days"], header["job"], header["clients"]
+      errors, encoding = header["errors"], header.get("encoding", "utf-8")
+    except (OSError, EOFError, ValueError, KeyError) as e:
+      Nagios.ReturnStatus(TNagios.UNKNOWN, f"could not read job dump '{self.Path}': {e}")
+    if header.get("columns") != TJobDump.Columns:
+      Nagios.ReturnStatus(TNagios.UNKNOWN, f"job dump '{self.Path}' was written by another version, dump the jobs again")
+    since = datetime.date.today() - datetime.timedelta(days=int(args.days))
+    if since < datetime.date.fromisoformat(created) - datetime.timedelta(days=dumpDays):
+      Nagios.ReturnStatus(TNagios.UNKNOWN, f"job dump '{self.Path}' of {created} covers {dumpDays} days only")
+    if dumpJob != (None if batch.JobName is None else batch.JobName.lower()):
+      Nagios.ReturnStatus(TNagios.UNKNOWN, f"job dump '{self.Path}' was written for " +
+                          ("all jobs" if dumpJob is None else f"job '{dumpJob}'"))
+
+    names = sorted(list(clientIDs.keys()) + list(errors.keys())) if batch.ClientNames is None else batch.ClientNames
+    for name in names:
+      if name in errors:
+        batch.Errors[name] = tuple(errors[name])
+      elif name not in clientIDs:
+        batch.Errors[name] = (TNagios.CRITICAL, f"client '{name}' not found in job dump")
+      else:
+        batch.Clients[name] = TClient(None, name, batch.JobName, fetch=False)
+        batch.Clients[name].ClientID = clientIDs[name]
+    byText: typing.Dict[AnyStr, List[TClient]] = {}
+    for client in batch.Clients.values(): byText.setdefault(str(client.ClientID), []).append(client)
+
+    # Rows are compared as text, ISO timestamps sort like their values. Rows before the timeframe (or still running)
+    # are kept up to TClient.FallbackJobs per client.
+    since = since.isoformat()
+    older: typing.Dict[AnyStr, List[List[AnyStr]]] = {}
+    def fold(rows):
+      for row in rows:
+        clients = byText.get(row[10])
+        if clients is None: continue
+        if row[8] >= since:
+          for client in clients: client.addJob(row, TJob.FromText)
+        else:
+          lst = older.setdefault(row[10], [])
+          if len(lst) < TClient.FallbackJobs: lst.append(row)
+
+    with Timer.Stage("fetch"):
+      try:
+        rest = b""
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+          data = rest + chunk
+          end = data.rfind(b"\n") + 1
+          fold(TCopyWriter.Parse(data[:end], encoding))
+          rest = data[end:]
+        f.close()
+      except (OSError, EOFError) as e:
+        Nagios.ReturnStatus(TNagios.UNKNOWN, f"could not read job dump '{self.Path}': {e}")
+
+    for clientID, clients in byText.items():
+      if len(clients[0].Summaries) > 0: continue
+      for client in clients:
+        client.Fallback = True
+        for row in older.get(clientID, []): client.addJob(row, TJob.FromText)
+
+
+###############################################################################
+# Exponentially weighted mean and variance of bytes, files and run time of the
+# successful jobs per job name and level, kept per client in a file and updated
+# from the jobs added since the previous check only, so the cost of a check does
+# not depend on the history behind the baseline. The last job of each job name
+# is reported against the baseline before it, as perfdata with thresholds.
+class TJobBaseline:
+
+  # Weight of a new job, the first 1 / Alpha jobs are weighted evenly
+  Alpha = 0.1
+  # Jobs of a job name and level required for thresholds
+  MinSamples = 5
+  # Minimum half width of the bands relative to the mean, as the values of some jobs hardly vary
+  MinWidth = {TNagios.WARNING: 0.1, TNagios.CRITICAL: 0.2}
+  # Metric -> (perfdata unit, rounding digits)
+  Metrics = {"bytes": ("B", 0), "files": (None, 0), "run time": ("s", 1)}
+  # Jobs not finished this number of days after being scheduled (left over by a crashed director) are no longer followed
+  PendingDays = 7
+
+  def __init__(self, directory: AnyStr, key: typing.Sequence, warn: AnyStr, crit: AnyStr):
+    self.Directory = directory
+    self.Path = os.path.join(directory, keyDigest(key) + ".baseline")
+    self.Bands = {TNagios.WARNING: warn, TNagios.CRITICAL: crit}
+    self.ClientID: Optional[int] = None
+    self.Watermark = 0  # Highest jobid seen
+    self.Pending: List[int] = []  # Jobs not finished when seen
+    # Job name -> level -> {"n": jobs, "stats": {metric: [mean, variance]}, "last": last job and the baseline before it}
+    self.Names: typing.Dict[AnyStr, typing.Dict[str, typing.Dict[AnyStr, typing.Any]]] = {}
+    self.load()
+
+  # ------------------------------------------------------------------------------
+  def load(self):
+    try:
+      with open(self.Path) as f:
+        state = json.load(f)
+      self.ClientID = state["clientid"]
+      self.Watermark = state["watermark"]
+      self.Pending = state["pending"]
+      self.Names = state["names"]
+    except (OSError, ValueError, KeyError):
+      pass  # Start from scratch
+
+  # ------------------------------------------------------------------------------
+  def Save(self):
+    state = {"clientid": self.ClientID, "watermark": self.Watermark, "pending": self.Pending, "names": self.Names}
+    tmpPath = f"{self.Path}.{os.getpid()}"
+    try:
+      os.makedirs(self.Directory, exist_ok=True)
+      with open(tmpPath, "w") as f:
+        json.dump(state, f)
+      os.replace(tmpPath, self.Path)
+    except OSError:
+      if os.path.exists(tmpPath): os.unlink(tmpPath)
+
+  # ------------------------------------------------------------------------------
+  # Fetches the jobs of the client added since the previous update, the first update reads all its jobs
+  def Update(self, client: TClient):
+    if client.ClientID is None: client.getClient()
+    if self.ClientID != client.ClientID:
+      self.ClientID = client.ClientID
+      self.Watermark = 0
+      self.Pending = []
+      self.Names = {}
+    cursor: psycopg2.cursor = client.Bacula.DBConnection.cursor()
+    jobName = None if client.JobName is None else client.JobName.lower()
+    client.Bacula.Execute(cursor, "check_bacula_baseline_jobs", (self.ClientID, self.Watermark, self.Pending, jobName,
+                                                                 jobName))
+    self.Pending = []  # Jobs purged meanwhile are not returned
+    for row in cursor:
+      self.Add(row, client.NoRunWarn)
+    cursor.close()
+    self.Save()
+    client.Baseline = self
+
+  # ------------------------------------------------------------------------------
+  # Adds a row of check_bacula_baseline_jobs, rows are expected ascending by end date
+  def Add(self, row, norunwarn: bool):
+    jobID, name, level, status, files, bytes, runTime, end, scheduled = row
+    self.Watermark = max(self.Watermark, jobID)
+    if end is None:
+      if scheduled is None or datetime.datetime.now() - scheduled < datetime.timedelta(days=TJobBaseline.PendingDays):
+        self.Pending.append(jobID)
+      return
+    if status not in TJobStatus.SuccessSets[norunwarn] or runTime is None: return
+
+    entry = self.Names.setdefault(name, {}).setdefault(level, {"n": 0, "stats": {}})
+    values = {"bytes": bytes or 0, "files": files or 0, "run time": runTime}
+    entry["last"] = {"jobid": jobID, "end": end.isoformat(), "values": values, "n": entry["n"],
+                     "stats": {metric: list(stats) for metric, stats in entry["stats"].items()}}
+    entry["n"] += 1
+    alpha = max(TJobBaseline.Alpha, 1 / entry["n"])
+    for metric, x in values.items():
+      mean, variance = entry["stats"].get(metric, [x, 0.0])
+      diff = x - mean
+      entry["stats"][metric] = [mean + alpha * diff, (1 - alpha) * (variance + alpha * diff * diff)]
+
+  # ------------------------------------------------------------------------------
+  # Threshold of the given type around mean: a number of standard deviations or a percentage of the mean
+  def band(self, type: int, mean: float, variance: float, digits: int) -> TThreshold:
+    spec = self.Bands[type]
+    width = mean * float(spec[:-1]) / 100 if spec.endswith("%") else float(spec) * math.sqrt(variance)
+    width = max(width, mean * TJobBaseline.MinWidth[type])
+    low, high = round(max(0.0, mean - width), digits), round(mean + width, digits)
+    if digits == 0: low, high = int(low), int(high)
+    return TThreshold(type, f"{low}:{high}")
+
+  # ------------------------------------------------------------------------------
+  # Perfdata of the last successful job of the given job names, with thresholds once the baseline before it holds
+  # MinSamples jobs of the same level
+  def GetPerfData(self, jobNames: List[AnyStr]) -> List[TPerfData]:
+    perfData = []
+    for jobName in jobNames:
+      levels = self.Names.get(jobName, {})
+      if len(levels) == 0: continue
+      last = max([entry["last"] for entry in levels.values()], key=lambda last: (last["end"], last["jobid"]))
+      for metric, (unit, digits) in TJobBaseline.Metrics.items():
+        value = round(last["values"][metric], digits)
+        p = TPerfData(f"{jobName} {metric}", int(value) if digits == 0 else value, unit)
+        if last["n"] >= TJobBaseline.MinSamples:
+          mean, variance = last["stats"][metric]
+          p.WarnThreshold = self.band(TNagios.WARNING, mean, variance, digits)
+          p.CritThreshold = self.band(TNagios.CRITICAL, mean, variance, digits)
+        perfData.append(p)
+    return perfData
+
+
+###############################################################################
+# Excerpts of the catalog log of the last job of each job name which did not
+# end successfully, appended as long output of the client. The jobs of all
+# clients are collected first and their log fetched with one query per catalog,
+# checks without failed job do not query the log at all.
+class TJobLog:
+
+  # Log lines matching are taken first
+  Relevant = r"error|fatal|fail|cancel|denied|refused|timeout|warning"
+  # Longer lines are cut
+  MaxLineLength = 200
+
+  def __init__(self, lines: int):
+    self.Lines = lines  # Lines per job
+    self.Jobs: List[typing.Tuple[TClient, TJob]] = []
+
+  # ------------------------------------------------------------------------------
+  # Collects the last jobs of the client which finished unsuccessfully
+  def Add(self, client: TClient):
+    if client.Bacula is None: return  # Jobs read from a dump, merged catalogs
+    for jobName in sorted(client.Summaries.keys()):
+      last = client.Summaries[jobName].Last
+      if last is None or last.JobID is None or last.EndTime is None or last.Status.IsRunning(): continue
+      if last.Status.GetSeverity(client.NoRunWarn) != TNagios.SUCCESS: self.Jobs.append((client, last))
+
+  # ------------------------------------------------------------------------------
+  # Log lines without the '<daemon> JobId <id>: ' prefix, cut to MaxLineLength
+  @staticmethod
+  def split(text: AnyStr) -> List[AnyStr]:
+    lines = []
+    for line in text.splitlines():
+      line = re.sub(r"^\S+ JobId [0-9]+: ", "", line.strip())
+      if len(line) == 0: continue
+      if len(line) > TJobLog.MaxLineLength: line = line[:TJobLog.MaxLineLength - 3] + "..."
+      lines.append(line)
+    return lines
+
+  # ------------------------------------------------------------------------------
+  # Fetches the log of the collected jobs and appends it to the results of their clients
+  def Report(self):
+    byCatalog: typing.Dict[int, List[typing.Tuple[TClient, TJob]]] = {}
+    for client, job in self.Jobs: byCatalog.setdefault(id(client.Bacula), []).append((client, job))
+    for jobs in byCatalog.values():
+      bacula = jobs[0][0].Bacula
+      texts: typing.Dict[int, List[AnyStr]] = {}  # jobid -> log lines, the relevant ones first
+      cursor: psycopg2.cursor = bacula.DBConnection.cursor()
+      bacula.Execute(cursor, "check_bacula_job_log", (sorted({job.JobID for client, job in jobs}), TJobLog.Relevant,
+                                                      self.Lines))
+      with Timer.Stage("fetch"):
+        for jobID, text in cursor:
+          texts.setdefault(jobID, []).extend(TJobLog.split(text))
+      cursor.close()
+      for client, job in jobs:
+        lines = texts.get(job.JobID, [])
+        client.Nagios.LongOutput += [f"{job.Name} log: {line}" for line in lines[:self.Lines]]
+    self.Jobs = []
+
+
+# t1=TThreshold("10")
+# t2=TThreshold("10:")
+# t3=TThreshold("~:10")
+# t4=TThreshold(":10")
+# t5=TThreshold("10:20")
+# t6=TThreshold("@10:20")
+
+#------------------------------------------------------------------------------
+def parseThresholds(type : int, lst : List[typing.Tuple[AnyStr, AnyStr]]):
+  th = []
+  if lst is None: return th
+  for target, thr in lst:
+    if " ".join(target.lower().split()) in [" ".join(x.Target.lower().split()) for x in th]:
+      raise RuntimeError(f"multiple thresholds given for target '{target}'")
+    th.append(TThreshold(type, thr, target, thresholdMapper))
+    for job, metric in th[-1].JobTargets():
+      pattern = TThreshold.TargetPattern(job)
+      try:
+        if pattern is not None: re.compile(pattern)
+      except re.error as e:
+        raise RuntimeError(f"invalid threshold target '{target}': {e}")
+  try:
+    TThresholdIndex(th)  # Fails here rather than at the first perfdata, after querying the catalog
+  except re.error as e:
+    raise RuntimeError(f"invalid threshold targets: {e}")
+  return th
+
+#------------------------------------------------------------------------------
+# Matches '+' to the total and other targets to the '<job name> <metric>' perfdata, see TThresholdIndex
+def thresholdMapper(thr : TThreshold, lbl : AnyStr) -> bool:
+  if thr.Target == '+': return lbl == totalPerfLabel
+  job, metric = TThresholdIndex.SplitJob(lbl)
+  for target, targetMetric in thr.JobTargets():
+    if metric != targetMetric: continue
+    pattern = TThreshold.TargetPattern(target)
+    if pattern is None and job.lower() == target.lower(): return True
+    if pattern is not None and re.match(pattern, job, re.IGNORECASE) is not None: return True
+  return False
+
+#------------------------------------------------------------------------------
+def readClientList(fileName : AnyStr) -> List[AnyStr]:
+  try:
+    f = sys.stdin if fileName == '-' else open(fileName)
+    lines = f.read().splitlines()
+    if f is not sys.stdin: f.close()
+  except OSError as e:
+    Nagios.ReturnStatus(TNagios.UNKNOWN, f"could not read client list '{fileName}': {e.strerror}")
+  clients = [x.split('#')[0].strip() for x in lines]
+  return [x for x in clients if len(x) > 0]
+
+#------------------------------------------------------------------------------
+def checkJobs(bacula : TBacula, ids : Optional[TClientIDCache] = None):
+  state = None
+  if args.state_dir is not None:
+    state = TJobState(args.state_dir, [args.host, args.port, args.db, args.client.lower(),
+                                       None if args.job is None else args.job.lower(), args.days, args.norunwarn])
+  client = TClient(bacula, args.client, args.job, state=state, ids=ids, history=args.history,
+                   summaryTable=args.summary_table)
+  if args.baseline_dir is not None:
+    TJobBaseline(args.baseline_dir, [args.host, args.port, args.db, args.client.lower(),
+                                     None if args.job is None else args.job.lower()],
+                 args.baseline_warn, args.baseline_crit).Update(client)
+  with Timer.Stage("evaluate"):
+    client.GetBackupStatus()
+  if args.job_log > 0:
+    jobLog = TJobLog(args.job_log)
+    jobLog.Add(client)
+    jobLog.Report()
+
+#------------------------------------------------------------------------------
+# Runs the check stages (--check) in turn over the connection of bacula. The job check runs first as it sets the
+# status, a job check ending early (e.g. unknown client) is shifted by the other stages instead of ending the check.
+def checkClient(bacula : TBacula, ids : Optional[TClientIDCache] = None):
+  if args.check == ["jobs"]:
+    checkJobs(bacula, ids)
+    return
+  if "jobs" in args.check:
+    exitOnResult = Nagios.ExitOnResult
+    Nagios.ExitOnResult = False
+    try:
+      checkJobs(bacula, ids)
+    except TNagiosResult:
+      pass
+    finally:
+      Nagios.ExitOnResult = exitOnResult
+  else:
+    Nagios.SetStatus(TNagios.SUCCESS, "")
+  if "volumes" in args.check or "pools" in args.check:
+    from check_bacula.media import TMediaCheck
+    with Timer.Stage("evaluate"):
+      TMediaCheck(bacula, args.pool, "volumes" in args.check, "pools" in args.check).GetStatus(Nagios)
+
+#------------------------------------------------------------------------------
+# Runs check() within the deadline. A check cut short by it answers with the last good result kept in stale and its
+# age, or UNKNOWN without. Results of checks which reached the catalog in time become the last good result.
+def boundedCheck(bacula : TBacula, deadline : TDeadline, stale : Optional[TResultCache], check : typing.Callable[[], None]):
+  exitOnResult = Nagios.ExitOnResult
+  Nagios.ExitOnResult = False
+  try:
+    check()
+  except TNagiosResult:
+    pass
+  except psycopg2.extensions.QueryCanceledError:
+    deadline.Exceeded = True
+  finally:
+    deadline.Stop()
+    Nagios.ExitOnResult = exitOnResult
+
+  if not deadline.Exceeded:
+    if stale is not None and bacula.Connected and Nagios.Status != TNagios.UNKNOWN: stale.store(Nagios)
+    Nagios.ReturnResult()
+
+  entry = None if stale is None else stale.load()
+  Nagios.PerfDataList = []
+  Nagios.LongOutput = []
+  if entry is None:
+    Nagios.ReturnStatus(TNagios.UNKNOWN, f"deadline of {deadline.Seconds:g}s exceeded, no previous result")
+  age = int(time.time() - entry["time"])
+  Nagios.SetStatus(entry["status"], f"deadline of {deadline.Seconds:g}s exceeded, result of {age}s ago: {entry['message']}")
+  Nagios.PerfDataList = [TPerfData.FromDict(p) for p in entry["perfdata"]] + [TPerfData("result age", age, "s")]
+  Nagios.LongOutput = entry["longoutput"]
+  Nagios.ReturnResult()
+
+#------------------------------------------------------------------------------
+# Catalogs given by --catalog and --catalogs-from, catalog name -> TBacula
+def readCatalogs() -> typing.Dict[AnyStr, TBacula]:
+  catalogs = {}
+  for spec in [] if args.catalog is None else args.catalog:
+    m = re.fullmatch(r"(?P<host>[^:/]+)(?:[:](?P<port>[0-9]+))?(?:[/](?P<db>.+))?", spec)
+    if m is None:
+      Nagios.ReturnStatus(TNagios.UNKNOWN, f"invalid catalog '{spec}', expected HOST[:PORT][/DB]")
+    port = args.port if m.group("port") is None else m.group("port")
+    db = args.db if m.group("db") is None else m.group("db")
+    catalogs[spec] = TBacula(f"{m.group('host')}:{port}//{db}", args.dbuser, args.dbpass)
+
+  if args.catalogs_from is not None:
+    import configparser
+    config = configparser.ConfigParser(interpolation=None)
+    try:
+      with open(args.catalogs_from) as f:
+        config.read_file(f)
+    except (OSError, configparser.Error) as e:
+      Nagios.ReturnStatus(TNagios.UNKNOWN, f"could not read catalogs from '{args.catalogs_from}': {e}")
+    for name in config.sections():
+      c = config[name]
+      catalogs[name] = TBacula(f"{c.get('host', args.host)}:{c.get('port', str(args.port))}//{c.get('db', args.db)}",
+                               c.get('user', args.dbuser), c.get('password', args.dbpass))
+  return catalogs
+
+#------------------------------------------------------------------------------
+def main(argv : Optional[List[AnyStr]] = None):
+  global args
+  parser = buildParser()
+  args = checkArgs(parser, parser.parse_args(argv))
+  deadline = None if args.deadline is None else TDeadline(args.deadline)
+
+  # Parsing the thresholds
+  try:
+    warningThresholds  = parseThresholds(TNagios.WARNING, args.warn)
+    criticalThresholds = parseThresholds(TNagios.CRITICAL, args.crit)
+  except RuntimeError as e:
+    Nagios.ReturnStatus(TNagios.UNKNOWN, str(e))
+  Nagios.AddTheshold(warningThresholds)
+  Nagios.AddTheshold(criticalThresholds)
+  if args.timings or args.profile is not None:
+    Timer.Enable(args.timings, args.profile, args.profile_format)
+    Nagios.Timer = Timer
+
+  bacula = TBacula(f"{args.host}:{args.port}//{args.db}", args.dbuser, args.dbpass)
+  TBacula.FetchSize = max(1, args.fetch_size)
+  if not args.listen and args.daemon is None and args.exporter is None: bacula.Deadline = deadline
+  # Writing and listening needs the primary
+  if args.replica is not None and not (args.listen or args.daemon is not None or args.create_indexes or
+                                       args.install_trigger or args.remove_trigger or args.install_summary_table or
+                                       args.remove_summary_table):
+    for spec in args.replica:
+      m = re.fullmatch(r"(?P<host>[^:]+)(?:[:](?P<port>[0-9]+))?", spec)
+      if m is None:
+        Nagios.ReturnStatus(TNagios.UNKNOWN, f"invalid replica '{spec}', expected HOST[:PORT]")
+      bacula.Replicas.append((m.group("host"), bacula.DBPort if m.group("port") is None else int(m.group("port"))))
+    bacula.MaxLag = args.max_lag
+    if args.host_state is not None: bacula.HostState = THostState(args.host_state)
+
+  if args.daemon is not None:
+    from check_bacula.daemon import TBaculaPool, TCheckDaemon
+    TCheckDaemon(args.daemon, TBaculaPool(bacula, args.pool_size), args.pool_size).Run()
+    sys.exit(0)
+
+  if args.install_trigger or args.remove_trigger:
+    from check_bacula.listener import TJobListener
+    TJobListener.SetupTrigger(bacula, args.install_trigger)
+
+  if args.install_summary_table or args.remove_summary_table:
+    from check_bacula.summary import TSummaryTable
+    TSummaryTable.Setup(bacula, args.install_summary_table, args.summary_retention)
+
+  if args.explain or args.advise:
+    from check_bacula.advisor import TQueryAdvisor
+    TQueryAdvisor(bacula, TClient(bacula, args.client, args.job, fetch=False)).ReturnResult(args.advise,
+                                                                                            args.create_indexes)
+
+  ids = None
+  if args.client_cache is not None:
+    ids = TClientIDCache(args.client_cache, args.client_cache_ttl, [args.host, args.port, args.db])
+
+  submitter = None
+  if args.submit_command_file is not None or args.submit_spool_dir is not None or args.submit_url is not None:
+    from check_bacula.passive import TPassiveSubmitter
+    submitter = TPassiveSubmitter(args.submit_host, args.submit_service, args.submit_command_file, args.submit_spool_dir,
+                                  args.submit_url, args.submit_auth)
+
+  if args.listen:
+    from check_bacula.listener import TJobListener
+    clientNames = None if args.all_clients else readClientList(args.clients_from)
+    if args.client is not None and clientNames is not None: clientNames.append(args.client)
+    TJobListener(bacula, clientNames, args.job, warningThresholds + criticalThresholds, args.listen_refresh, submitter,
+                 ids, args.history).Run()
+    sys.exit(0)
+
+  if args.exporter is not None:
+    from check_bacula.exporter import TMetricsExporter
+    m = re.fullmatch(r"(?:(?P<host>[^:]*):)?(?P<port>[0-9]+)", args.exporter)
+    if m is None:
+      Nagios.ReturnStatus(TNagios.UNKNOWN, f"invalid exporter address '{args.exporter}', expected [HOST:]PORT")
+    clientNames = None if args.all_clients else readClientList(args.clients_from)
+    if args.client is not None and clientNames is not None: clientNames.append(args.client)
+    if int(args.history) == 0: args.history = args.days
+    TMetricsExporter(bacula, clientNames, args.job, warningThresholds + criticalThresholds, args.exporter_interval,
+                     ids, args.history).Run((m.group("host") or "", int(m.group("port"))))
+    sys.exit(0)
+
+  catalogs = readCatalogs()
+  if len(catalogs) > 0:
+    fanOut = TCatalogFanOut(catalogs, args.catalog_timeout)
+    if args.clients_from is not None or args.all_clients:
+      clientNames = None if args.all_clients else readClientList(args.clients_from)
+      if args.client is not None and clientNames is not None: clientNames.append(args.client)
+      fanOut.CheckClients(clientNames, args.job, warningThresholds + criticalThresholds, submitter, args.history)
+    fanOut.CheckClient(args.client, args.job, args.history)
+
+  if args.clients_from is not None or args.all_clients:
+    clientNames = None if args.all_clients else readClientList(args.clients_from)
+    if args.client is not None and clientNames is not None: clientNames.append(args.client)
+    if args.jobs_from is not None:
+      batch = TClientBatch(None, clientNames, args.job, fetch=False)
+      TJobDump(args.jobs_from).Load(batch)
+      batch.Submitter = submitter
+      batch.ReturnResult(warningThresholds + criticalThresholds)
+    # The deadline may cancel the job query as well as the queries of the evaluation (--job-log)
+    try:
+      batch = TClientBatch(bacula, clientNames, args.job, ids=ids,
+                           dump=None if args.dump_jobs is None else TJobDump(args.dump_jobs), history=args.history)
+      batch.Submitter = submitter
+      if args.job_log > 0: batch.JobLog = TJobLog(args.job_log)
+      batch.ReturnResult(warningThresholds + criticalThresholds)
+    except psycopg2.extensions.QueryCanceledError:
+      Nagios.ReturnStatus(TNagios.UNKNOWN, f"deadline of {args.deadline:g}s exceeded")
+
+  cacheKey = [args.host, args.port, args.db, None if args.client is None else args.client.lower(),
+              None if args.job is None else args.job.lower(), args.days, args.history,
+              sorted([(thr.Type, thr.Target, str(thr)) for thr in warningThresholds + criticalThresholds]),
+              args.norunwarn, args.baseline_dir, args.baseline_warn, args.baseline_crit, args.check, args.job_log,
+              None if args.pool is None else sorted([name.lower() for name in args.pool])]
+  check = lambda: checkClient(bacula, ids)
+  if deadline is not None:
+    stale = None if args.stale_dir is None else TResultCache(args.stale_dir, 0, args.cache_size * 1024, cacheKey)
+    check = lambda: boundedCheck(bacula, deadline, stale, lambda: checkClient(bacula, ids))
+
+  if args.cache_dir is not None:
+    TResultCache(args.cache_dir, args.cache_ttl, args.cache_size * 1024, cacheKey).Run(
+      Nagios, check, lambda: deadline is None or not deadline.Exceeded)
+
+  check()
+  Nagios.ReturnResult()
+
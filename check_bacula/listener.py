@@ -0,0 +1,156 @@
+# Event driven mode (check_bacula_jobs.py --listen), re-evaluating clients when the catalog notifies job changes, and
+# installer of the notifying trigger (--install-trigger, --remove-trigger), kept apart as not needed for regular checks
+from __future__ import annotations
+import select
+import signal
+import sys
+import time
+import typing
+from typing import AnyStr, List, Optional
+
+from check_bacula import jobs
+from check_bacula.jobs import (Nagios, TBacula, TClientBatch, TClientIDCache, TNagios, TNagiosResult, TThreshold,
+                               importDriver)
+
+
+###############################################################################
+# Keeps one catalog connection listening for job notifications and re-evaluates
+# only the clients whose jobs changed, the results are printed or submitted
+# (see check_bacula.passive) right away
+class TJobListener:
+
+  Channel = "check_bacula_job"
+
+  # Notifies the clientid of backup jobs which are inserted or change their status or end time. Identical
+  # notifications of a transaction are folded by PostgreSQL.
+  TriggerSQL = f"""
+CREATE OR REPLACE FUNCTION public.check_bacula_job_notify() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP = 'UPDATE' AND NEW.jobstatus IS NOT DISTINCT FROM OLD.jobstatus
+     AND NEW.realendtime IS NOT DISTINCT FROM OLD.realendtime THEN
+    RETURN NULL;
+  END IF;
+  PERFORM pg_notify('{Channel}', NEW.clientid::text);
+  RETURN NULL;
+END $$;
+DROP TRIGGER IF EXISTS check_bacula_job_notify ON public.job;
+CREATE TRIGGER check_bacula_job_notify AFTER INSERT OR UPDATE OF jobstatus, realendtime ON public.job
+  FOR EACH ROW WHEN (NEW.type = 'B') EXECUTE PROCEDURE public.check_bacula_job_notify();
+"""
+
+  RemoveSQL = """
+DROP TRIGGER IF EXISTS check_bacula_job_notify ON public.job;
+DROP FUNCTION IF EXISTS public.check_bacula_job_notify();
+"""
+
+  # Seconds notifications are collected after the first one, a job usually changes several times when finishing
+  Delay = 1.0
+
+  # Seconds between reconnection attempts after the catalog connection was lost
+  RetryDelay = 10
+
+  def __init__(self, bacula: TBacula, clientNames: Optional[List[AnyStr]], jobName: Optional[AnyStr],
+               thresholds: List[TThreshold], refresh: int, submitter=None, ids: Optional[TClientIDCache] = None,
+               history: int = 0):
+    self.Bacula = bacula
+    self.ClientNames = clientNames  # None for all clients registered in the catalog
+    self.JobName = jobName
+    self.Thresholds = thresholds
+    self.Refresh = refresh  # Seconds between evaluations of all clients, as job ages change without notifications
+    self.Submitter = submitter
+    self.IDs = ids
+    self.History = history  # Days of job history analysed, 0 for none
+    self.Names: typing.Dict[int, AnyStr] = {}  # clientid -> checked client name
+    self._evaluated = 0.0
+
+  # ------------------------------------------------------------------------------
+  # Runs the trigger installation or removal script, requires the privilege to create triggers on public.job
+  @staticmethod
+  def SetupTrigger(bacula: TBacula, install: bool):
+    cnx = bacula.DBConnection
+    cursor = cnx.cursor()
+    try:
+      cursor.execute(TJobListener.TriggerSQL if install else TJobListener.RemoveSQL)
+      cnx.commit()
+    except jobs.psycopg2.Error as e:
+      Nagios.ReturnStatus(TNagios.CRITICAL, f"could not {'install' if install else 'remove'} the job trigger: "
+                                            f"{str(e).strip()}")
+    finally:
+      cursor.close()
+    if install: Nagios.ReturnStatus(TNagios.SUCCESS, f"job trigger installed, notifying channel '{TJobListener.Channel}'")
+    Nagios.ReturnStatus(TNagios.SUCCESS, "job trigger removed")
+
+  # ------------------------------------------------------------------------------
+  # Evaluates the given clients (all if None) with a single batch query
+  def Evaluate(self, clientNames: Optional[List[AnyStr]]):
+    batch = TClientBatch(self.Bacula, clientNames, self.JobName, ids=self.IDs, history=self.History)
+    results = batch.GetBackupStatus(self.Thresholds)
+    self.Bacula.DBConnection.rollback()  # Notifications are only delivered outside of transactions
+    for name, client in batch.Clients.items(): self.Names[client.ClientID] = name
+    if clientNames is None or clientNames is self.ClientNames: self._evaluated = time.monotonic()
+    self.emit(results)
+
+  # ------------------------------------------------------------------------------
+  def emit(self, results: typing.Dict[AnyStr, TNagios]):
+    if self.Submitter is not None:
+      self.Submitter.Submit(results)
+      for error in self.Submitter.Errors: print(f"submission failed: {error}", file=sys.stderr, flush=True)
+      self.Submitter.Errors.clear()
+      return
+    for name, result in results.items():
+      print("\n".join([f"{name}: {result.FormatResult()}"] + result.LongOutput), flush=True)
+
+  # ------------------------------------------------------------------------------
+  # Waits for notifications until the next full evaluation is due, returns the notified clientids
+  def wait(self) -> typing.Set[int]:
+    cnx = self.Bacula.DBConnection
+    ids = set()
+    burst = None  # End of the collection of the notifications of one burst
+    while True:
+      timeout = (self._evaluated + self.Refresh if burst is None else burst) - time.monotonic()
+      if timeout <= 0: return ids
+      if len(select.select([cnx], [], [], timeout)[0]) > 0:
+        cnx.poll()
+        while len(cnx.notifies) > 0:
+          notify = cnx.notifies.pop(0)
+          if notify.payload.isdigit(): ids.add(int(notify.payload))
+        if burst is None and len(ids) > 0: burst = time.monotonic() + TJobListener.Delay
+
+  # ------------------------------------------------------------------------------
+  def listen(self):
+    cnx = self.Bacula.DBConnection
+    cursor = cnx.cursor()
+    cursor.execute(f"LISTEN {TJobListener.Channel}")
+    cursor.close()
+    cnx.commit()
+    self.Evaluate(self.ClientNames)  # Changes before LISTEN are caught up by the full evaluation
+
+    while True:
+      ids = self.wait()
+      if len(ids) == 0:
+        self.Evaluate(self.ClientNames)
+      elif self.ClientNames is None and len(ids - self.Names.keys()) > 0:
+        self.Evaluate(None)  # New client
+      else:
+        names = sorted({self.Names[clientID] for clientID in ids if clientID in self.Names})
+        if len(names) > 0: self.Evaluate(names)
+
+  # ------------------------------------------------------------------------------
+  # Listens until terminated, reconnecting to the catalog after connection losses
+  def Run(self):
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    importDriver()
+    self.Bacula.Nagios = TNagios(exitOnResult=False)  # Connection errors are retried
+    try:
+      while True:
+        try:
+          self.listen()
+        except TNagiosResult as e:
+          print(e.Nagios.FormatResult(), file=sys.stderr, flush=True)
+        except jobs.psycopg2.OperationalError as e:
+          print(f"catalog connection lost: {str(e).strip()}", file=sys.stderr, flush=True)
+        if self.Bacula._cnx is not None and not self.Bacula._cnx.closed: self.Bacula._cnx.close()
+        self.Bacula._cnx = None
+        time.sleep(TJobListener.RetryDelay)
+    except KeyboardInterrupt:
+      pass
@@ -0,0 +1,98 @@
+# Volume and pool check stages (check_bacula_jobs.py --check volumes,pools), run after the job check over the same
+# catalog connection, kept apart as they are not needed for regular checks
+from __future__ import annotations
+import typing
+from typing import AnyStr, List, Optional
+
+from check_bacula.jobs import TBacula, TNagios, TPerfData, TThreshold
+
+
+###############################################################################
+# Checks the backup pools and their volumes with one statement: pool usage
+# against the maximum number of volumes, volumes left to write to and volumes
+# in error. Results are shifted into the status of the check, perfdata labels
+# are 'pool <name> <metric>' and take thresholds like job perfdata.
+class TMediaCheck:
+
+  # Volume states which can be written to
+  UsableStates = ["Append", "Recycle", "Purged"]
+
+  # Thresholds of pools without threshold given: percent of the maximum number of volumes used, volumes in error
+  DefaultThresholds = {"used": (TThreshold(TNagios.WARNING, "80"), TThreshold(TNagios.CRITICAL, "95")),
+                       "error volumes": (TThreshold(TNagios.WARNING, "0"), None)}
+
+  def __init__(self, bacula: TBacula, poolNames: Optional[List[AnyStr]], volumes: bool, pools: bool):
+    self.Bacula = bacula
+    self.PoolNames = None if poolNames is None else [name.lower() for name in poolNames]  # None for all backup pools
+    self.Volumes = volumes
+    self.Pools = pools
+    # Rows of check_bacula_pools
+    self.Rows: List[typing.Tuple] = []
+
+  # ------------------------------------------------------------------------------
+  def fetch(self):
+    cursor = self.Bacula.DBConnection.cursor()
+    self.Bacula.Execute(cursor, "check_bacula_pools", (TMediaCheck.UsableStates, self.PoolNames, self.PoolNames))
+    self.Rows = cursor.fetchall()
+    cursor.close()
+
+  # ------------------------------------------------------------------------------
+  # Perfdata of one pool row, with the thresholds of the check or the default ones
+  def perfData(self, nagios: TNagios, row: typing.Tuple) -> List[TPerfData]:
+    name, numVols, maxVols, volumes, usable, errors, bytes = row
+    perfData = []
+    if self.Pools:
+      perfData.append(TPerfData(f"pool {name} volumes", numVols, min=0, max=maxVols or None))
+      if maxVols > 0: perfData.append(TPerfData(f"pool {name} used", round(100 * numVols / maxVols, 1), "%"))
+    if self.Volumes:
+      perfData += [TPerfData(f"pool {name} usable volumes", usable), TPerfData(f"pool {name} error volumes", errors),
+                   TPerfData(f"pool {name} bytes", int(bytes), "B")]
+    nagios.AddPerf(perfData)
+    for p in perfData:
+      warn, crit = TMediaCheck.DefaultThresholds.get(p.Label[len(f"pool {name} "):], (None, None))
+      if p.WarnThreshold is None and p.CritThreshold is None:
+        p.WarnThreshold, p.CritThreshold = warn, crit
+    return perfData
+
+  # ------------------------------------------------------------------------------
+  # Shifts the status of the pools into nagios, the pools without problems are counted, the others listed
+  def GetStatus(self, nagios: TNagios):
+    self.fetch()
+    if len(self.Rows) == 0:
+      nagios.ShiftStatus(TNagios.WARNING, "no backup pool found" if self.PoolNames is None else
+                         f"backup pool {','.join(self.PoolNames)} not found", append='; ')
+      return
+
+    okCount = 0
+    for row in self.Rows:
+      name, numVols, maxVols, volumes, usable, errors, bytes = row
+      status = TNagios.SUCCESS
+      problems = []
+      for p in self.perfData(nagios, row):
+        for thr in [p.CritThreshold, p.WarnThreshold]:
+          if thr is not None and thr.Alert(p.Value):
+            status = max(status, thr.Type)
+            problems.append(f"{p.Label[len(f'pool {name} '):]} {p.Value}{p.Unit or ''} ({thr})")
+            break
+      # A pool which cannot create volumes any more and has none left to write to blocks the next job
+      if self.Volumes and usable == 0 and 0 < maxVols <= numVols:
+        status = TNagios.CRITICAL
+        problems.append("no usable volume")
+      nagios.LongOutput.append(f"pool {name}: {numVols}{'' if maxVols == 0 else f' of {maxVols}'} volumes, "
+                               f"{usable} usable, {errors} in error")
+      if status == TNagios.SUCCESS:
+        okCount += 1
+      else:
+        nagios.ShiftStatus(status, f"pool {name}: {', '.join(problems)}", append='; ')
+    if okCount > 0: nagios.ShiftStatus(TNagios.SUCCESS, f"{okCount} pools OK", append='; ')
+
+
+# One row per backup pool: name, volumes, maximum volumes (0 for no limit), volumes in the catalog, usable volumes,
+# volumes in error, bytes on the volumes
+TBacula.Register("check_bacula_pools", ["text[]", "text[]", "text[]"],
+                 "SELECT pool.name, pool.numvols, pool.maxvols, count(media.mediaid),"
+                 " count(media.mediaid) FILTER (WHERE media.volstatus = ANY(%s) AND media.enabled = 1),"
+                 " count(media.mediaid) FILTER (WHERE media.volstatus = 'Error'), coalesce(sum(media.volbytes), 0)"
+                 " FROM public.pool LEFT JOIN public.media ON media.poolid = pool.poolid"
+                 " WHERE pool.pooltype = 'Backup' AND (%s::text[] IS NULL OR lower(pool.name) = ANY(%s))"
+                 " GROUP BY pool.poolid, pool.name, pool.numvols, pool.maxvols ORDER BY pool.name")
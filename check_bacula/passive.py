@@ -0,0 +1,131 @@
+# Passive check result submission for batch mode (--submit-command-file, --submit-spool-dir, --submit-url), kept apart
+# as it is not needed for regular checks
+from __future__ import annotations
+import base64
+import json
+import os
+import stat
+import tempfile
+import time
+import typing
+from typing import AnyStr, List, Optional
+
+from check_bacula.jobs import TNagios
+
+
+###############################################################################
+# Submits the results of a batch run as passive service check results, to the
+# Nagios / Icinga external command file (or FIFO), the check result spool
+# directory or the Icinga 2 REST API
+class TPassiveSubmitter:
+
+  # Writes to a FIFO up to this size are not interleaved with other writers
+  PipeBuffer = 4096
+
+  def __init__(self, hostFormat: AnyStr, service: AnyStr, commandFile: Optional[AnyStr] = None,
+               spoolDir: Optional[AnyStr] = None, url: Optional[AnyStr] = None, auth: Optional[AnyStr] = None,
+               timeout: float = 10):
+    self.HostFormat = hostFormat
+    self.Service = service
+    self.CommandFile = commandFile
+    self.SpoolDir = spoolDir
+    self.URL = url
+    self.Auth = auth  # USER:PASSWORD for the REST API
+    self.Timeout = timeout
+    self.Errors: List[AnyStr] = []
+
+  # ------------------------------------------------------------------------------
+  # Nagios host name of a client, the format may use {client} and {host} (client name without '-fd' suffix)
+  def HostName(self, client: AnyStr) -> AnyStr:
+    host = client[:-3] if client.lower().endswith("-fd") else client
+    return self.HostFormat.format(client=client, host=host)
+
+  # ------------------------------------------------------------------------------
+  # Plugin output as single line, long output lines are escaped as Nagios expects them in external commands
+  @staticmethod
+  def Output(result: TNagios) -> AnyStr:
+    return "\\n".join([result.FormatResult()] + result.LongOutput).replace("\n", "\\n")
+
+  # ------------------------------------------------------------------------------
+  # Submits all results, returns the number of submissions which failed (see Errors)
+  def Submit(self, results: typing.Dict[AnyStr, TNagios]) -> int:
+    now = int(time.time())
+    if self.CommandFile is not None: self.writeCommandFile(results, now)
+    if self.SpoolDir is not None: self.writeSpoolFile(results, now)
+    if self.URL is not None: self.post(results)
+    return len(self.Errors)
+
+  # ------------------------------------------------------------------------------
+  # One PROCESS_SERVICE_CHECK_RESULT line per result, written in chunks of whole lines which are not interleaved with
+  # other writers on a FIFO. Opening a FIFO without reader fails instead of blocking.
+  def writeCommandFile(self, results: typing.Dict[AnyStr, TNagios], now: int):
+    lines = [f"[{now}] PROCESS_SERVICE_CHECK_RESULT;{self.HostName(name)};{self.Service};{result.Status};"
+             f"{TPassiveSubmitter.Output(result)}\n" for name, result in results.items()]
+    try:
+      fd = os.open(self.CommandFile, os.O_WRONLY | os.O_APPEND | os.O_NONBLOCK)
+    except OSError as e:
+      self.Errors.append(f"could not open command file '{self.CommandFile}': {e.strerror}")
+      return
+    try:
+      os.set_blocking(fd, True)
+      fifo = stat.S_ISFIFO(os.fstat(fd).st_mode)
+      chunk = ""
+      for line in lines:
+        if fifo and len(chunk) > 0 and len((chunk + line).encode()) > TPassiveSubmitter.PipeBuffer:
+          os.write(fd, chunk.encode())
+          chunk = ""
+        chunk += line
+      if len(chunk) > 0: os.write(fd, chunk.encode())
+    except OSError as e:
+      self.Errors.append(f"could not write command file '{self.CommandFile}': {e.strerror}")
+    finally:
+      os.close(fd)
+
+  # ------------------------------------------------------------------------------
+  # One check result file holding all results, picked up by Nagios once the '.ok' file exists
+  def writeSpoolFile(self, results: typing.Dict[AnyStr, TNagios], now: int):
+    text = f"### Passive Check Result File ###\nfile_time={now}\n\n"
+    for name, result in results.items():
+      text += (f"### Nagios Service Check Result ###\n# Time: {time.ctime(now)}\n"
+               f"host_name={self.HostName(name)}\nservice_description={self.Service}\n"
+               f"check_type=1\ncheck_options=0\nscheduled_check=0\nreschedule_check=0\nlatency=0\n"
+               f"start_time={now}.0\nfinish_time={now}.0\nearly_timeout=0\nexited_ok=1\n"
+               f"return_code={result.Status}\noutput={TPassiveSubmitter.Output(result)}\n\n")
+    try:
+      fd, path = tempfile.mkstemp(prefix="c", dir=self.SpoolDir)
+      with os.fdopen(fd, "w") as f:
+        f.write(text)
+      open(path + ".ok", "w").close()
+    except OSError as e:
+      self.Errors.append(f"could not write check result file to '{self.SpoolDir}': {e.strerror}")
+
+  # ------------------------------------------------------------------------------
+  # Icinga 2 API action process-check-result, one request per result over a single connection
+  def post(self, results: typing.Dict[AnyStr, TNagios]):
+    import http.client
+    import urllib.parse
+    url = urllib.parse.urlsplit(self.URL)
+    if url.scheme == "https":
+      import ssl
+      cnx = http.client.HTTPSConnection(url.hostname, url.port, timeout=self.Timeout,
+                                        context=ssl.create_default_context())
+    else:
+      cnx = http.client.HTTPConnection(url.hostname, url.port, timeout=self.Timeout)
+    headers = {"Accept": "application/json", "Content-Type": "application/json"}
+    if self.Auth is not None: headers["Authorization"] = "Basic " + base64.b64encode(self.Auth.encode()).decode()
+
+    try:
+      for name, result in results.items():
+        body = {"type": "Service", "service": f"{self.HostName(name)}!{self.Service}", "exit_status": result.Status,
+                "plugin_output": result.FormatResult().split("|")[0],
+                "performance_data": [str(p) for p in result.PerfDataList], "check_source": "check_bacula_jobs"}
+        if len(result.LongOutput) > 0: body["plugin_output"] += "\n" + "\n".join(result.LongOutput)
+        cnx.request("POST", url.path or "/", json.dumps(body), headers)
+        response = cnx.getresponse()
+        response.read()
+        if response.status >= 300:
+          self.Errors.append(f"{name}: {response.status} {response.reason}")
+    except (OSError, http.client.HTTPException) as e:
+      self.Errors.append(f"could not post to '{self.URL}': {e}")
+    finally:
+      cnx.close()
@@ -0,0 +1,138 @@
+# Installer of the job summary table maintained in the catalog (check_bacula_jobs.py --install-summary-table,
+# --remove-summary-table), kept apart as it is not needed for regular checks
+from __future__ import annotations
+
+from check_bacula import jobs
+from check_bacula.jobs import Nagios, TBacula, TJobStatus, TNagios
+
+
+###############################################################################
+# Summary of the finished backup jobs per client and job name kept in the
+# catalog: last, last successful and last successful full job, as well as the
+# successful jobs per day. Refreshed by check_bacula_summary_refresh() from the
+# jobs above a watermark (plus those not finished when seen), read by TClient
+# with --summary-table.
+class TSummaryTable:
+
+  # The refresh function runs with the privileges of the installing user, checks only need EXECUTE on it and SELECT on
+  # the tables. Concurrent refreshes are excluded by an advisory lock, each statement of the function then sees the
+  # state left by the previous refresh. A check finding the lock taken skips the refresh instead of waiting for it and
+  # reads the table as left by the last refresh, so checks never queue behind each other. Refreshes without new or
+  # finished jobs write nothing. Jobs not finished PendingDays after being scheduled (left over by a crashed director)
+  # are no longer followed, as every refresh fetches the followed jobs again.
+  PendingDays = 7
+
+  InstallSQL = """
+CREATE TABLE IF NOT EXISTS public.check_bacula_summary (
+  clientid integer NOT NULL, name text NOT NULL,
+  lastid integer NOT NULL, lastend timestamp without time zone NOT NULL,
+  okid integer, okend timestamp without time zone,
+  fullid integer, fullend timestamp without time zone,
+  PRIMARY KEY (clientid, name));
+CREATE TABLE IF NOT EXISTS public.check_bacula_summary_days (
+  clientid integer NOT NULL, name text NOT NULL, day date NOT NULL, okcount integer NOT NULL,
+  PRIMARY KEY (clientid, name, day));
+CREATE TABLE IF NOT EXISTS public.check_bacula_summary_state (
+  id boolean PRIMARY KEY DEFAULT true CHECK (id), watermark integer NOT NULL DEFAULT 0,
+  pending integer[] NOT NULL DEFAULT '{{}}', retention integer NOT NULL, pruned date NOT NULL DEFAULT CURRENT_DATE);
+INSERT INTO public.check_bacula_summary_state (retention) VALUES ({retention})
+  ON CONFLICT (id) DO UPDATE SET retention = EXCLUDED.retention;
+
+CREATE OR REPLACE FUNCTION public.check_bacula_summary_refresh() RETURNS integer LANGUAGE plpgsql
+  SECURITY DEFINER SET search_path = public, pg_temp AS $$
+DECLARE
+  jobCount integer;
+  lastID integer;
+  pendingIDs integer[];
+BEGIN
+  IF NOT pg_try_advisory_xact_lock(hashtext('check_bacula_summary_refresh')) THEN
+    RETURN 0;
+  END IF;
+  -- Most refreshes find no new or finished job, which is answered without planning the refresh statement
+  SELECT watermark, pending INTO lastID, pendingIDs FROM check_bacula_summary_state;
+  IF NOT EXISTS (SELECT 1 FROM job WHERE jobid > lastID)
+     AND NOT EXISTS (SELECT 1 FROM job WHERE jobid = ANY(pendingIDs) AND realendtime IS NOT NULL) THEN
+    RETURN 0;
+  END IF;
+  WITH state AS (
+    SELECT * FROM check_bacula_summary_state
+  ), fetched AS (
+    SELECT job.jobid, job.clientid, job.name, job.level, job.jobstatus = ANY('{success}'::char[]) AS ok, job.realendtime,
+      job.schedtime
+    FROM job, state WHERE job.type = 'B' AND (job.jobid > state.watermark OR job.jobid = ANY(state.pending))
+  ), finished AS (
+    SELECT * FROM fetched WHERE realendtime IS NOT NULL
+  ), lastjob AS (
+    SELECT DISTINCT ON (clientid, name) clientid, name, jobid, realendtime FROM finished
+    ORDER BY clientid, name, realendtime DESC, jobid DESC
+  ), okjob AS (
+    SELECT DISTINCT ON (clientid, name) clientid, name, jobid, realendtime FROM finished WHERE ok
+    ORDER BY clientid, name, realendtime DESC, jobid DESC
+  ), fulljob AS (
+    SELECT DISTINCT ON (clientid, name) clientid, name, jobid, realendtime FROM finished WHERE ok AND level = 'F'
+    ORDER BY clientid, name, realendtime DESC, jobid DESC
+  ), summary AS (
+    INSERT INTO check_bacula_summary AS s
+    SELECT l.clientid, l.name, l.jobid, l.realendtime, o.jobid, o.realendtime, f.jobid, f.realendtime
+    FROM lastjob l LEFT JOIN okjob o USING (clientid, name) LEFT JOIN fulljob f USING (clientid, name)
+    ON CONFLICT (clientid, name) DO UPDATE SET
+      lastid = CASE WHEN (EXCLUDED.lastend, EXCLUDED.lastid) > (s.lastend, s.lastid) THEN EXCLUDED.lastid ELSE s.lastid END,
+      lastend = GREATEST(EXCLUDED.lastend, s.lastend),
+      okid = CASE WHEN EXCLUDED.okid IS NOT NULL AND (s.okid IS NULL OR (EXCLUDED.okend, EXCLUDED.okid) > (s.okend, s.okid))
+                  THEN EXCLUDED.okid ELSE s.okid END,
+      okend = CASE WHEN s.okend IS NULL THEN EXCLUDED.okend ELSE GREATEST(EXCLUDED.okend, s.okend) END,
+      fullid = CASE WHEN EXCLUDED.fullid IS NOT NULL AND (s.fullid IS NULL OR (EXCLUDED.fullend, EXCLUDED.fullid) > (s.fullend, s.fullid))
+                    THEN EXCLUDED.fullid ELSE s.fullid END,
+      fullend = CASE WHEN s.fullend IS NULL THEN EXCLUDED.fullend ELSE GREATEST(EXCLUDED.fullend, s.fullend) END
+  ), days AS (
+    INSERT INTO check_bacula_summary_days AS d
+    SELECT clientid, name, realendtime::date, count(*) FROM finished WHERE ok GROUP BY 1, 2, 3
+    ON CONFLICT (clientid, name, day) DO UPDATE SET okcount = d.okcount + EXCLUDED.okcount
+  ), updated AS (
+    UPDATE check_bacula_summary_state u SET watermark = n.watermark, pending = n.pending
+    FROM (SELECT GREATEST(state.watermark, (SELECT max(jobid) FROM fetched)) AS watermark,
+            ARRAY(SELECT jobid FROM fetched WHERE realendtime IS NULL
+                  AND (schedtime IS NULL OR schedtime >= now() - INTERVAL '{pending} days') ORDER BY jobid) AS pending
+          FROM state) n
+    WHERE (u.watermark, u.pending) IS DISTINCT FROM (n.watermark, n.pending)
+  )
+  SELECT count(*) INTO jobCount FROM fetched;
+
+  -- Daily counts are pruned once a day
+  IF (SELECT pruned FROM check_bacula_summary_state) < CURRENT_DATE THEN
+    DELETE FROM check_bacula_summary_days WHERE day < CURRENT_DATE - (SELECT retention FROM check_bacula_summary_state);
+    UPDATE check_bacula_summary_state SET pruned = CURRENT_DATE;
+  END IF;
+  RETURN jobCount;
+END $$;
+"""
+
+  RemoveSQL = """
+DROP FUNCTION IF EXISTS public.check_bacula_summary_refresh();
+DROP TABLE IF EXISTS public.check_bacula_summary, public.check_bacula_summary_days, public.check_bacula_summary_state;
+"""
+
+  # ------------------------------------------------------------------------------
+  # Creates (or updates) the tables and the refresh function and runs the first refresh, which summarizes all jobs of
+  # the catalog, or drops them. Requires the privilege to create tables in the catalog.
+  @staticmethod
+  def Setup(bacula: TBacula, install: bool, retention: int):
+    cnx = bacula.DBConnection
+    cursor = cnx.cursor()
+    try:
+      if install:
+        cursor.execute(TSummaryTable.InstallSQL.format(retention=int(retention), pending=TSummaryTable.PendingDays,
+                                                       success=f"{{{','.join(TJobStatus.SuccessCodes(False))}}}"))
+        cursor.execute("SELECT public.check_bacula_summary_refresh()")
+        fetched = cursor.fetchone()[0]
+        cursor.execute("ANALYZE public.check_bacula_summary, public.check_bacula_summary_days")
+      else:
+        cursor.execute(TSummaryTable.RemoveSQL)
+      cnx.commit()
+    except jobs.psycopg2.Error as e:
+      Nagios.ReturnStatus(TNagios.CRITICAL, f"could not {'install' if install else 'remove'} the summary table: "
+                                            f"{str(e).strip()}")
+    finally:
+      cursor.close()
+    if install: Nagios.ReturnStatus(TNagios.SUCCESS, f"summary table installed, {fetched} jobs summarized")
+    Nagios.ReturnStatus(TNagios.SUCCESS, "summary table removed")
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+# Client for the resident check daemon (check_bacula_jobs.py --daemon SOCKET). Takes the same check options as
+# check_bacula_jobs.py, forwards them over the daemon's Unix domain socket and returns the result as Nagios plugin.
+# The socket is given by --socket (must be the first option) or the CHECK_BACULA_SOCKET environment variable.
+import json
+import os
+import socket
+import sys
+
+DEFAULT_SOCKET = "/run/check_bacula_jobs/check_bacula_jobs.sock"
+TIMEOUT = 30
+UNKNOWN = 3
+
+argv = sys.argv[1:]
+socketPath = os.environ.get("CHECK_BACULA_SOCKET", DEFAULT_SOCKET)
+if len(argv) >= 2 and argv[0] == "--socket":
+  socketPath = argv[1]
+  argv = argv[2:]
+
+try:
+  with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+    s.settimeout(TIMEOUT)
+    s.connect(socketPath)
+    s.sendall((json.dumps({"argv": argv}) + "\n").encode())
+    with s.makefile("rb") as f:
+      response = json.loads(f.readline())
+  print(response["output"])
+  sys.exit(int(response["status"]))
+except (OSError, ValueError, KeyError, TypeError) as e:
+  print(f"UNKNOWN - check daemon at '{socketPath}' failed: {e}")
+  sys.exit(UNKNOWN)